@@ -1,30 +1,44 @@
 from __future__ import annotations
 
 import json
+import os
+import sqlite3
+import tempfile
+import threading
 import time
-from contextlib import closing
+from concurrent.futures import wait
+from functools import partial
+from itertools import islice
 from http.client import RemoteDisconnected
 from math import ceil
-from typing import Any, Generator
+from typing import Any, Generator, Iterator
 from urllib.error import HTTPError, URLError
-from urllib.parse import quote_plus
-from urllib.request import Request, urlopen
+from urllib.parse import quote, quote_plus
 
 _LAST_ALL_MIRRORS_DOWN_TIME: float = 0.0
+# Seconds between mirror discovery runs triggered by every mirror failing
+_DISCOVERY_RETRY = 600
 
 try:
     from calibre import browser  # pyright: ignore[reportMissingImports]
+    from calibre.constants import DEBUG  # pyright: ignore[reportMissingImports]
     from calibre.gui2 import open_url  # pyright: ignore[reportMissingImports]
     from calibre.gui2.store import StorePlugin  # pyright: ignore[reportMissingImports]
     from calibre.gui2.store.search_result import SearchResult  # pyright: ignore[reportMissingImports]
     from calibre.gui2.store.web_store_dialog import WebStoreDialog  # pyright: ignore[reportMissingImports]
 except ImportError:
     # Mocks for linting/type checking when calibre is not installed
+    DEBUG = False
+
     def browser() -> Any: ...
     def open_url(url: Any) -> None: ...
 
     class StorePlugin:
-        def __init__(self, gui: Any, name: str, config: Any = None, base_plugin: Any = None) -> None: ...
+        def __init__(self, gui: Any, name: str, config: Any = None, base_plugin: Any = None) -> None:
+            self.gui = gui
+            self.name = name
+            self.base_plugin = base_plugin
+            self.config = config if config is not None else {}
 
     class SearchResult:
         DRM_UNLOCKED: str = "unlocked"
@@ -46,8 +60,39 @@ except ImportError:
         def exec(self) -> None: ...
 
 
-from calibre_plugins.store_annas_archive.constants import DEFAULT_MIRRORS, RESULTS_PER_PAGE, SearchOption
-from lxml import html
+from calibre_plugins.store_annas_archive.cancellation import Cancelled, CancelToken
+from calibre_plugins.store_annas_archive.constants import (
+    DEFAULT_MIRROR_SOURCES,
+    DEFAULT_MIRRORS,
+    RESULTS_PER_PAGE,
+    SearchOption,
+)
+from calibre_plugins.store_annas_archive.discovery import MirrorDiscovery, merge_mirrors, normalize_mirror
+from calibre_plugins.store_annas_archive.downloader import SegmentedDownloader
+from calibre_plugins.store_annas_archive.events import EventLog
+from calibre_plugins.store_annas_archive.fanout import merge_ranked
+from calibre_plugins.store_annas_archive.httpcache import CachingBrowser, ResponseCache
+from calibre_plugins.store_annas_archive.identifiers import IdentifierCache, classify
+from calibre_plugins.store_annas_archive.library import LibraryIndex
+from calibre_plugins.store_annas_archive.parsing import (
+    Parser,
+    parse_download_links,
+    parse_md5_links,
+    parse_md5_page,
+    parse_search_rows,
+)
+from calibre_plugins.store_annas_archive.prefetch import Prefetcher
+from calibre_plugins.store_annas_archive.profiling import Tracer, profile_mode
+from calibre_plugins.store_annas_archive.proxies import ProxiedBrowser, ProxyPool
+from calibre_plugins.store_annas_archive.ratelimit import THROTTLED, RateLimitedBrowser, RateLimiter
+from calibre_plugins.store_annas_archive.records import ResultRecord
+from calibre_plugins.store_annas_archive.resolvers import ResolverRegistry
+from calibre_plugins.store_annas_archive.resultcache import LOCAL_FILTERS, Filters, ResultCache, matches
+from calibre_plugins.store_annas_archive.sharedcache import SharedCache
+from calibre_plugins.store_annas_archive.singleflight import SingleFlight, canonical_url
+from calibre_plugins.store_annas_archive.transfer import CompressingBrowser, TransferStats, compressing_opener
+from calibre_plugins.store_annas_archive.verification import LinkVerifier
+from calibre_plugins.store_annas_archive.warmup import preconnect
 
 try:
     from qt.core import QUrl
@@ -60,103 +105,400 @@ except (ImportError, ModuleNotFoundError):
 SearchResults = Generator[SearchResult, None, None]
 
 
+def _plugin_config_dir(name: str) -> str:
+    try:
+        from calibre.constants import config_dir  # pyright: ignore[reportMissingImports]
+    except ImportError:
+        config_dir = tempfile.gettempdir()
+    return os.path.join(config_dir, "plugins", "store_annas_archive", name)
+
+
 class AnnasArchiveStore(StorePlugin):
     def __init__(self, gui: Any, name: str, config: dict[str, Any] | None = None, base_plugin: Any = None) -> None:
         super().__init__(gui, name, config, base_plugin)
+        # What went wrong recently, shown in the settings instead of printed, unless calibre runs in debug mode
+        self.events = EventLog(self.config.get("events", {}).get("capacity", 500), echo=DEBUG)
+        # Forks the parse workers, if any, so it has to come before anything that starts a thread
+        self.parser = Parser(self._parse_processes(), events=self.events)
         self.working_mirror = None
+        self.rate_limiter = RateLimiter()
+        self._configure_rate_limiter()
+        self.proxies = ProxyPool(events=self.events)
+        self._configure_proxies()
+        self._urlopen = self.proxies.urlopen(self.rate_limiter.call)
+        # Bytes on the wire versus decoded, for pages and API calls. Book files are fetched as they are,
+        # the segmented downloader depends on their raw offsets and they don't compress anyway.
+        self.transfer_stats = TransferStats()
+        self._api_urlopen = self.proxies.urlopen(self._call_compressed)
+        self.link_verifier = LinkVerifier(opener=self._urlopen)
+        self._flights = SingleFlight()
+        self.resolvers = ResolverRegistry()
+        self.resolvers.configure(self.config.get("resolvers", {}))
+        cache_opts = self.config.get("cache", {})
+        self.shared_cache = self._open_shared_cache(cache_opts)
+        self.identifier_cache = IdentifierCache(shared=self.shared_cache)
+        self.response_cache = (
+            ResponseCache(self.shared_cache or self._memory_cache(cache_opts)) if cache_opts.get("http", True) else None
+        )
+        self.result_cache = (
+            ResultCache(ttl=cache_opts.get("results_ttl", 600), shared=self.shared_cache, record_type=ResultRecord)
+            if cache_opts.get("results", True)
+            else None
+        )
+        self.tracer = Tracer(
+            _plugin_config_dir("profiles"), profile_mode(self.config.get("profile", False)), events=self.events
+        )
+        self.library_index = LibraryIndex(self.events)
+        self.prefetcher = Prefetcher(self.config.get("prefetch", {}).get("workers", 2))
+        # Seconds the last successful request to each mirror took, persisted so a restart starts warm
+        self.mirror_latency: dict[str, float] = {}
+        if self.shared_cache is not None:
+            self.working_mirror = self.shared_cache.get("mirrors", "working")
+            self.mirror_latency = self.shared_cache.get("mirrors", "latency") or {}
+        self._persisted_latency = dict(self.mirror_latency)
+        # Mirrors the last discovery run found dead, tried after all others
+        self.dead_mirrors: set[str] = set()
+        if self.shared_cache is not None:
+            self.dead_mirrors = set(self.shared_cache.get("mirrors", "dead") or ())
+        self.discovery = MirrorDiscovery(self._api_urlopen, events=self.events)
+        self._discovery_lock = threading.Lock()
+        self._last_discovery = 0.0
+        # Through proxies, a direct connection to the mirror warms nothing that requests use
+        if self.config.get("preconnect", True) and not len(self.proxies):
+            threading.Thread(target=self._warm_up, name="AnnasArchiveWarmUp", daemon=True).start()
+        threading.Thread(target=self._discover_mirrors, name="AnnasArchiveDiscovery", daemon=True).start()
+
+    def _open_shared_cache(self, cache_opts: dict[str, Any]) -> SharedCache | None:
+        # One database for every calibre process on the host: GUI, calibre-server and batch jobs
+        if not cache_opts.get("shared", True):
+            return None
+        try:
+            return SharedCache(
+                _plugin_config_dir("cache.sqlite"), cache_opts.get("max_size", 100) * 1024 * 1024, events=self.events
+            )
+        except (sqlite3.Error, OSError) as e:
+            self.events.record("cache", e, f"Failed to open the shared cache, caching in memory only: {e}")
+            return None
 
-    def _search(self, url: str, max_results: int, timeout: int) -> SearchResults:
+    @staticmethod
+    def _memory_cache(cache_opts: dict[str, Any]) -> SharedCache:
+        # The same store in a private in-memory database, for when there is no shared one
+        return SharedCache(":memory:", cache_opts.get("max_size", 100) * 1024 * 1024)
+
+    def _parse_processes(self) -> int:
+        # Worker processes only pay off in batch runs, the GUI always parses in-process
+        if self.gui is not None:
+            return 0
+        env = os.environ.get("ANNAS_ARCHIVE_PARSE_PROCESSES", "")
+        return int(env) if env.isdigit() else self.config.get("parse_processes", 0)
+
+    def _configure_rate_limiter(self) -> None:
+        rate_opts = self.config.get("rate_limit", {})
+        self.rate_limiter.rate = rate_opts.get("rate", 2.0)
+        self.rate_limiter.burst = rate_opts.get("burst", 4)
+        self.rate_limiter.hosts = {host: tuple(limits) for host, limits in rate_opts.get("hosts", {}).items()}
+        self.rate_limiter.reset()
+
+    def _configure_proxies(self) -> None:
+        proxy_opts = self.config.get("proxies", {})
+        self.proxies.max_failures = proxy_opts.get("max_failures", 3)
+        self.proxies.cooldown = proxy_opts.get("cooldown", 60)
+        self.proxies.configure(proxy_opts.get("urls", []), proxy_opts.get("strategy", "round_robin"))
+
+    def _call_compressed(self, opener: Any, request: Any, *args: Any, **kwargs: Any) -> Any:
+        return self.rate_limiter.call(compressing_opener(opener, self.transfer_stats), request, *args, **kwargs)
+
+    def _library_db(self) -> Any:
+        if self.gui is not None:
+            return self.gui.current_db.new_api
+        # Batch runs name the library to check against
+        path = self.config.get("library", {}).get("path")
+        if not path:
+            return None
+        if self.library_index.db is None:
+            from calibre.library import db  # pyright: ignore[reportMissingImports]
+
+            return db(path).new_api
+        return self.library_index.db
+
+    def _check_library(
+        self, records: Iterator[ResultRecord], looked_up: dict[str, tuple[str, str]] | None = None
+    ) -> Iterator[tuple[ResultRecord, int | None]]:
+        """
+        Pair the results with the id of the same book in the calibre library, dropping them if they should be hidden.
+
+        ``looked_up`` maps the md5 of records found by an identifier query to that identifier, which
+        the library is checked for too. Every other result is matched on its md5 and title + author only.
+        """
+        library_opts = self.config.get("library", {})
+        mode = library_opts.get("mode", "off")
+        db = self._library_db() if mode != "off" else None
+        if db is None:
+            yield from ((record, None) for record in records)
+            return
+        self.library_index.attach(db)
+        # Only the first search after calibre starts has to wait for the index
+        if not self.library_index.wait(library_opts.get("wait", 10)):
+            yield from ((record, None) for record in records)
+            return
+
+        for record in records:
+            identifiers = [("md5", record.md5)]
+            if looked_up and record.md5 in looked_up:
+                identifiers.append(looked_up[record.md5])
+            library_id = self.library_index.match(record.title, record.author, identifiers)
+            if library_id is not None and mode == "hide":
+                continue
+            yield record, library_id
+
+    def _browser(self, token: CancelToken) -> Any:
+        br = CompressingBrowser(browser(), self.transfer_stats)
+        if self.response_cache is not None:
+            br = CachingBrowser(br, self.response_cache)
+        br = RateLimitedBrowser(
+            br, self.rate_limiter, self.config.get("rate_limit", {}).get("max_wait", 30), token=token
+        )
+        return ProxiedBrowser(br, self.proxies)
+
+    def _fetch_from_mirrors(self, url: str, token: CancelToken, br: Any) -> bytes:
         global _LAST_ALL_MIRRORS_DOWN_TIME
-        if self.config.get("circuit_breaker", False) and (time.time() - _LAST_ALL_MIRRORS_DOWN_TIME < 300):
+        down_since = _LAST_ALL_MIRRORS_DOWN_TIME
+        if self.shared_cache is not None:
+            # Another calibre process may already know which mirror works, or that none do
+            self.working_mirror = self.shared_cache.get("mirrors", "working") or self.working_mirror
+            down_since = max(down_since, self.shared_cache.get("mirrors", "all_down") or 0)
+        if self.config.get("circuit_breaker", False) and (time.time() - down_since < 300):
             raise Exception("All of your Anna's Archive mirrors are down. Circuit breaker active for 5 minutes.")
 
-        br = browser()
-        doc: Any = None
-        counter = max_results
-
-        for page in range(1, ceil(max_results / RESULTS_PER_PAGE) + 1):
-            mirrors = list(self.config.get("mirrors", DEFAULT_MIRRORS))
-            if self.working_mirror and self.working_mirror in mirrors:
-                mirrors.remove(self.working_mirror)
-                mirrors.insert(0, self.working_mirror)
-            for mirror in mirrors:
-                try:
-                    with closing(br.open(url.format(base=mirror, page=page), timeout=timeout)) as resp:
-                        if resp.code < 500 or resp.code > 599:
-                            self.working_mirror = mirror
-                            content = resp.read()
-                            doc = html.fromstring(content)
-                            break
-                except Exception as e:
-                    # Try next mirror
-                    print(f"Failed to connect to {mirror}: {e}")
-                    pass
-            if doc is None:
-                self.working_mirror = None
-                if self.config.get("circuit_breaker", False):
-                    _LAST_ALL_MIRRORS_DOWN_TIME = time.time()
-                raise Exception(
-                    "All of your Anna's Archive mirrors are unreachable. Please check your internet connection or update the mirror list in the plugin configuration (Preferences -> Plugins -> Get books -> Anna's Archive -> Customize)."
+        throttled = False
+        for mirror in self._mirror_order():
+            token.check()
+            start = time.monotonic()
+            try:
+                with self.tracer.span("fetch", mirror=mirror), token.open(br, url.format(base=mirror)) as resp:
+                    if resp.code in THROTTLED:
+                        throttled = True
+                    elif resp.code < 500 or resp.code > 599:
+                        content = resp.read()
+                        self._set_working_mirror(mirror, time.monotonic() - start)
+                        return content
+            except HTTPError as e:
+                if e.code == 404:
+                    # The mirror is fine, the page just doesn't exist
+                    self._set_working_mirror(mirror)
+                    raise
+                throttled = throttled or e.code in THROTTLED
+                self.events.record(
+                    "fetch", e, mirror=mirror, url=url.format(base=mirror), duration=time.monotonic() - start
+                )
+            except Cancelled:
+                raise
+            except Exception as e:
+                if token.cancelled:
+                    # The response was closed under us, that says nothing about the mirror
+                    raise Cancelled("Cancelled") from e
+                # Try next mirror
+                self.events.record(
+                    "fetch", e, mirror=mirror, url=url.format(base=mirror), duration=time.monotonic() - start
                 )
 
-            # New layout uses divs, not table rows
-            books: list[Any] = doc.xpath('//a[contains(@class, "js-vim-focus")]')
-            if not books:
-                # Fallback or empty result
-                pass
-
-            for book in books:
-                if counter <= 0:
-                    break
-
-                # The anchor with 'js-vim-focus' is inside a td, which is inside a tr
-                # Structure: tr > td > a.js-vim-focus
-                try:
-                    tr = book.getparent().getparent()
-                except AttributeError:
-                    continue
-
-                s = SearchResult()
-                s.detail_item = book.get("href", "").split("/")[-1]
-                if not s.detail_item:
-                    continue
-
-                try:
-                    # Title is in the 2nd td (index 1)
-                    # Use xpath to find all text within the cell to be safe
-                    s.title = "".join(tr.xpath("./td[2]//text()")).strip()
-
-                    # Author is in the 3rd td (index 2)
-                    s.author = "".join(tr.xpath("./td[3]//text()")).strip()
-                    if not s.author:
-                        s.author = "Unknown"
-
-                    # Format is in the 10th td (index 9)
-                    # "pdf", "epub", etc.
-                    s.formats = "".join(tr.xpath("./td[10]//text()")).strip().upper()
-                    if not s.formats:
-                        s.formats = "UNKNOWN"
-
-                    # Cover image
-                    # In the 1st td (index 0), inside a hidden div that appears on hover/focus
-                    # <div id="hover_cover..."><img src="..."></div>
-                    cover_src = tr.xpath("./td[1]//img/@src")
-                    # The first img might be the small cover or the large hover one.
-                    # Usually there are two images in the first td.
-                    s.cover_url = cover_src[0] if cover_src else ""
-
-                except IndexError:
-                    # If table structure is different (e.g. mobile view or change), fail gracefully for this item
-                    continue
-
-                s.price = "$0.00"
-                s.drm = SearchResult.DRM_UNLOCKED
-
-                counter -= 1
-                yield s
+        if throttled:
+            # The mirrors are up, they just want us to slow down, so the working mirror stays
+            raise Exception("Anna's Archive is rate limiting searches. Please wait a little and try again.")
+        self._set_working_mirror(None)
+        # The mirrors may have moved, look for new ones for the next search
+        threading.Thread(target=self._discover_mirrors, args=(True,), name="AnnasArchiveDiscovery", daemon=True).start()
+        if self.config.get("circuit_breaker", False):
+            _LAST_ALL_MIRRORS_DOWN_TIME = time.time()
+            if self.shared_cache is not None:
+                self.shared_cache.put("mirrors", "all_down", _LAST_ALL_MIRRORS_DOWN_TIME, ttl=300)
+        raise Exception(
+            "All of your Anna's Archive mirrors are unreachable. Please check your internet connection or update the mirror list in the plugin configuration (Preferences -> Plugins -> Get books -> Anna's Archive -> Customize)."
+        )
+
+    def _mirror_order(self) -> list[str]:
+        # The working mirror first, then the rest as configured and the ones found dead last. Only the mirrors
+        # discovery added, which the user hasn't ordered, go by how fast they answered before.
+        found = set(self.config.get("discovery", {}).get("found", ()))
+        mirrors = sorted(
+            self.config.get("mirrors", DEFAULT_MIRRORS),
+            key=lambda m: (
+                m in self.dead_mirrors,
+                m in found,
+                self.mirror_latency.get(m, float("inf")) if m in found else 0.0,
+            ),
+        )
+        if self.working_mirror and self.working_mirror in mirrors:
+            mirrors.remove(self.working_mirror)
+            mirrors.insert(0, self.working_mirror)
+        return mirrors
+
+    def _set_working_mirror(self, mirror: str | None, latency: float | None = None) -> None:
+        if self.shared_cache is not None and mirror != self.working_mirror:
+            self.shared_cache.put("mirrors", "working", mirror)
+        self.working_mirror = mirror
+        self.dead_mirrors.discard(mirror)
+        if mirror is None or latency is None:
+            return
+        previous = self.mirror_latency.get(mirror)
+        self.mirror_latency[mirror] = latency if previous is None else 0.7 * previous + 0.3 * latency
+        persisted = self._persisted_latency.get(mirror)
+        latency = self.mirror_latency[mirror]
+        # Only write when the latency moved noticeably, not after every request
+        if self.shared_cache is not None and (persisted is None or abs(persisted - latency) > 0.2 * persisted):
+            self._persisted_latency = dict(self.mirror_latency)
+            self.shared_cache.put("mirrors", "latency", self._persisted_latency)
+
+    def _warm_up(self) -> None:
+        """
+        Resolve and connect to the mirror the first search will use, in the background at plugin load.
+
+        The connection is thrown away and calibre's browser makes its own, so the gain is the DNS
+        lookup, where the system caches those, and, if the last working mirror is gone, finding the
+        next reachable one before the user searches instead of during the search.
+        """
+        initial = self.working_mirror
+        for mirror in self._mirror_order()[:3]:
+            try:
+                preconnect(mirror, timeout=5)
+            except OSError as e:
+                self.events.record("preconnect", e, mirror=mirror)
+                continue
+            # Unless a search has found a working mirror in the meantime
+            if self.working_mirror == initial:
+                self.working_mirror = mirror
+            return
+
+    def _discover_mirrors(self, urgent: bool = False) -> None:
+        """
+        Probe the configured mirrors and look for new ones, in the background.
+
+        Candidates come from the ``discovery.sources`` mirror lists and from the links on the working
+        mirror's front page. Live new mirrors are appended to the configured list fastest first, dead ones
+        are tried last until they work again. This runs at most once per ``discovery.interval`` seconds across
+        all calibre processes, or after 10 minutes when every mirror just failed (``urgent``).
+        """
+        opts = self.config.get("discovery", {})
+        if not opts.get("enabled", True) or not self._discovery_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.time()
+            last = self._last_discovery
+            if self.shared_cache is not None:
+                last = max(last, self.shared_cache.get("mirrors", "discovered_at") or 0)
+            interval = opts.get("interval", 86400)
+            if now - last < (min(interval, _DISCOVERY_RETRY) if urgent else interval):
+                return
+            self._last_discovery = now
+            if self.shared_cache is not None:
+                self.shared_cache.put("mirrors", "discovered_at", now)
+
+            configured = list(self.config.get("mirrors", DEFAULT_MIRRORS))
+            known = {normalize_mirror(mirror) or mirror for mirror in configured}
+            ignored = opts.get("ignored", [])
+            sources = list(opts.get("sources", DEFAULT_MIRROR_SOURCES))
+            if self.working_mirror:
+                sources.append(self.working_mirror + "/")
+            new = [m for m in self.discovery.candidates(sources, configured) if m not in known and m not in ignored]
+            live, dead = self.discovery.probe_all(configured + new)
+
+            self.dead_mirrors = dead
+            if self.shared_cache is not None:
+                self.shared_cache.put("mirrors", "dead", sorted(dead), ttl=interval)
+            # New mirrors are added fastest first, a probe says nothing about the ones the user ordered
+            mirrors = merge_mirrors(configured, sorted((m for m in new if m in live), key=live.__getitem__), ignored)
+            # The list may have been edited in the meantime
+            if mirrors != configured and self.config.get("mirrors", DEFAULT_MIRRORS) == configured:
+                added = mirrors[len(configured) :]
+                self.events.record("discovery", message=f"Found new mirrors: {', '.join(added)}")
+                self.config["mirrors"] = mirrors
+                discovery = self.config.get("discovery", {})
+                self.config["discovery"] = {
+                    **discovery,
+                    "found": list(discovery.get("found", [])) + added,
+                    "discovered": list(discovery.get("discovered", [])) + added,
+                }
+        except Exception as e:
+            self.events.record("discovery", e, f"Mirror discovery failed: {e}")
+        finally:
+            self._discovery_lock.release()
+
+    def _search(self, url: str, max_results: int, token: CancelToken) -> Iterator[ResultRecord]:
+        br = self._browser(token)
+        counter = max_results
+
+        try:
+            for page in range(1, ceil(max_results / RESULTS_PER_PAGE) + 1):
+                content = self._fetch_from_mirrors(url.replace("{page}", str(page)), token, br)
+                with self.tracer.span("parse", page=page, size=len(content)):
+                    rows = self.parser.run(parse_search_rows, content)
+
+                for row in rows:
+                    if counter <= 0:
+                        break
+                    counter -= 1
+                    yield ResultRecord(*row)
+        finally:
+            # Also runs on GeneratorExit when the consumer goes away mid-search
+            token.cancel()
+
+    def search_many(self, queries: list[str], max_results: int = 10, timeout: int = 60) -> SearchResults:
+        """
+        Search for several variants of the same book at once, e.g. title, "title author" and ISBNs.
+
+        Results are merged by md5 and ranked by how many of the variants found them, the best
+        ``max_results`` of them are returned.
+        """
+        queries = list(dict.fromkeys(query.strip() for query in queries if query.strip()))
+        token = CancelToken(timeout)
+        looked_up: dict[str, tuple[str, str]] = {}
+        records = merge_ranked(
+            [partial(self._search_records, query, max_results, token.child(), looked_up) for query in queries],
+            key=lambda record: record.md5,
+            max_workers=self.config.get("search_many_workers", 4),
+            events=self.events,
+        )
+        try:
+            for record, library_id in islice(self._check_library(records, looked_up), max_results):
+                yield record.to_search_result(SearchResult, library_id)
+        finally:
+            records.close()
+            token.cancel()
 
     def search(self, query: str, max_results: int = 10, timeout: int = 60) -> SearchResults:
+        token = CancelToken(timeout)
+        # A new search means the results of the last one won't be opened anymore
+        prefetch_token = self.prefetcher.restart(CancelToken())
+        looked_up: dict[str, tuple[str, str]] = {}
+        matched = self._check_library(self._search_records(query, max_results, token, looked_up), looked_up)
+        matched = self._prefetch_details(matched, prefetch_token, timeout)
+        results = (record.to_search_result(SearchResult, library_id) for record, library_id in matched)
+        try:
+            yield from self.tracer.generator("search", results, query=query, max_results=max_results)
+        finally:
+            token.cancel()
+
+    def _prefetch_details(
+        self, results: Iterator[tuple[ResultRecord, int | None]], token: CancelToken, timeout: float
+    ) -> Iterator[tuple[ResultRecord, int | None]]:
+        # The first few results are the ones that get opened, look up their download links while the user reads
+        count = self.config.get("prefetch", {}).get("results", 3)
+        for i, (record, library_id) in enumerate(results):
+            if i < count and record.formats:
+                self.prefetcher.submit(record.md5, partial(self._get_download_links, record.md5), token, timeout)
+            yield record, library_id
+
+    def _search_records(
+        self,
+        query: str,
+        max_results: int,
+        token: CancelToken,
+        looked_up: dict[str, tuple[str, str]] | None = None,
+    ) -> Iterator[ResultRecord]:
         url = f"{{base}}/search?page={{page}}&q={quote_plus(query)}&display=table"
+        # What a result can't be checked against goes into the cache key, the rest can be filtered locally
+        key: list[tuple[str, tuple[str, ...]]] = [("q", (query,))]
+        filters: Filters = {}
         search_opts = self.config.get("search", {})
         for option in SearchOption.options:
             value = search_opts.get(option.config_option, ())
@@ -164,7 +506,76 @@ class AnnasArchiveStore(StorePlugin):
                 value = (value,)
             for item in value:
                 url += f"&{option.url_param}={item}"
-        yield from self._search(url, max_results, timeout)
+            if option.url_param not in LOCAL_FILTERS:
+                key.append((option.url_param, tuple(sorted(value))))
+            elif option.url_param == "content" and value:
+                # Results have the content type as it's shown, not the search parameter
+                filters["content"] = frozenset(label.lower() for label, code in option.options if code in value)
+            elif value:
+                filters[option.url_param] = frozenset(value)
+
+        identifier = classify(query)
+        # A record page only tells the file type, any other filter needs the search page
+        if identifier is not None and set(filters) <= {"ext"}:
+            record = self.tracer.call("lookup", self._lookup_identifier, *identifier, token)
+            if record is not None and matches(record, filters):
+                if looked_up is not None:
+                    # The identifier is known to be this record's, unlike any result of a full-text search
+                    looked_up[record.md5] = identifier
+                yield record
+                return
+            # Not a single file Anna's Archive knows by that identifier, a normal search may still find it
+
+        if self.result_cache is not None:
+            cached = self.result_cache.get(tuple(key), filters, max_results)
+            if cached is not None:
+                yield from cached
+                return
+
+        # The shared search outlives any one caller, it's only cancelled once every caller has left or been cancelled
+        shared = CancelToken(token.remaining())
+        records = []
+        for record in self._flights.stream(
+            ("search", canonical_url(url), max_results),
+            partial(self._search, url, max_results, shared),
+            cancel=shared.cancel,
+            token=token,
+        ):
+            records.append(record)
+            yield record
+        if self.result_cache is not None:
+            # Fewer results than asked for means these are all of them
+            self.result_cache.put(tuple(key), filters, records, complete=len(records) < max_results)
+
+    def _lookup_identifier(self, kind: str, value: str, token: CancelToken) -> ResultRecord | None:
+        br = self._browser(token)
+        md5 = value if kind == "md5" else self.identifier_cache.md5_for(kind, value)
+        record = self.identifier_cache.record(md5) if md5 else None
+        try:
+            if md5 is None:
+                # The isbn and scidb record pages link to the files they describe
+                path = "isbn" if kind == "isbn" else "scidb"
+                content = self._fetch_from_mirrors(f"{{base}}/{path}/{quote(value, safe='/')}", token, br)
+                md5s = list(dict.fromkeys(self.parser.run(parse_md5_links, content)))
+                # An ISBN usually names several files (EPUB, PDF, ...), which only a search lists
+                md5 = md5s[0] if len(md5s) == 1 else ""
+                self.identifier_cache.remember_md5(kind, value, md5)
+                if not md5:
+                    return None
+                record = self.identifier_cache.record(md5)
+            elif not md5:
+                return None
+
+            if record is None:
+                record = self.parser.run(parse_md5_page, self._fetch_from_mirrors(f"{{base}}/md5/{md5}", token, br))
+                if record is None:
+                    return None
+                self.identifier_cache.remember_record(md5, record)
+        except HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+        return ResultRecord(md5, *record)
 
     def open(self, parent: Any = None, detail_item: str | None = None, external: bool = False) -> None:
         if detail_item:
@@ -186,116 +597,135 @@ class AnnasArchiveStore(StorePlugin):
                 open_url(QUrl(url))
 
     def get_details(self, search_result: SearchResult, timeout: int = 60) -> None:
+        token = CancelToken(timeout)
+        try:
+            self.tracer.call("get_details", self._get_details, search_result, token)
+        finally:
+            token.cancel()
+
+    def _get_details(self, search_result: SearchResult, token: CancelToken) -> None:
         if not search_result.formats:
             return
 
-        _format = "." + search_result.formats.lower()
+        prefetched, links = self.prefetcher.take(search_result.detail_item, token.remaining())
+        if not prefetched:
+            # Concurrent lookups of the same book share one set of requests
+            links = self._flights.do(
+                ("details", search_result.detail_item),
+                partial(self._get_download_links, search_result.detail_item, token),
+                timeout=token.remaining(),
+                rerun=(Cancelled,),
+            )
+
+        link_opts = self.config.get("link", {})
+        verify_content_type = link_opts.get("content_type", False)
+
+        def verified(link_text: str, url: str) -> bool:
+            # Because Z-Lib downloads use hashes, we can't check them :(
+            return verify_content_type and link_text != "premium" and "z-lib" not in url
+
+        checks = {
+            url: self.link_verifier.submit(url, token.timeout())
+            for link_text, url in links
+            if verified(link_text, url) and self.link_verifier.verdict(url) is None
+        }
+        if checks:
+            # calibre reads the downloads as soon as this returns, so they can't change afterwards.
+            # The checks still running go on in the background and count for the next lookup.
+            wait(checks.values(), timeout=token.timeout(link_opts.get("verify_wait", 5)))
+
+        for link_text, url in links:
+            key = f"{link_text}.{search_result.formats}"
+            if not verified(link_text, url):
+                search_result.downloads[key] = url
+                continue
 
-        if self.config.get("secret"):
-            resp = urlopen(self._get_url_premium(search_result.detail_item), timeout=timeout).read().decode("utf-8")
-            url = json.loads(resp).get("download_url")
+            check = checks.get(url)
+            if check is None:
+                verdict = self.link_verifier.verdict(url)
+            elif check.done():
+                verdict = None if check.exception() else check.result()
+            else:
+                key = f"{link_text} (unverified).{search_result.formats}"
+                verdict = None
+            if verdict is not False:
+                search_result.downloads[key] = url
+
+    def _get_download_links(self, md5: str, token: CancelToken) -> list[tuple[str, str]]:
+        links: list[tuple[str, str]] = []
+        premium_url = self._get_url_premium(md5) if self.config.get("secret") else None
+        if premium_url is not None:
+            with self._api_urlopen(premium_url, timeout=token.timeout(), token=token) as resp:
+                url = json.loads(resp.read().decode("utf-8")).get("download_url")
 
             if url:
-                search_result.downloads[f"premium.{search_result.formats}"] = url
-
-        br = browser()
-        with closing(br.open(self._get_url(search_result.detail_item), timeout=timeout)) as f:
-            doc = html.fromstring(f.read())
-
-        for link in doc.xpath(
-            '//div[@id="md5-panel-downloads"]/ul[contains(@class, "list-inside")]/li/a[contains(@class, "js-download-link")]'
-        ):
-            url = link.get("href")
-            link_text = "".join(link.itertext())
-
-            if "Fast Partner Server" in link_text and not self.config.get("secret"):
-                continue
-
+                links.append(("premium", url))
+
+        br = self._browser(token)
+        with self.tracer.span("fetch", mirror=self.working_mirror), token.open(br, self._get_url(md5)) as f:
+            content = f.read()
+
+        page_links = [
+            (url, link_text)
+            for url, link_text in self.parser.run(parse_download_links, content)
+            if "Fast Partner Server" not in link_text or self.config.get("secret")
+        ]
+        for resolver, url, link_text in self.resolvers.plan(page_links):
+            token.check()
+            start = time.monotonic()
             try:
-                if link_text == "Libgen.li":
-                    # Cloudflare "Phishing Warning" popups make this impossible for us
-                    continue
-                elif link_text == "Libgen.rs Fiction" or link_text == "Libgen.rs Non-Fiction":
-                    url = self._get_libgen_link(url, br)
-                elif link_text.startswith("Sci-Hub"):
-                    url = self._get_scihub_link(url, br)
-                elif link_text == "Z-Library":
-                    url = self._get_zlib_link(url, br)
-                else:
-                    continue
-            except (OSError, URLError, HTTPError, TimeoutError, RemoteDisconnected) as e:
-                br.set_handle_gzip(False)  # Reset potentially messed up browser state
-                print(f"Failed to resolve link '{link_text}': {e}")
-                continue
-
-            if not url:
+                with self.tracer.span("resolve", link=link_text, resolver=resolver.name):
+                    url = self._flights.do(
+                        ("link", url),
+                        partial(self.resolvers.resolve, resolver, url, br, token),
+                        timeout=token.remaining(),
+                        rerun=(Cancelled,),
+                    )
+            except (Cancelled, OSError, URLError, HTTPError, TimeoutError, RemoteDisconnected) as e:
+                # Only the resolver's own budget ran out, unless this raises
+                token.check()
+                self.events.record(
+                    "resolve", e, f"{link_text}: {e}", mirror=resolver.name, url=url, duration=time.monotonic() - start
+                )
                 continue
 
-            # Takes longer, but more accurate
-            # Get rid of extension checking because basically none have extensions...
-            try:
-                # Because Z-Lib downloads use hashes, we can't check them :(
-                if "z-lib" not in url:
-                    with urlopen(Request(url, method="HEAD"), timeout=timeout) as resp:
-                        if resp.info().get_content_maintype() != "application":
-                            continue
-            except (HTTPError, URLError, TimeoutError, RemoteDisconnected):
-                pass
-            search_result.downloads[f"{link_text}.{search_result.formats}"] = url
-
-    @staticmethod
-    def _get_libgen_link(url: str, br: Any) -> str:
-        with closing(br.open(url)) as resp:
-            doc = html.fromstring(resp.read())
-        # Fiction
-        url = "".join(doc.xpath('//ul[contains(@class, "record_mirrors")]/li[1]/a/@href'))
-
-        # Handle non-fiction
-        if not url:
-            url = "".join(doc.xpath('//a[@title="Libgen & IPFS & Tor"]/@href'))
-        # Replace http with https because it doesn't work without it
-        url = url.replace("http", "https")
-
-        # Open the new books.ms url and look for the 'get' button there
-        with closing(br.open(url)) as resp:
-            doc = html.fromstring(resp.read())
-            scheme, _, host, _ = resp.geturl().split("/", 3)
-        url = "".join(doc.xpath('//div[@id="download"]/h2[1]/a/@href'))
-        return url
-
-    @staticmethod
-    def _get_libgen_nonfiction_link(url: str, br) -> str:
-        with closing(br.open(url)) as resp:
-            doc = html.fromstring(resp.read())
-        url = "".join(doc.xpath('//h2/a[text()="GET"]/@href'))
-        return url
-
-    @staticmethod
-    def _get_scihub_link(url: str, br: Any) -> str | None:
-        with closing(br.open(url)) as resp:
-            doc = html.fromstring(resp.read())
-            scheme, _ = resp.geturl().split("/", 1)
-        url = "".join(doc.xpath('//embed[@id="pdf"]/@src'))
-        if url:
-            return scheme + url
-
-    # With Z-Lib, every download has a hash
-    @staticmethod
-    def _get_zlib_link(url: str, br: Any) -> str | None:
-        with closing(br.open(url)) as resp:
-            doc = html.fromstring(resp.read())
-            scheme, _, host, _ = resp.geturl().split("/", 3)
-        url = "".join(doc.xpath('//a[contains(@class, "addDownloadedBook")]/@href'))
-        if url:
-            # The url already has a leading /
-            return f"{scheme}//{host}{url}"
+            if url:
+                links.append((link_text, url))
+        return links
+
+    def download(self, search_result: SearchResult, path: str, timeout: int = 60) -> str:
+        if not search_result.downloads:
+            self.get_details(search_result, timeout)
+        # Premium links come first, then the mirrors in the order get_details found them
+        downloads = search_result.downloads
+        urls = [url for name, url in downloads.items() if name.startswith("premium.")]
+        urls += [url for name, url in downloads.items() if not name.startswith("premium.")]
+        download_opts = self.config.get("download", {})
+        downloader = SegmentedDownloader(
+            urls,
+            path,
+            md5=search_result.detail_item,
+            connections=download_opts.get("connections", 4),
+            timeout=timeout,
+            opener=self._urlopen,
+            events=self.events,
+        )
+        return downloader.download()
 
     def _get_url(self, md5: str) -> str:
-        return f"{self.working_mirror}/md5/{md5}"
-
-    def _get_url_premium(self, md5: str) -> str:
+        # None after every mirror failed, the next one to try is as good a guess as any
+        mirror = self.working_mirror or self._mirror_order()[0]
+        return f"{mirror}/md5/{md5}"
+
+    def _get_url_premium(self, md5: str) -> str | None:
+        # The key only goes to a mirror the user put in the list, never to one discovery added
+        discovered = set(self.config.get("discovery", {}).get("discovered", ()))
+        mirror = next((m for m in self._mirror_order() if m not in discovered), None)
+        if mirror is None:
+            self.events.record("premium", message="No configured mirror to send the secret key to")
+            return None
         secret = self.config.get("secret")
-        return f"{self.working_mirror}/dyn/api/fast_download.json?md5={md5}&key={secret}"
+        return f"{mirror}/dyn/api/fast_download.json?md5={md5}&key={secret}"
 
     def config_widget(self) -> Any:
         from calibre_plugins.store_annas_archive.config import ConfigWidget
@@ -304,3 +734,7 @@ class AnnasArchiveStore(StorePlugin):
 
     def save_settings(self, config_widget: Any) -> None:
         config_widget.save_settings()
+        self._configure_rate_limiter()
+        self._configure_proxies()
+        self.resolvers.configure(self.config.get("resolvers", {}))
+        self.tracer.mode = profile_mode(self.config.get("profile", False))
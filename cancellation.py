@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+__all__ = ("CancelToken", "Cancelled")
+
+
+# Where a response keeps the one it wraps: the plugin's wrappers, mechanize's and http.client's, down to the socket
+_WRAPPED = ("resp", "wrapped", "fp", "raw", "_sock")
+
+
+class Cancelled(Exception):
+    pass
+
+
+def _socket_of(resource: Any) -> socket.socket | None:
+    seen = set()
+    todo = [resource]
+    while todo:
+        obj = todo.pop()
+        if isinstance(obj, socket.socket):
+            return obj
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        for name in _WRAPPED:
+            try:
+                inner = getattr(obj, name, None)
+            except Exception:
+                continue
+            if inner is not None:
+                todo.append(inner)
+    return None
+
+
+class _PendingOpen:
+    """A ``br.open`` running on its own thread. Closing it abandons the response, which is closed once it arrives."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.resp: Any = None
+        self.error: BaseException | None = None
+        self.abandoned = False
+
+    def finish(self, resp: Any = None, error: BaseException | None = None) -> None:
+        with self.lock:
+            self.resp, self.error = resp, error
+            abandoned = self.abandoned
+        self.done.set()
+        if abandoned and resp is not None:
+            CancelToken._close(resp)
+
+    def result(self) -> Any:
+        with self.lock:
+            if self.abandoned:
+                raise Cancelled("Cancelled")
+            if self.error is not None:
+                raise self.error
+            return self.resp
+
+    def close(self) -> None:
+        with self.lock:
+            self.abandoned = True
+            resp = self.resp
+        self.done.set()
+        if resp is not None:
+            CancelToken._close(resp)
+
+
+class CancelToken:
+    """
+    Cancellation flag and deadline handed down through a search or details lookup.
+
+    Every blocking call takes its timeout from ``timeout()`` so nothing outlives the deadline,
+    and responses registered with ``track()`` have their sockets shut down and are closed as soon
+    as the token is cancelled, which wakes a blocked read instead of waiting for it to time out.
+    """
+
+    def __init__(self, timeout: float | None = None, parent: CancelToken | None = None) -> None:
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        if parent is not None and parent.deadline is not None:
+            self.deadline = parent.deadline if self.deadline is None else min(self.deadline, parent.deadline)
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._resources: list[Any] = []
+        self._children: list[CancelToken] = []
+        if parent is not None:
+            parent._adopt(self)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def remaining(self) -> float | None:
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def check(self) -> None:
+        if self._event.is_set():
+            raise Cancelled("Cancelled")
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise Cancelled("Deadline exceeded")
+
+    def timeout(self, default: float | None = None) -> float | None:
+        """The timeout for the next blocking call, no longer than what is left of the deadline."""
+        self.check()
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return remaining if default is None else min(default, remaining)
+
+    def wait(self, seconds: float) -> bool:
+        """Sleep that wakes up early on cancellation, returns True if cancelled."""
+        return self._event.wait(seconds)
+
+    def child(self, timeout: float | None = None) -> CancelToken:
+        return CancelToken(timeout, parent=self)
+
+    def track(self, resource: Any) -> Any:
+        with self._lock:
+            if not self._event.is_set():
+                self._resources.append(resource)
+                return resource
+        # Already cancelled, don't let it leak
+        self._close(resource)
+        raise Cancelled("Cancelled")
+
+    def untrack(self, resource: Any) -> None:
+        with self._lock:
+            try:
+                self._resources.remove(resource)
+            except ValueError:
+                pass
+
+    @contextmanager
+    def open(self, br: Any, url: str) -> Iterator[Any]:
+        """
+        ``br.open(url)`` with this token's timeout.
+
+        Cancelling the token shuts down the response's socket, which unblocks a read stuck on a slow
+        host, and a caller still waiting for the response itself stops waiting. A body cut off that
+        way reads like a short one or fails, so leaving the block on a cancelled token raises ``Cancelled``.
+        """
+        resp = self.track(self._open(br, url))
+        try:
+            yield resp
+        except Exception as e:
+            if self.cancelled and not isinstance(e, Cancelled):
+                raise Cancelled("Cancelled") from e
+            raise
+        finally:
+            self.untrack(resp)
+            resp.close()
+        if self.cancelled:
+            raise Cancelled("Cancelled")
+
+    def _open(self, br: Any, url: str) -> Any:
+        # Until the headers are in there is no response to close, so br.open runs on its own thread
+        timeout = self.timeout()
+        pending = self.track(_PendingOpen())
+
+        def run() -> None:
+            try:
+                resp = br.open(url, timeout=timeout)
+            except BaseException as e:
+                pending.finish(error=e)
+            else:
+                pending.finish(resp)
+
+        threading.Thread(target=run, name="CancelToken.open", daemon=True).start()
+        pending.done.wait()
+        self.untrack(pending)
+        return pending.result()
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            resources, self._resources = self._resources, []
+            children, self._children = self._children, []
+        for resource in resources:
+            self._close(resource)
+        for child in children:
+            child.cancel()
+
+    def _adopt(self, child: CancelToken) -> None:
+        with self._lock:
+            if not self._event.is_set():
+                self._children.append(child)
+                return
+        child.cancel()
+
+    @staticmethod
+    def _close(resource: Any) -> None:
+        # close() from another thread doesn't wake a read blocked on the socket, a shutdown does
+        sock = _socket_of(resource)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        try:
+            resource.close()
+        except Exception:
+            pass
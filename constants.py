@@ -21,6 +21,7 @@ else:
                     QComboBox = Any
 
 __all__ = (
+    "DEFAULT_MIRROR_SOURCES",
     "DEFAULT_MIRRORS",
     "SearchOption",
     "SearchConfiguration",
@@ -40,6 +41,8 @@ DEFAULT_MIRRORS = [
     "https://annas-archive.pm",
     "https://annas-archive.in",
 ]
+# Pages that link to the current mirrors, for mirror discovery
+DEFAULT_MIRROR_SOURCES = ["https://en.wikipedia.org/wiki/Anna%27s_Archive"]
 RESULTS_PER_PAGE = 100
 
 
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import gc
+import os
+import random
+import sys
+import tracemalloc
+
+# Add parent directory to path so we can import the plugin modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import ResultRecord
+
+ROWS = 100_000
+FORMATS = ("epub", "pdf", "mobi", "azw3", "cbz", "djvu")
+
+
+class SearchResult:
+    # Same attributes as calibre.gui2.store.search_result.SearchResult
+    DRM_UNLOCKED = 2
+
+    def __init__(self) -> None:
+        self.store_name = ""
+        self.cover_url = ""
+        self.cover_data = None
+        self.title = ""
+        self.author = ""
+        self.price = ""
+        self.detail_item = ""
+        self.drm = None
+        self.formats = ""
+        self.downloads: dict[str, str] = {}
+        self.affiliate = False
+        self.plugin_author = ""
+        self.create_browser = None
+
+
+def synthetic_rows(count: int) -> list[tuple[str, str, str, str, str]]:
+    rng = random.Random(42)
+    authors = [f"Author {i}" for i in range(count // 20)]
+    rows = []
+    for i in range(count):
+        # Fresh string objects for every row, the way lxml hands them to us
+        rows.append(
+            (
+                f"{rng.getrandbits(128):032x}",
+                f"Title of book number {i}",
+                "".join(rng.choice(authors)),
+                "".join(rng.choice(FORMATS)).upper(),
+                f"https://covers.example/{i}.jpg",
+            )
+        )
+    return rows
+
+
+def measure(name: str, build) -> int:
+    rows = synthetic_rows(ROWS)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    results = build(rows)
+    # The parsed rows are dropped once the results are built, so this is what the results keep alive
+    del rows
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print(f"{name:<14} {used / 1024 / 1024:8.1f} MiB  {used / len(results):6.0f} bytes/row")
+    return used
+
+
+def build_search_results(rows):
+    results = []
+    for md5, title, author, formats, cover_url in rows:
+        s = SearchResult()
+        s.detail_item = md5
+        s.title = title
+        s.author = author
+        s.formats = formats
+        s.cover_url = cover_url
+        s.price = "$0.00"
+        s.drm = SearchResult.DRM_UNLOCKED
+        results.append(s)
+    return results
+
+
+def build_records(rows):
+    return [ResultRecord(*row) for row in rows]
+
+
+def main():
+    print(f"Memory for {ROWS:,} synthetic search results:")
+    full = measure("SearchResult", build_search_results)
+    compact = measure("ResultRecord", build_records)
+    print(f"ResultRecord uses {compact / full:.0%} of the memory of SearchResult")
+
+
+if __name__ == "__main__":
+    main()
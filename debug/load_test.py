@@ -0,0 +1,412 @@
+from __future__ import annotations
+
+import argparse
+import gc
+import gzip
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Add parent directory to path so we can import the plugin modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Budget keys, their command line flags and whether a bigger value is worse
+BUDGET = {
+    "search_p95": ("--max-search-p95", True),
+    "search_p99": ("--max-search-p99", True),
+    "details_p95": ("--max-details-p95", True),
+    "details_p99": ("--max-details-p99", True),
+    "error_rate": ("--max-error-rate", True),
+    "peak_threads": ("--max-threads", True),
+    "peak_sockets": ("--max-sockets", True),
+    "leaked_sockets": ("--max-leaked-sockets", True),
+    "leaked_threads": ("--max-leaked-threads", True),
+    "throughput": ("--min-throughput", False),
+}
+
+
+def md5_for(query: str, i: int) -> str:
+    return hashlib.md5(f"{query}/{i}".encode()).hexdigest()
+
+
+def search_page(query: str, rows: int) -> bytes:
+    body = "".join(
+        f"""<tr>
+<td><img src="/covers/{i}.jpg"/></td>
+<td><a href="/md5/{md5_for(query, i)}" class="js-vim-focus">{query} volume {i}</a></td>
+<td>Author {i % 7}</td>
+<td>Publisher</td><td>2001</td><td>book.epub</td><td>lgli/zlib</td><td>English [en]</td><td>Book (fiction)</td>
+<td>epub</td><td>1.2MB</td>
+</tr>"""
+        for i in range(rows)
+    )
+    return f'<html><head><meta charset="utf-8"/></head><body><table>{body}</table></body></html>'.encode()
+
+
+def md5_page(md5: str, host: str) -> bytes:
+    return f"""<html><head><meta charset="utf-8"/><meta property="og:title" content="Book {md5}"/></head><body>
+<div class="italic">Author</div>
+<div class="text-gray-500">English [en], .epub, 1.2MB</div>
+<div id="md5-panel-downloads"><ul class="list-inside">
+<li><a class="js-download-link" href="http://{host}/zlib/{md5}">Z-Library</a></li>
+</ul></div>
+</body></html>""".encode()
+
+
+def zlib_page(md5: str) -> bytes:
+    return f'<html><body><a class="addDownloadedBook" href="/dl/{md5}">Download</a></body></html>'.encode()
+
+
+class StubMirror(BaseHTTPRequestHandler):
+    """Serves just enough of Anna's Archive for searches and get_details, with latency and failures."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        opts = self.server.profile  # type: ignore[attr-defined]
+        time.sleep(max(0.0, random.gauss(opts["latency"], opts["jitter"])))
+        roll = random.random()
+        if roll < opts["reset_rate"]:
+            # Drop the connection without an answer, like an overloaded mirror does
+            self.close_connection = True
+            return
+        roll -= opts["reset_rate"]
+        if roll < opts["hang_rate"]:
+            time.sleep(opts["hang"])
+            self.close_connection = True
+            return
+        roll -= opts["hang_rate"]
+        if roll < opts["throttle_rate"]:
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        roll -= opts["throttle_rate"]
+        if roll < opts["error_rate"]:
+            self.send_error(503)
+            return
+
+        url = urlparse(self.path)
+        if url.path == "/":
+            # Enough for the mirror discovery probe
+            body = b'<html><body><form action="/search"><input name="q"/></form></body></html>'
+        elif url.path == "/search":
+            query = parse_qs(url.query).get("q", [""])[0]
+            body = search_page(query, opts["rows"])
+        elif url.path.startswith("/md5/"):
+            body = md5_page(url.path.rsplit("/", 1)[-1], self.headers.get("Host", ""))
+        elif url.path.startswith("/zlib/"):
+            body = zlib_page(url.path.rsplit("/", 1)[-1])
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        if opts["compress"] and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=6)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if opts["bandwidth"]:
+            # A slow link: the body takes its size over the bandwidth to arrive
+            time.sleep(len(body) / opts["bandwidth"])
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def serve(port: int, profile: dict, ready=None) -> None:
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubMirror)
+    server.daemon_threads = True
+    server.request_queue_size = 256
+    server.profile = profile  # type: ignore[attr-defined]
+    if ready is not None:
+        ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_stub(profile: dict) -> tuple[str, object]:
+    # A separate process keeps the stub's own sockets and threads out of the numbers
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+        ready = context.Queue()
+        process = context.Process(target=serve, args=(0, profile, ready), daemon=True)
+        process.start()
+        return f"http://127.0.0.1:{ready.get(timeout=10)}", process
+    print("No fork on this platform, the stub mirror's sockets and threads count towards the results")
+    import queue
+
+    ready = queue.Queue()
+    threading.Thread(target=serve, args=(0, profile, ready), daemon=True).start()
+    return f"http://127.0.0.1:{ready.get(timeout=10)}", None
+
+
+def open_sockets() -> int | None:
+    try:
+        fds = os.listdir("/proc/self/fd")
+    except OSError:
+        return None
+    count = 0
+    for fd in fds:
+        try:
+            count += os.readlink(f"/proc/self/fd/{fd}").startswith("socket:")
+        except OSError:
+            pass
+    return count
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    # Nearest rank
+    values = sorted(values)
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+class Monitor(threading.Thread):
+    def __init__(self) -> None:
+        super().__init__(daemon=True)
+        self.peak_threads = 0
+        self.peak_sockets = 0
+        self.stop = threading.Event()
+
+    def run(self) -> None:
+        while not self.stop.wait(0.05):
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            self.peak_sockets = max(self.peak_sockets, open_sockets() or 0)
+
+
+def run_load(store, args) -> dict:
+    from annas_archive import SearchResult
+
+    store.transfer_stats.reset()
+    store.events.clear()
+
+    queries = [f"load test {i}" for i in range(args.distinct_queries)]
+    latencies: dict[str, list[float]] = {"search": [], "details": []}
+    errors: dict[str, int] = {}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def record(kind: str, start: float, error: Exception | None) -> None:
+        with lock:
+            if error is None:
+                latencies[kind].append(time.perf_counter() - start)
+            else:
+                key = f"{kind}: {type(error).__name__}"
+                errors[key] = errors.get(key, 0) + 1
+
+    def worker(seed: int) -> None:
+        rng = random.Random(seed)
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                results = list(store.search(rng.choice(queries), args.max_results, args.timeout))
+            except Exception as e:
+                record("search", start, e)
+                continue
+            record("search", start, None)
+
+            for result in results[: args.details]:
+                details = SearchResult()
+                details.detail_item, details.formats = result.detail_item, result.formats
+                start = time.perf_counter()
+                try:
+                    store.get_details(details, args.timeout)
+                except Exception as e:
+                    record("details", start, e)
+                else:
+                    record("details", start, None)
+
+    gc.collect()
+    threads_before, sockets_before = threading.active_count(), open_sockets()
+    monitor = Monitor()
+    monitor.start()
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(i,), name=f"load-{i}") for i in range(args.concurrency)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    monitor.stop.set()
+    monitor.join()
+
+    # Give abandoned requests a moment to wind down before looking for leaks
+    time.sleep(args.settle)
+    gc.collect()
+    sockets_after = open_sockets()
+
+    operations = len(latencies["search"]) + len(latencies["details"])
+    failures = sum(errors.values())
+    report = {
+        "operations": operations,
+        "failures": failures,
+        "errors": errors,
+        "throughput": operations / elapsed,
+        "error_rate": failures / max(1, operations + failures),
+        "peak_threads": monitor.peak_threads,
+        "leaked_threads": threading.active_count() - threads_before,
+    }
+    for kind, values in latencies.items():
+        for pct in (50, 95, 99):
+            report[f"{kind}_p{pct}"] = percentile(values, pct)
+    transfer = store.transfer_stats.snapshot()
+    report["wire_bytes"] = transfer["wire_bytes"]
+    report["decoded_bytes"] = transfer["decoded_bytes"]
+    report["encodings"] = {encoding: stats["responses"] for encoding, stats in transfer["by_encoding"].items()}
+    report["events"] = {f"{stage} {error}".strip(): count for (stage, error), count in store.events.counts().items()}
+    if sockets_before is not None and sockets_after is not None:
+        report["peak_sockets"] = monitor.peak_sockets
+        report["leaked_sockets"] = sockets_after - sockets_before
+    return report
+
+
+def check_budget(report: dict, budget: dict) -> list[str]:
+    failures = []
+    for key, limit in budget.items():
+        if key not in BUDGET:
+            failures.append(f"unknown budget {key!r}")
+            continue
+        if limit is None or key not in report:
+            continue
+        bigger_is_worse = BUDGET[key][1]
+        if (report[key] > limit) if bigger_is_worse else (report[key] < limit):
+            failures.append(f"{key} = {report[key]:.3f} (budget {'<=' if bigger_is_worse else '>='} {limit})")
+    return failures
+
+
+def print_report(report: dict) -> None:
+    print(f"Operations:   {report['operations']} ok, {report['failures']} failed ({report['error_rate']:.1%})")
+    print(f"Throughput:   {report['throughput']:.1f} operations/s")
+    for kind in ("search", "details"):
+        print(
+            f"{kind.capitalize() + ':':<13} p50 {report[f'{kind}_p50'] * 1000:7.1f} ms"
+            f"  p95 {report[f'{kind}_p95'] * 1000:7.1f} ms  p99 {report[f'{kind}_p99'] * 1000:7.1f} ms"
+        )
+    if report["decoded_bytes"]:
+        saved = 1 - report["wire_bytes"] / report["decoded_bytes"]
+        encodings = ", ".join(f"{count} {encoding}" for encoding, count in sorted(report["encodings"].items()))
+        print(
+            f"Transfer:     {report['wire_bytes'] / 1024:.0f} KiB on the wire for {report['decoded_bytes'] / 1024:.0f} KiB"
+            f" of pages ({saved:.0%} saved; {encodings})"
+        )
+    print(f"Threads:      peak {report['peak_threads']}, {report['leaked_threads']:+d} after the run")
+    if "peak_sockets" in report:
+        print(f"Sockets:      peak {report['peak_sockets']}, {report['leaked_sockets']:+d} after the run")
+    for error, count in sorted(report["errors"].items()):
+        print(f"  {count:6d} x {error}")
+    if report["events"]:
+        print("Plugin events:")
+        for event, count in sorted(report["events"].items(), key=lambda item: -item[1]):
+            print(f"  {count:6d} x {event}")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load test the store plugin against a local stub mirror.")
+    load = parser.add_argument_group("load")
+    load.add_argument("--concurrency", type=int, default=8, help="parallel searchers (default 8)")
+    load.add_argument("--duration", type=float, default=20, help="seconds to run (default 20)")
+    load.add_argument("--distinct-queries", type=int, default=50, help="size of the query pool (default 50)")
+    load.add_argument("--max-results", type=int, default=10)
+    load.add_argument("--details", type=int, default=2, help="get_details calls after each search (default 2)")
+    load.add_argument("--timeout", type=float, default=10)
+    load.add_argument("--settle", type=float, default=1, help="seconds to wait before counting leaks (default 1)")
+    load.add_argument("--cache", action="store_true", help="keep the plugin's result and page caches on")
+    load.add_argument("--parse-processes", type=int, default=0)
+    load.add_argument("--prefetch", type=int, default=0, help="results to prefetch details for (default 0)")
+    load.add_argument("--mirror", help="use this mirror instead of starting the stub")
+
+    stub = parser.add_argument_group("stub mirror")
+    stub.add_argument("--serve", action="store_true", help="only run the stub mirror")
+    stub.add_argument("--port", type=int, default=0, help="port for --serve")
+    stub.add_argument("--latency", type=float, default=0.05, help="mean response time in seconds (default 0.05)")
+    stub.add_argument("--jitter", type=float, default=0.02, help="standard deviation of the response time")
+    stub.add_argument("--rows", type=int, default=25, help="results per search page (default 25)")
+    stub.add_argument("--error-rate", type=float, default=0.0, help="share of 503 answers")
+    stub.add_argument("--throttle-rate", type=float, default=0.0, help="share of 429 answers")
+    stub.add_argument("--reset-rate", type=float, default=0.0, help="share of connections dropped without an answer")
+    stub.add_argument("--hang-rate", type=float, default=0.0, help="share of requests that never get an answer")
+    stub.add_argument("--hang", type=float, default=30, help="how long a hanging request hangs (default 30)")
+    stub.add_argument("--bandwidth", type=float, default=0, help="bytes/s per response, to simulate a slow link")
+    stub.add_argument("--no-compress", action="store_true", help="never gzip pages, even when asked to")
+
+    budget = parser.add_argument_group("regression budget, exit with status 1 when exceeded")
+    budget.add_argument("--budget", help="JSON file with any of: " + ", ".join(BUDGET))
+    for key, (flag, _) in BUDGET.items():
+        budget.add_argument(flag, dest=key, type=float)
+    parser.add_argument("--json", help="also write the report to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    profile = {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "rows": args.rows,
+        "error_rate": args.error_rate,
+        "throttle_rate": args.throttle_rate,
+        "reset_rate": args.reset_rate,
+        "hang_rate": args.hang_rate,
+        "hang": args.hang,
+        "bandwidth": args.bandwidth,
+        "compress": not args.no_compress,
+    }
+    if args.serve:
+        print(f"Stub mirror on http://127.0.0.1:{args.port}")
+        serve(args.port, profile)
+        return 0
+
+    from annas_archive import AnnasArchiveStore
+
+    mirror, stub = (args.mirror, None) if args.mirror else start_stub(profile)
+    config = {
+        "mirrors": [mirror],
+        # The stub is one host, the per-host limits would measure the rate limiter instead of the plugin
+        "rate_limit": {"rate": 10000.0, "burst": 10000},
+        "cache": {"shared": False, "results": args.cache, "http": args.cache},
+        "parse_processes": args.parse_processes,
+        "discovery": {"enabled": False},
+        # Searchers would cancel each other's prefetches, like separate users of a calibre-server do
+        "prefetch": {"results": args.prefetch},
+    }
+    # A plain dict, so the user's plugin settings are left alone
+    store = AnnasArchiveStore(None, "Anna's Archive", config=config)
+
+    print(f"Running {args.concurrency} searchers for {args.duration:.0f}s against {mirror}")
+    try:
+        report = run_load(store, args)
+    finally:
+        store.parser.close()
+        store.prefetcher.close()
+        if stub is not None:
+            stub.terminate()
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    budget = {}
+    if args.budget:
+        with open(args.budget) as f:
+            budget.update(json.load(f))
+    budget.update({key: getattr(args, key) for key in BUDGET if getattr(args, key) is not None})
+    failures = check_budget(report, budget)
+    for failure in failures:
+        print(f"OVER BUDGET: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Iterable
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+
+from lxml import html
+
+if TYPE_CHECKING:
+    from calibre_plugins.store_annas_archive.events import EventLog
+
+__all__ = ("MirrorDiscovery", "merge_mirrors", "normalize_mirror", "parse_mirror_list")
+
+
+def normalize_mirror(url: str) -> str | None:
+    """``scheme://host[:port]`` of ``url``, or None if it isn't an http(s) url."""
+    url = url.strip()
+    if "//" not in url:
+        url = "https://" + url
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname or "." not in parts.hostname:
+        return None
+    return f"{parts.scheme}://{parts.netloc.lower()}"
+
+
+# Top-level domains Anna's Archive has run mirrors on. A link on a page only counts as a mirror if its host is
+# the known site name right under one of these, or under the TLD of a mirror the user configured
+MIRROR_TLDS = frozenset(("org", "li", "se", "pm", "in", "gs", "gl", "vg"))
+
+
+def _site(mirror: str) -> tuple[str, str] | None:
+    # ("annas-archive", "org") for https://annas-archive.org, None unless it is a second-level domain without a port
+    parts = urlsplit(mirror)
+    labels = (parts.hostname or "").split(".")
+    if len(labels) != 2 or not all(labels) or ":" in parts.netloc:
+        return None
+    return labels[0], labels[1]
+
+
+def parse_mirror_list(content: bytes, known: Iterable[str] = ()) -> list[str]:
+    """
+    Mirror urls in a mirror list: a JSON list, ``{"mirrors": [...]}``, one url per line or an HTML page.
+
+    A page links to much more than mirrors and may be edited by anyone, so only its links to a domain
+    registered under the name of one of the ``known`` mirrors count, e.g. annas-archive.se for
+    annas-archive.org, and only on a vetted TLD (``MIRROR_TLDS``) or one of the ``known`` mirrors' own.
+    """
+    text = content.decode("utf-8", "replace").strip()
+    if text.startswith("<"):
+        sites = [site for site in map(_site, known) if site is not None]
+        tlds = MIRROR_TLDS | {tld for _, tld in sites}
+        allowed = {(name, tld) for name, _ in sites for tld in tlds}
+        urls = [href for href in html.fromstring(content).xpath("//a/@href") if href.startswith("http")]
+        urls = [url for url in urls if _site(normalize_mirror(url) or "") in allowed]
+    else:
+        try:
+            data = json.loads(text)
+        except ValueError:
+            urls = [line for line in text.splitlines() if line.strip() and not line.lstrip().startswith("#")]
+        else:
+            urls = data.get("mirrors", []) if isinstance(data, dict) else data
+    mirrors: list[str] = []
+    for url in urls:
+        mirror = normalize_mirror(url) if isinstance(url, str) else None
+        if mirror is not None and mirror not in mirrors:
+            mirrors.append(mirror)
+    return mirrors
+
+
+def merge_mirrors(configured: list[str], live: Iterable[str], ignored: Iterable[str] = ()) -> list[str]:
+    """
+    The configured mirrors in their order, followed by the ``live`` ones that are new.
+
+    Mirrors the user removed (``ignored``) are never added back. Dead mirrors stay in the list,
+    the store tries them last instead, so a mirror that comes back needs no editing.
+    """
+    known = {normalize_mirror(mirror) or mirror for mirror in configured} | set(ignored)
+    return list(configured) + [mirror for mirror in live if mirror not in known]
+
+
+class MirrorDiscovery:
+    """
+    Finds mirrors in mirror lists and on the pages of working mirrors, and probes which are alive.
+
+    ``opener`` is a urlopen style callable. A probe loads a mirror's front page and only counts it as
+    alive if that has a search form, so parked or seized domains that still answer 200 are dead.
+    """
+
+    def __init__(self, opener: Callable[..., Any] = urlopen, workers: int = 4, events: EventLog | None = None) -> None:
+        self.opener = opener
+        self.workers = workers
+        self.events = events
+
+    def _read(self, source: str, timeout: float) -> bytes:
+        if "://" in source:
+            with self.opener(source, timeout=timeout) as resp:
+                return resp.read()
+        with open(source, "rb") as f:
+            return f.read()
+
+    def candidates(self, sources: Iterable[str], known: list[str], timeout: float = 15) -> list[str]:
+        """Mirrors listed by ``sources`` (urls or file paths), leaving out sources that can't be read."""
+        mirrors: list[str] = []
+        for source in sources:
+            try:
+                found = parse_mirror_list(self._read(source, timeout), known)
+            except (OSError, ValueError) as e:
+                if self.events is not None:
+                    self.events.record("discovery", e, f"Failed to read mirror list: {e}", url=source)
+                continue
+            mirrors += [mirror for mirror in found if mirror not in mirrors]
+        return mirrors
+
+    def probe(self, mirror: str, timeout: float = 10) -> float:
+        """Seconds the front page of ``mirror`` took, raises OSError if it isn't a working mirror."""
+        start = time.monotonic()
+        with self.opener(mirror.rstrip("/") + "/", timeout=timeout) as resp:
+            body = resp.read()
+            if getattr(resp, "code", 200) != 200 or b"/search" not in body:
+                raise OSError(f"{mirror} doesn't look like a mirror")
+        return time.monotonic() - start
+
+    def probe_all(self, mirrors: list[str], timeout: float = 10) -> tuple[dict[str, float], set[str]]:
+        """Latency of the live ``mirrors`` and the set of dead ones."""
+
+        def probe(mirror: str) -> float | None:
+            try:
+                return self.probe(mirror, timeout)
+            except Exception as e:
+                if self.events is not None:
+                    self.events.record("discovery", e, f"Probe failed: {e}", mirror=mirror)
+                return None
+
+        live: dict[str, float] = {}
+        dead: set[str] = set()
+        if not mirrors:
+            return live, dead
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(mirrors)))) as pool:
+            for mirror, latency in zip(mirrors, pool.map(probe, mirrors)):
+                if latency is None:
+                    dead.add(mirror)
+                else:
+                    live[mirror] = latency
+        return live, dead
@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from contextlib import closing
+from typing import TYPE_CHECKING, Any, Callable
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+if TYPE_CHECKING:
+    from calibre_plugins.store_annas_archive.events import EventLog
+
+__all__ = ("DownloadError", "SegmentedDownloader")
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_SEGMENT_SIZE = 4 * 1024 * 1024
+# Below this size the probe and journal overhead outweighs any parallelism
+MIN_SEGMENTED_SIZE = 8 * 1024 * 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+class _Source:
+    def __init__(self, url: str, size: int | None, ranges: bool) -> None:
+        self.url = url
+        self.size = size
+        self.ranges = ranges
+        self.failures = 0
+
+
+class SegmentedDownloader:
+    """
+    Downloads one file from one or more mirrors, splitting it into byte ranges that are fetched in parallel.
+
+    Progress is journaled next to the partial file so an interrupted download resumes where it stopped,
+    and the finished file is checked against the expected md5 before it is moved into place.
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        path: str,
+        md5: str | None = None,
+        connections: int = 4,
+        segment_size: int = DEFAULT_SEGMENT_SIZE,
+        timeout: int = 60,
+        max_failures: int = 3,
+        opener: Callable[..., Any] = urlopen,
+        events: EventLog | None = None,
+    ) -> None:
+        self.urls = list(dict.fromkeys(urls))
+        self.path = path
+        self.md5 = md5.lower() if md5 else None
+        self.connections = max(1, connections)
+        self.segment_size = max(CHUNK_SIZE, segment_size)
+        self.timeout = timeout
+        self.max_failures = max_failures
+        self.opener = opener
+        self.events = events
+
+        self.part_path = path + ".part"
+        self.journal_path = path + ".part.json"
+        self._lock = threading.Lock()
+        self._done: list[list[int]] = []
+
+    def download(self) -> str:
+        if not self.urls:
+            raise DownloadError("No download urls")
+
+        sources = [source for source in (self._probe(url) for url in self.urls) if source is not None]
+        if not sources:
+            raise DownloadError("None of the download urls could be reached")
+
+        size = sources[0].size
+        # Mirrors can only share the work when they agree on the file size, the md5 check catches the rest
+        parallel = [source for source in sources if source.ranges and source.size is not None and source.size == size]
+        if size is None or size < MIN_SEGMENTED_SIZE or not parallel:
+            self._download_single(sources)
+        else:
+            self._download_segmented(parallel, size)
+
+        self._verify()
+        os.replace(self.part_path, self.path)
+        self._remove(self.journal_path)
+        return self.path
+
+    def _probe(self, url: str) -> _Source | None:
+        # A one byte range request tells us both the size and whether ranges are honored
+        try:
+            with closing(self._open(url, "bytes=0-0")) as resp:
+                content_range = resp.headers.get("Content-Range", "")
+                if resp.status == 206 and "/" in content_range:
+                    total = content_range.rsplit("/", 1)[1]
+                    return _Source(url, int(total) if total.isdigit() else None, True)
+                length = resp.headers.get("Content-Length")
+                return _Source(url, int(length) if length and length.isdigit() else None, False)
+        except (OSError, ValueError) as e:
+            if self.events is not None:
+                self.events.record("download", e, url=url)
+            return None
+
+    def _open(self, url: str, byte_range: str | None = None) -> Any:
+        headers = {"Range": byte_range} if byte_range else {}
+        return self.opener(Request(url, headers=headers), timeout=self.timeout)
+
+    def _download_single(self, sources: list[_Source]) -> None:
+        if os.path.exists(self.journal_path):
+            # Left over from a segmented attempt, the partial file is preallocated and can't be appended to
+            self._remove(self.part_path)
+            self._remove(self.journal_path)
+        for source in sources:
+            offset = os.path.getsize(self.part_path) if source.ranges and os.path.exists(self.part_path) else 0
+            try:
+                with closing(self._open(source.url, f"bytes={offset}-" if offset else None)) as resp:
+                    if offset and resp.status != 206:
+                        offset = 0
+                    with open(self.part_path, "r+b" if offset else "wb") as f:
+                        f.seek(offset)
+                        for chunk in iter(lambda resp=resp: resp.read(CHUNK_SIZE), b""):
+                            f.write(chunk)
+                return
+            except (OSError, HTTPError, URLError) as e:
+                if self.events is not None:
+                    self.events.record("download", e, url=source.url)
+        raise DownloadError("All download urls failed")
+
+    def _download_segmented(self, sources: list[_Source], size: int) -> None:
+        self._load_journal(size)
+        if not os.path.exists(self.part_path) or os.path.getsize(self.part_path) != size:
+            with open(self.part_path, "wb") as f:
+                f.truncate(size)
+            # Whatever the journal says was downloaded isn't in the new file
+            self._done = []
+            self._save_journal(size)
+
+        done = {start for start, _ in self._done}
+        pending = [
+            (start, min(start + self.segment_size, size) - 1)
+            for start in range(0, size, self.segment_size)
+            if start not in done
+        ]
+        pending.reverse()
+        errors: list[Exception] = []
+
+        def worker(index: int) -> None:
+            while True:
+                with self._lock:
+                    if not pending or errors:
+                        return
+                    segment = pending.pop()
+                    live = [source for source in sources if source.failures < self.max_failures]
+                    if not live:
+                        errors.append(DownloadError("All download urls failed"))
+                        return
+                    # Spread the segments over the mirrors, each worker starting from a different one
+                    source = live[(index + len(done)) % len(live)]
+                try:
+                    self._fetch_segment(source, *segment)
+                except (OSError, HTTPError, URLError, DownloadError) as e:
+                    if self.events is not None:
+                        self.events.record("download", e, f"bytes {segment[0]}-{segment[1]}: {e}", url=source.url)
+                    with self._lock:
+                        source.failures += 1
+                        pending.append(segment)
+                    continue
+                with self._lock:
+                    done.add(segment[0])
+                    self._done.append(list(segment))
+                    self._save_journal(size)
+
+        threads = [
+            threading.Thread(target=worker, args=(i,), name=f"AnnasArchiveDownload-{i}", daemon=True)
+            for i in range(min(self.connections, len(pending)))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+        if pending:
+            raise DownloadError("Download did not complete")
+
+    def _fetch_segment(self, source: _Source, start: int, end: int) -> None:
+        with closing(self._open(source.url, f"bytes={start}-{end}")) as resp:
+            if resp.status != 206:
+                # The mirror ignored the range, writing its response at this offset would corrupt the file
+                source.failures = self.max_failures
+                raise DownloadError(f"'{source.url}' does not support byte ranges")
+            with open(self.part_path, "r+b") as f:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = resp.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise DownloadError("Connection closed before the segment was complete")
+                    f.write(chunk)
+                    remaining -= len(chunk)
+
+    def _load_journal(self, size: int) -> None:
+        self._done = []
+        try:
+            with open(self.journal_path) as f:
+                journal = json.load(f)
+        except (OSError, ValueError):
+            return
+        # A journal for a different file or segmentation can't be trusted
+        if (
+            journal.get("size") == size
+            and journal.get("segment_size") == self.segment_size
+            and journal.get("md5") == self.md5
+        ):
+            self._done = [list(segment) for segment in journal.get("done", [])]
+
+    def _save_journal(self, size: int) -> None:
+        tmp = self.journal_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"size": size, "segment_size": self.segment_size, "md5": self.md5, "done": self._done}, f)
+        os.replace(tmp, self.journal_path)
+
+    def _verify(self) -> None:
+        if not self.md5:
+            return
+        digest = hashlib.md5()
+        with open(self.part_path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        if digest.hexdigest() != self.md5:
+            # Start from scratch next time rather than resuming a corrupt file
+            self._remove(self.part_path)
+            self._remove(self.journal_path)
+            raise DownloadError(f"Downloaded file does not match md5 {self.md5}")
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
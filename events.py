@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import json
+import time
+from collections import deque
+from typing import Callable, NamedTuple
+
+__all__ = ("Event", "EventLog")
+
+
+class Event(NamedTuple):
+    time: float
+    stage: str
+    # Class name of the exception, empty for events that aren't failures
+    error: str
+    message: str
+    mirror: str | None = None
+    url: str | None = None
+    duration: float | None = None
+
+    def format(self) -> str:
+        parts = [time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.time)), self.stage]
+        if self.mirror:
+            parts.append(self.mirror)
+        if self.duration is not None:
+            parts.append(f"{self.duration:.2f}s")
+        parts.append(f"{self.error}: {self.message}" if self.error else self.message)
+        if self.url and self.url != self.mirror:
+            parts.append(f"<{self.url}>")
+        return " ".join(parts)
+
+
+class EventLog:
+    """
+    The last ``capacity`` diagnostic events of the plugin: failed requests, skipped mirrors and the like.
+
+    Recording one is a tuple and a deque append, no lock and no I/O, so it costs next to nothing on
+    the search path. The log is shown in the plugin settings and can be written out with ``write``.
+    With ``echo`` (calibre's debug mode) events are printed as well.
+    """
+
+    def __init__(self, capacity: int = 500, echo: bool = False, clock: Callable[[], float] = time.time) -> None:
+        # deque.append and deque.copy are atomic, the GIL is the only lock needed
+        self._events: deque[Event] = deque(maxlen=capacity)
+        self.echo = echo
+        self.clock = clock
+
+    def record(
+        self,
+        stage: str,
+        error: BaseException | None = None,
+        message: str = "",
+        mirror: str | None = None,
+        url: str | None = None,
+        duration: float | None = None,
+    ) -> None:
+        event = Event(
+            self.clock(),
+            stage,
+            type(error).__name__ if error is not None else "",
+            message or (str(error) if error is not None else ""),
+            mirror,
+            url,
+            duration,
+        )
+        self._events.append(event)
+        if self.echo:
+            print(event.format())
+
+    def events(self, stage: str | None = None) -> list[Event]:
+        """Oldest first."""
+        events = self._events.copy()
+        return [event for event in events if stage is None or event.stage == stage]
+
+    def counts(self) -> dict[tuple[str, str], int]:
+        """Number of events per (stage, error class), e.g. to see which mirror problems dominate."""
+        counts: dict[tuple[str, str], int] = {}
+        for event in self._events.copy():
+            counts[event.stage, event.error] = counts.get((event.stage, event.error), 0) + 1
+        return counts
+
+    def format(self) -> str:
+        return "\n".join(event.format() for event in self._events.copy())
+
+    def write(self, path: str) -> None:
+        """Write the events to ``path`` as JSON lines."""
+        with open(path, "w", encoding="utf-8") as f:
+            for event in self._events.copy():
+                f.write(json.dumps(event._asdict()) + "\n")
+
+    def clear(self) -> None:
+        self._events.clear()
+
+    def __len__(self) -> int:
+        return len(self._events)
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import queue
+import threading
+from typing import TYPE_CHECKING, Callable, Hashable, Iterator, TypeVar
+
+if TYPE_CHECKING:
+    from calibre_plugins.store_annas_archive.events import EventLog
+
+__all__ = ("merge_ranked",)
+
+T = TypeVar("T")
+
+_ROW = 0
+_DONE = 1
+
+
+class _Hit:
+    def __init__(self, item: object, order: int) -> None:
+        self.item = item
+        self.order = order
+        self.count = 0
+
+
+def merge_ranked(
+    sources: list[Callable[[], Iterator[T]]],
+    key: Callable[[T], Hashable],
+    max_workers: int = 4,
+    events: EventLog | None = None,
+) -> Iterator[T]:
+    """
+    Run several result generators concurrently and merge their items by key.
+
+    Items are ranked by how many sources returned them, ties keep the order they were first seen in.
+    An item is yielded as soon as no other item can overtake it any more, so the best hits come out
+    before the slowest source has finished. If every source fails, the first error is raised.
+    """
+    updates: queue.Queue[tuple[int, int, object]] = queue.Queue()
+    stop = threading.Event()
+    pending_sources = list(enumerate(sources))
+    lock = threading.Lock()
+
+    def worker() -> None:
+        while not stop.is_set():
+            with lock:
+                if not pending_sources:
+                    return
+                index, source = pending_sources.pop(0)
+            error: BaseException | None = None
+            iterator = None
+            try:
+                iterator = source()
+                for item in iterator:
+                    if stop.is_set():
+                        break
+                    updates.put((_ROW, index, item))
+            except Exception as e:
+                error = e
+            finally:
+                close = getattr(iterator, "close", None)
+                if close is not None:
+                    close()
+                updates.put((_DONE, index, error))
+
+    threads = [
+        threading.Thread(target=worker, name=f"AnnasArchiveFanout-{i}", daemon=True)
+        for i in range(max(1, min(max_workers, len(sources))))
+    ]
+    for thread in threads:
+        thread.start()
+
+    hits: dict[Hashable, _Hit] = {}
+    pending: list[_Hit] = []
+    errors: list[BaseException] = []
+    seen: set[tuple[int, Hashable]] = set()
+    running = len(sources)
+    try:
+        while running:
+            kind, index, payload = updates.get()
+            if kind == _DONE:
+                running -= 1
+                if payload is not None:
+                    errors.append(payload)  # type: ignore[arg-type]
+            else:
+                item_key = key(payload)  # type: ignore[arg-type]
+                if (index, item_key) in seen:
+                    continue
+                seen.add((index, item_key))
+                hit = hits.get(item_key)
+                if hit is None:
+                    hit = hits[item_key] = _Hit(payload, len(hits))
+                    pending.append(hit)
+                hit.count += 1
+
+            pending.sort(key=lambda h: (-h.count, h.order))
+            # Every still running source could return any pending (or unseen) item, so the leader
+            # is only safe once it's ahead of the runner-up by more than that
+            while pending:
+                runner_up = pending[1].count if len(pending) > 1 else 0
+                if pending[0].count < runner_up + running:
+                    break
+                yield pending.pop(0).item  # type: ignore[misc]
+
+        if errors and not hits:
+            raise errors[0]
+        for error in errors:
+            if events is not None:
+                events.record("search", error, f"Search variant failed: {error}")
+    finally:
+        stop.set()
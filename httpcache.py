@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+from email.message import Message
+from typing import TYPE_CHECKING, Any
+from urllib.error import HTTPError
+
+if TYPE_CHECKING:
+    from calibre_plugins.store_annas_archive.sharedcache import SharedCache
+
+__all__ = ("CachedResponse", "CachingBrowser", "ResponseCache")
+
+# Only pages that are fetched over and over are worth keeping
+CACHED_PATHS = ("/md5/", "/search?")
+
+
+class CachedResponse:
+    """Stands in for a browser response whose body has already been read."""
+
+    def __init__(self, body: bytes, url: str, headers: Any = None, code: int = 200) -> None:
+        self.body = body
+        self.url = url
+        self.headers = headers if headers is not None else Message()
+        self.code = code
+        self._offset = 0
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self.body) if size < 0 else self._offset + size
+        data = self.body[self._offset : end]
+        self._offset += len(data)
+        return data
+
+    def geturl(self) -> str:
+        return self.url
+
+    def info(self) -> Any:
+        return self.headers
+
+    def close(self) -> None:
+        pass
+
+
+class _StoringResponse:
+    """
+    Passes a fresh page through as it is read and caches it once it has been read to the end.
+
+    The body is read by the caller, so closing the response (e.g. on cancellation) interrupts it.
+    A page that wasn't read to the end, or was closed on the way, isn't cached: a response closed
+    under a read ends it early without an error, which would otherwise cache a truncated page.
+    """
+
+    def __init__(self, resp: Any, cache: ResponseCache, url: str) -> None:
+        self.resp = resp
+        self.cache = cache
+        self.url = url
+        self._chunks: list[bytes] | None = []
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.resp.read(size)
+        if self._chunks is not None:
+            self._chunks.append(data)
+            if size < 0 or not data:
+                self._store()
+        return data
+
+    def _store(self) -> None:
+        chunks, self._chunks = self._chunks, None
+        body = b"".join(chunks or ())
+        if chunks is None or not self._complete(body):
+            return
+        headers = self.resp.info()
+        self.cache.put(self.url, body, headers.get("ETag"), headers.get("Last-Modified"))
+
+    def _complete(self, body: bytes) -> bool:
+        # DecodedResponse knows whether the wire body ended, otherwise go by Content-Length
+        complete = getattr(self.resp, "complete", None)
+        if complete is not None:
+            return bool(complete)
+        length = self.resp.info().get("Content-Length")
+        return length is None or not length.strip().isdigit() or int(length) == len(body)
+
+    def close(self) -> None:
+        self._chunks = None
+        self.resp.close()
+
+    def __enter__(self) -> _StoringResponse:
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def __getattr__(self, name: str) -> Any:
+        # geturl, info, code, headers, ...
+        return getattr(self.resp, name)
+
+
+class ResponseCache:
+    """
+    Response bodies with their validators, kept in the plugin's shared cache (or an in-memory one).
+
+    Bodies and validators are separate entries, so a body evicted on its own is simply fetched
+    again. Size limits and eviction are those of the shared cache.
+    """
+
+    def __init__(self, cache: SharedCache) -> None:
+        self.cache = cache
+
+    def validators(self, url: str) -> dict[str, str]:
+        entry = self.cache.get("page.validators", url)
+        if entry is None:
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def get(self, url: str) -> bytes | None:
+        return self.cache.get("page", url)
+
+    def put(self, url: str, body: bytes, etag: str | None, last_modified: str | None) -> None:
+        if not etag and not last_modified:
+            # Nothing to revalidate with, so there is no point keeping it
+            self.remove(url)
+            return
+        self.cache.put("page", url, body)
+        self.cache.put("page.validators", url, {"etag": etag, "last_modified": last_modified})
+
+    def remove(self, url: str) -> None:
+        self.cache.delete("page.validators", url)
+        self.cache.delete("page", url)
+
+    def size(self) -> int:
+        return self.cache.size("page")
+
+
+class CachingBrowser:
+    """Wraps a calibre browser, revalidating cached md5 and search pages instead of downloading them again."""
+
+    def __init__(self, br: Any, cache: ResponseCache) -> None:
+        self.br = br
+        self.cache = cache
+
+    def open(self, url: Any, *args: Any, **kwargs: Any) -> Any:
+        if not isinstance(url, str) or not any(path in url for path in CACHED_PATHS):
+            return self.br.open(url, *args, **kwargs)
+
+        validators = self.cache.validators(url)
+        addheaders = self.br.addheaders
+        self.br.addheaders = list(addheaders) + list(validators.items())
+        try:
+            resp = self.br.open(url, *args, **kwargs)
+        except HTTPError as e:
+            if e.code != 304:
+                raise
+            resp = e
+        finally:
+            self.br.addheaders = addheaders
+
+        if getattr(resp, "code", 200) == 304:
+            body = self.cache.get(url)
+            if body is not None:
+                return CachedResponse(body, url, resp.info())
+            # Lost the body somehow, fetch it again without validators
+            self.cache.remove(url)
+            return self.br.open(url, *args, **kwargs)
+        if getattr(resp, "code", 200) != 200:
+            return resp
+        return _StoringResponse(resp, self.cache, url)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.br, name)
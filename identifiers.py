@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import re
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from calibre_plugins.store_annas_archive.parsing import Record
+    from calibre_plugins.store_annas_archive.sharedcache import SharedCache
+
+__all__ = ("IdentifierCache", "classify", "isbn10_to_isbn13")
+
+_MD5 = re.compile(r"^(?:md5:)?([0-9a-f]{32})$", re.IGNORECASE)
+_ISBN = re.compile(r"^(?:isbn(?:-1[03])?:?\s*)?([0-9][0-9\- ]{8,15}[0-9xX])$", re.IGNORECASE)
+_DOI = re.compile(r"^(?:doi:\s*|https?://(?:dx\.)?doi\.org/)?(10\.\d{4,9}/\S+)$", re.IGNORECASE)
+
+
+def _isbn10_valid(isbn: str) -> bool:
+    if not re.fullmatch(r"\d{9}[\dX]", isbn):
+        return False
+    total = sum((10 - i) * (10 if c == "X" else int(c)) for i, c in enumerate(isbn))
+    return total % 11 == 0
+
+
+def _isbn13_valid(isbn: str) -> bool:
+    if not re.fullmatch(r"97[89]\d{10}", isbn):
+        return False
+    return sum((3 if i % 2 else 1) * int(c) for i, c in enumerate(isbn)) % 10 == 0
+
+
+def isbn10_to_isbn13(isbn: str) -> str:
+    body = "978" + isbn[:9]
+    check = (10 - sum((3 if i % 2 else 1) * int(c) for i, c in enumerate(body)) % 10) % 10
+    return body + str(check)
+
+
+def classify(query: str) -> tuple[str, str] | None:
+    """
+    Recognize queries that name exactly one record.
+
+    Returns ("md5", md5), ("isbn", isbn13) or ("doi", doi), or None for a normal search.
+    ISBN-10s are converted to ISBN-13 so both forms share a cache entry.
+    """
+    query = query.strip()
+    match = _MD5.match(query)
+    if match:
+        return "md5", match.group(1).lower()
+    match = _ISBN.match(query)
+    if match:
+        isbn = re.sub(r"[\- ]", "", match.group(1)).upper()
+        if _isbn13_valid(isbn):
+            return "isbn", isbn
+        if _isbn10_valid(isbn):
+            return "isbn", isbn10_to_isbn13(isbn)
+    match = _DOI.match(query)
+    if match:
+        # DOIs are case insensitive
+        return "doi", match.group(1).lower()
+    return None
+
+
+class IdentifierCache:
+    """
+    Bounded LRU caches of identifier -> md5 mappings and of the records looked up by md5.
+
+    An empty md5 is remembered for an identifier that names several files, which can't be looked up directly.
+
+    With a shared cache, misses are looked up there and new entries written through, so other
+    calibre processes on the host benefit from each other's lookups.
+    """
+
+    # Records can be edited on Anna's Archive, the identifier mappings practically never change
+    record_ttl = 7 * 24 * 3600
+
+    def __init__(self, max_entries: int = 10000, shared: SharedCache | None = None) -> None:
+        self.max_entries = max_entries
+        self.shared = shared
+        self._md5s: OrderedDict[tuple[str, str], str] = OrderedDict()
+        self._records: OrderedDict[str, Record] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def md5_for(self, kind: str, value: str) -> str | None:
+        with self._lock:
+            md5 = self._md5s.get((kind, value))
+            if md5 is not None:
+                self._md5s.move_to_end((kind, value))
+                return md5
+        if self.shared is not None:
+            md5 = self.shared.get("identifier.file", f"{kind}:{value}")
+            if md5 is not None:
+                self._remember(self._md5s, (kind, value), md5)
+        return md5
+
+    def remember_md5(self, kind: str, value: str, md5: str) -> None:
+        self._remember(self._md5s, (kind, value), md5)
+        if self.shared is not None:
+            self.shared.put("identifier.file", f"{kind}:{value}", md5)
+
+    def record(self, md5: str) -> Record | None:
+        with self._lock:
+            record = self._records.get(md5)
+            if record is not None:
+                self._records.move_to_end(md5)
+                return record
+        if self.shared is not None:
+            stored = self.shared.get("record", md5)
+            if stored is not None:
+                record = tuple(stored)  # type: ignore[assignment]
+                self._remember(self._records, md5, record)
+        return record
+
+    def remember_record(self, md5: str, record: Record) -> None:
+        self._remember(self._records, md5, record)
+        if self.shared is not None:
+            self.shared.put("record", md5, list(record), ttl=self.record_ttl)
+
+    def _remember(self, entries: OrderedDict, key: Any, value: Any) -> None:
+        with self._lock:
+            entries[key] = value
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
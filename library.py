@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import re
+import threading
+import unicodedata
+from typing import TYPE_CHECKING, Any, Iterable
+
+if TYPE_CHECKING:
+    from calibre_plugins.store_annas_archive.events import EventLog
+
+__all__ = ("LibraryIndex", "author_key", "title_key")
+
+# Fields whose changes can change a book's keys
+_INDEXED_FIELDS = frozenset(("title", "authors", "identifiers"))
+_ARTICLES = re.compile(r"^(?:the|a|an)\s+")
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def _fold(text: str) -> str:
+    # "Les Misérables" and "Les Miserables" are the same book
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def title_key(title: str) -> str:
+    # Subtitles are often missing on one side, so only the main title counts
+    title = _fold(title).split(":", 1)[0]
+    title = _NON_WORD.sub(" ", title).strip()
+    return _ARTICLES.sub("", title)
+
+
+def author_key(authors: str | Iterable[str]) -> str:
+    """
+    Key of the first author, the same for "Jane Doe", "Doe, Jane" and "DOE Jane".
+
+    Anna's Archive gives all authors as one string separated by ";" or "&", calibre gives a list.
+    """
+    if isinstance(authors, str):
+        authors = re.split(r"\s*[;&]\s*", authors)
+    first = next(iter(authors), "")
+    return " ".join(sorted(_NON_WORD.sub(" ", _fold(first)).split()))
+
+
+class LibraryIndex:
+    """
+    In-memory index of the books in a calibre library by title + author and by identifier.
+
+    Building reads three columns for every book once, which takes a second or two for a couple
+    hundred thousand books, so it runs in a background thread. Afterwards the index listens to the
+    library's change events and only re-reads the books that were added, edited or removed, so
+    a lookup is a couple of dict hits.
+    """
+
+    def __init__(self, events: EventLog | None = None) -> None:
+        self.events = events
+        self.db: Any = None
+        self._keys: dict[tuple[str, str], int] = {}
+        self._book_keys: dict[int, list[tuple[str, str]]] = {}
+        self._dirty: set[int] = set()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def attach(self, db: Any) -> None:
+        """Index ``db`` (calibre's ``db.new_api``) in the background, unless it already is."""
+        with self._lock:
+            if db is self.db:
+                return
+            old, self.db = self.db, db
+            self._ready.clear()
+        if old is not None:
+            try:
+                old.remove_listener(self)
+            except Exception:
+                pass
+        threading.Thread(target=self._build, args=(db,), name="LibraryIndex", daemon=True).start()
+
+    def _build(self, db: Any) -> None:
+        try:
+            # Register first so changes made while building aren't lost
+            db.add_listener(self)
+            book_ids = db.all_book_ids()
+            keys, book_keys = {}, {}
+            self._read(db, book_ids, keys, book_keys)
+        except Exception as e:
+            if self.events is not None:
+                self.events.record("library", e, f"Failed to index the calibre library: {e}")
+            keys, book_keys = {}, {}
+        with self._lock:
+            if db is not self.db:
+                return
+            self._keys, self._book_keys = keys, book_keys
+            self._ready.set()
+
+    @staticmethod
+    def _read(
+        db: Any,
+        book_ids: Iterable[int],
+        keys: dict[tuple[str, str], int],
+        book_keys: dict[int, list[tuple[str, str]]],
+    ) -> None:
+        titles = db.all_field_for("title", book_ids, default_value="")
+        authors = db.all_field_for("authors", book_ids, default_value=())
+        identifiers = db.all_field_for("identifiers", book_ids, default_value={})
+        for book_id, title in titles.items():
+            own = [("title", f"{title_key(title)}\0{author_key(authors.get(book_id, ()))}")]
+            own += [(kind.lower(), value.lower()) for kind, value in identifiers.get(book_id, {}).items()]
+            for key in own:
+                keys[key] = book_id
+            book_keys[book_id] = own
+
+    def __call__(self, library_id: Any, event_type: Any, event_data: tuple[Any, ...]) -> None:
+        # Called by calibre's event dispatcher thread. The index holds a strong reference to itself
+        # through the store, calibre only keeps a weak one.
+        name = getattr(event_type, "name", event_type)
+        if name == "book_created":
+            book_ids = {event_data[0]}
+        elif name == "books_removed":
+            book_ids = set(event_data[0])
+        elif name == "metadata_changed" and event_data[0] in _INDEXED_FIELDS:
+            book_ids = set(event_data[1])
+        else:
+            return
+        with self._lock:
+            self._dirty |= book_ids
+
+    def _refresh(self) -> None:
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            db = self.db
+        if not dirty or db is None:
+            return
+        existing = [book_id for book_id in dirty if db.has_id(book_id)]
+        keys: dict[tuple[str, str], int] = {}
+        book_keys: dict[int, list[tuple[str, str]]] = {}
+        self._read(db, existing, keys, book_keys)
+        with self._lock:
+            for book_id in dirty:
+                for key in self._book_keys.pop(book_id, ()):
+                    if self._keys.get(key) == book_id:
+                        del self._keys[key]
+            self._keys.update(keys)
+            self._book_keys.update(book_keys)
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Wait for the index to be built and apply the changes made since the last call."""
+        if not self._ready.wait(timeout):
+            return False
+        self._refresh()
+        return True
+
+    def match(self, title: str, author: str, identifiers: Iterable[tuple[str, str]] = ()) -> int | None:
+        """The calibre book id of a book with one of ``identifiers`` or the same title and first author."""
+        for kind, value in identifiers:
+            book_id = self._keys.get((kind, value.lower()))
+            if book_id is not None:
+                return book_id
+        return self._keys.get(("title", f"{title_key(title)}\0{author_key(author)}"))
+
+    def __len__(self) -> int:
+        return len(self._book_keys)
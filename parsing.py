@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import multiprocessing
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pickle import PicklingError
+from typing import TYPE_CHECKING, Callable, Tuple, TypeVar
+
+from lxml import html
+
+if TYPE_CHECKING:
+    from calibre_plugins.store_annas_archive.events import EventLog
+
+__all__ = (
+    "Parser",
+    "Record",
+    "SearchRow",
+    "parse_download_links",
+    "parse_md5_page",
+    "parse_md5_links",
+    "parse_search_rows",
+)
+
+T = TypeVar("T")
+
+# md5, title, author, formats, cover_url, languages, sources, content
+SearchRow = Tuple[str, str, str, str, str, str, str, str]
+# title, author, formats, cover_url
+Record = Tuple[str, str, str, str]
+
+# The file details line reads like "English [en], .pdf, 🚀/lgli/zlib, 2.5MB, 📘 Book (non-fiction)"
+_EXTENSION = re.compile(r"(?:^|[\s,·])\.([a-z0-9]{2,5})\b", re.IGNORECASE)
+# "English [en], French [fr]"
+_LANGUAGE_CODE = re.compile(r"\[([\w\-]+)\]")
+
+
+def parse_search_rows(content: bytes) -> list[SearchRow]:
+    doc = html.fromstring(content)
+    rows: list[SearchRow] = []
+
+    # New layout uses divs, not table rows
+    for book in doc.xpath('//a[contains(@class, "js-vim-focus")]'):
+        # The anchor with 'js-vim-focus' is inside a td, which is inside a tr
+        # Structure: tr > td > a.js-vim-focus
+        try:
+            tr = book.getparent().getparent()
+        except AttributeError:
+            continue
+
+        md5 = book.get("href", "").split("/")[-1]
+        if not md5:
+            continue
+
+        try:
+            # Title is in the 2nd td (index 1)
+            # Use xpath to find all text within the cell to be safe
+            title = "".join(tr.xpath("./td[2]//text()")).strip()
+
+            # Author is in the 3rd td (index 2)
+            author = "".join(tr.xpath("./td[3]//text()")).strip() or "Unknown"
+
+            # Format is in the 10th td (index 9)
+            # "pdf", "epub", etc.
+            formats = "".join(tr.xpath("./td[10]//text()")).strip().upper() or "UNKNOWN"
+
+            # Cover image
+            # In the 1st td (index 0), inside a hidden div that appears on hover/focus
+            # <div id="hover_cover..."><img src="..."></div>
+            cover_src = tr.xpath("./td[1]//img/@src")
+            # The first img might be the small cover or the large hover one.
+            # Usually there are two images in the first td.
+            cover_url = cover_src[0] if cover_src else ""
+
+            # Source, language and content are the 7th, 8th and 9th td, kept so that results can be
+            # filtered again without a new search. "🚀/lgli/zlib" -> "lgli,zlib", "📗 Book (fiction)" -> "book (fiction)"
+            sources = ",".join(re.findall(r"[a-z0-9]+", "".join(tr.xpath("./td[7]//text()")).lower()))
+            languages = ",".join(_LANGUAGE_CODE.findall("".join(tr.xpath("./td[8]//text()"))))
+            content = re.sub(r"^[^\w(]+", "", "".join(tr.xpath("./td[9]//text()")).strip().lower())
+        except IndexError:
+            # If table structure is different (e.g. mobile view or change), fail gracefully for this item
+            continue
+
+        rows.append((md5, title, author, formats, cover_url, languages, sources, content))
+    return rows
+
+
+def parse_download_links(content: bytes) -> list[tuple[str, str]]:
+    doc = html.fromstring(content)
+    return [
+        (link.get("href"), "".join(link.itertext()))
+        for link in doc.xpath(
+            '//div[@id="md5-panel-downloads"]/ul[contains(@class, "list-inside")]/li/a[contains(@class, "js-download-link")]'
+        )
+    ]
+
+
+def parse_md5_links(content: bytes) -> list[str]:
+    doc = html.fromstring(content)
+    return [href.split("/")[-1] for href in doc.xpath('//a[starts-with(@href, "/md5/")]/@href')]
+
+
+def parse_md5_page(content: bytes) -> Record | None:
+    doc = html.fromstring(content)
+    title = "".join(doc.xpath('//meta[@property="og:title"]/@content')).strip()
+    if not title:
+        title = "".join(doc.xpath('(//div[contains(@class, "text-3xl")])[1]//text()')).replace("🔍", "").strip()
+    if not title:
+        return None
+
+    author = "".join(doc.xpath('(//div[contains(@class, "italic")])[1]//text()')).replace("🔍", "").strip()
+
+    details = " ".join(doc.xpath('//div[contains(@class, "text-gray-500")]//text()'))
+    extension = _EXTENSION.search(details)
+
+    cover = doc.xpath('//meta[@property="og:image"]/@content') or doc.xpath("//img/@src")
+    return (
+        title,
+        author or "Unknown",
+        extension.group(1).upper() if extension else "UNKNOWN",
+        cover[0] if cover else "",
+    )
+
+
+class Parser:
+    """
+    Runs the parse functions above, in a pool of worker processes when processes > 0.
+
+    Only the page bytes go to the workers and only the extracted tuples come back, so parsing
+    scales across cores instead of holding the GIL. The workers are forked when the Parser is
+    created, which the store does before it starts any thread: a process forked while other
+    threads run can deadlock on a lock one of them held. So the pool is never started later, if it
+    can't be started or breaks (e.g. a worker is killed) parsing runs in-process for good.
+    """
+
+    def __init__(self, processes: int = 0, events: EventLog | None = None) -> None:
+        self.events = events
+        self.processes = processes
+        self._lock = threading.Lock()
+        self._pool = self._start_pool() if processes > 0 else None
+
+    def _start_pool(self) -> ProcessPoolExecutor | None:
+        # Forked workers inherit calibre's plugin importer, spawned ones would have to find it themselves
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        pool = None
+        try:
+            pool = ProcessPoolExecutor(self.processes, mp_context=context)
+            # The pool starts workers as jobs come in, this starts all of them now
+            for future in [pool.submit(int) for _ in range(self.processes)]:
+                future.result()
+        except (BrokenProcessPool, OSError) as e:
+            if self.events is not None:
+                self.events.record("parse", e, f"Failed to start the parse worker pool, parsing in-process: {e}")
+            if pool is not None:
+                pool.shutdown(wait=False)
+            return None
+        return pool
+
+    def run(self, fn: Callable[[bytes], T], content: bytes) -> T:
+        pool = self._pool
+        if pool is not None:
+            try:
+                return pool.submit(fn, content).result()
+            except (BrokenProcessPool, PicklingError, ImportError, AttributeError, OSError) as e:
+                if self.events is not None:
+                    self.events.record("parse", e, f"Parse worker pool failed, parsing in-process from now on: {e}")
+                self.close()
+        return fn(content)
+
+    def close(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Hashable
+
+if TYPE_CHECKING:
+    from calibre_plugins.store_annas_archive.cancellation import CancelToken
+
+__all__ = ("Prefetcher",)
+
+
+class Prefetcher:
+    """
+    Runs speculative lookups on a small pool of background threads for whoever asks first.
+
+    Every search starts a new generation with ``restart``, which cancels what the previous one still
+    has queued or running. ``take`` hands over a finished result, waits for a running one, and takes
+    back one that hasn't started yet, so a caller never waits behind the queue. Results are kept for
+    ``ttl`` seconds, at most ``max_entries`` of them.
+    """
+
+    def __init__(self, workers: int = 2, ttl: float = 600, max_entries: int = 64) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="AnnasArchivePrefetch")
+        self._lock = threading.Lock()
+        self._token: CancelToken | None = None
+        self._entries: dict[Hashable, tuple[Future[Any], float]] = {}
+
+    def restart(self, token: CancelToken) -> CancelToken:
+        """Cancel the current generation and make ``token`` the next one's."""
+        with self._lock:
+            old, self._token = self._token, token
+            for key, (future, _) in list(self._entries.items()):
+                if not future.done():
+                    future.cancel()
+                    del self._entries[key]
+        if old is not None:
+            # Closes the responses the running lookups are reading
+            old.cancel()
+        return token
+
+    def submit(self, key: Hashable, fn: Callable[[CancelToken], Any], token: CancelToken, timeout: float) -> None:
+        """Run ``fn`` with a ``timeout`` budget from ``token`` unless ``key`` is already being fetched."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not (entry[0].done() and (entry[0].exception() or now - entry[1] > self.ttl)):
+                return
+            if token.cancelled or self._pool is None:
+                return
+            self._entries[key] = (self._pool.submit(self._run, fn, token, timeout), now)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._entries.pop(oldest)[0].cancel()
+
+    @staticmethod
+    def _run(fn: Callable[[CancelToken], Any], token: CancelToken, timeout: float) -> Any:
+        budget = token.child(timeout)
+        try:
+            return fn(budget)
+        finally:
+            budget.cancel()
+
+    def take(self, key: Hashable, timeout: float | None = None) -> tuple[bool, Any]:
+        """``(True, result)`` if ``key`` was prefetched, or is done within ``timeout``, else ``(False, None)``."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            return False, None
+        future, started = entry
+        if future.cancel() or time.monotonic() - started > self.ttl:
+            return False, None
+        try:
+            return True, future.result(timeout)
+        except Exception:
+            # Cancelled, too slow or failed, the caller's own attempt reports what went wrong
+            return False, None
+
+    def close(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+            token, self._token = self._token, None
+            entries, self._entries = self._entries, {}
+        for future, _ in entries.values():
+            future.cancel()
+        if token is not None:
+            token.cancel()
+        if pool is not None:
+            pool.shutdown(wait=False)
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import cProfile
+import glob
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import TYPE_CHECKING, Any, Callable, ContextManager, Iterator, TypeVar
+
+if TYPE_CHECKING:
+    from calibre_plugins.store_annas_archive.events import EventLog
+
+__all__ = ("PROFILE_ENV", "Tracer", "profile_mode")
+
+T = TypeVar("T")
+
+PROFILE_ENV = "ANNAS_ARCHIVE_PROFILE"
+MODES = ("cprofile", "trace")
+
+# Python 3.12+ allows one active profiler per process, so concurrent calls take turns at being profiled
+_PROFILER = threading.Lock()
+
+
+def profile_mode(enabled: bool) -> str | None:
+    # The environment variable wins so a profile can be captured without touching the settings
+    env = os.environ.get(PROFILE_ENV, "").strip().lower()
+    if env in MODES:
+        return env
+    if env in ("1", "true", "yes", "on"):
+        return "cprofile"
+    if env in ("0", "false", "no", "off"):
+        return None
+    return "cprofile" if enabled else None
+
+
+class _Trace:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.events: list[dict[str, Any]] = []
+        self.profile: cProfile.Profile | None = None
+        # Whether the profiler ever got to run, a call that never did has no profile to write
+        self.profiled = False
+
+
+class Tracer:
+    """
+    Opt-in profiling of the search pipeline.
+
+    Every traced call writes a Chrome trace-format JSON file (open it in chrome://tracing or Perfetto)
+    of the spans recorded while it ran, and in "cprofile" mode a cProfile dump next to it. Only one
+    call at a time is profiled, calls running alongside it (or alongside another profiler) record
+    their spans only. Only the newest ``keep`` calls are kept. When disabled every method is a cheap
+    pass-through.
+    """
+
+    def __init__(self, directory: str, mode: str | None = None, keep: int = 20, events: EventLog | None = None) -> None:
+        self.directory = directory
+        self.mode = mode
+        self.keep = keep
+        self.events = events
+        self._local = threading.local()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode is not None
+
+    def span(self, name: str, **args: Any) -> ContextManager[None]:
+        trace: _Trace | None = getattr(self._local, "trace", None)
+        if trace is None:
+            return nullcontext()
+        return self._span(trace, name, args)
+
+    @contextmanager
+    def _span(self, trace: _Trace, name: str, args: dict[str, Any]) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            args["error"] = type(e).__name__
+            raise
+        finally:
+            trace.events.append(self._event(name, start, time.perf_counter(), args))
+
+    def call(self, name: str, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        if not self.enabled:
+            return fn(*args, **kwargs)
+        if getattr(self._local, "trace", None) is not None:
+            # Already inside a traced call, so this is just another span of it
+            with self.span(name):
+                return fn(*args, **kwargs)
+        trace = self._begin(name)
+        start = time.perf_counter()
+        try:
+            return self._step(trace, fn, *args, **kwargs)
+        finally:
+            self._end(trace, start)
+
+    def generator(self, name: str, iterator: Iterator[T], **args: Any) -> Iterator[T]:
+        if not self.enabled:
+            yield from iterator
+            return
+        trace = self._begin(name)
+        start = time.perf_counter()
+        count = 0
+        try:
+            while True:
+                # Only the time spent producing items is ours, not the time calibre spends consuming them
+                try:
+                    item = self._step(trace, next, iterator)
+                except StopIteration:
+                    return
+                count += 1
+                yield item
+        finally:
+            args["results"] = count
+            trace.events.insert(0, self._event(name, start, time.perf_counter(), args))
+            self._write(trace)
+
+    def _begin(self, name: str) -> _Trace:
+        trace = _Trace(name)
+        if self.mode == "cprofile":
+            trace.profile = cProfile.Profile()
+        return trace
+
+    def _step(self, trace: _Trace, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        previous = getattr(self._local, "trace", None)
+        self._local.trace = trace
+        profile = trace.profile if trace.profile is not None and self._enable(trace.profile) else None
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if profile is not None:
+                profile.disable()
+                _PROFILER.release()
+                trace.profiled = True
+            self._local.trace = previous
+
+    @staticmethod
+    def _enable(profile: cProfile.Profile) -> bool:
+        if not _PROFILER.acquire(blocking=False):
+            return False
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiling tool is already active, e.g. calibre-debug's own
+            _PROFILER.release()
+            return False
+        return True
+
+    def _end(self, trace: _Trace, start: float) -> None:
+        trace.events.insert(0, self._event(trace.name, start, time.perf_counter(), {}))
+        self._write(trace)
+
+    @staticmethod
+    def _event(name: str, start: float, end: float, args: dict[str, Any]) -> dict[str, Any]:
+        return {
+            "name": name,
+            "ph": "X",
+            "ts": int(start * 1_000_000),
+            "dur": int((end - start) * 1_000_000),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": {key: str(value) for key, value in args.items()},
+        }
+
+    def _write(self, trace: _Trace) -> None:
+        stem = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{next(self._counter):04d}-{trace.name}")
+        try:
+            with self._lock:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(stem + ".json", "w") as f:
+                    json.dump({"traceEvents": trace.events, "displayTimeUnit": "ms"}, f)
+                if trace.profile is not None and trace.profiled:
+                    trace.profile.dump_stats(stem + ".prof")
+                self._rotate()
+        except OSError as e:
+            # Profiling must never break a search
+            if self.events is not None:
+                self.events.record("profile", e, f"Failed to write profile '{stem}': {e}")
+
+    def _rotate(self) -> None:
+        for pattern in ("*.json", "*.prof"):
+            files = sorted(glob.glob(os.path.join(self.directory, pattern)), key=os.path.getmtime, reverse=True)
+            for path in files[self.keep :]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import itertools
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+from urllib.request import ProxyHandler, build_opener, urlopen
+
+if TYPE_CHECKING:
+    from calibre_plugins.store_annas_archive.events import EventLog
+
+__all__ = ("ProxiedBrowser", "ProxyPool", "normalize_proxy")
+
+STRATEGIES = ("round_robin", "least_loaded")
+
+
+def normalize_proxy(proxy: str) -> str | None:
+    """``http://[user:password@]host:port`` for ``proxy``, None for anything but an http(s) proxy."""
+    proxy = proxy.strip()
+    if not proxy:
+        return None
+    if "://" not in proxy:
+        proxy = "http://" + proxy
+    parts = urlsplit(proxy)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return None
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _proxy_failed(error: BaseException) -> bool:
+    # An HTTP answer means the proxy got through, whatever the mirror said, unless the proxy itself refused
+    if isinstance(error, HTTPError):
+        return error.code == 407
+    return isinstance(error, OSError)
+
+
+class _Proxy:
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.in_flight = 0
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency: float | None = None
+        self.down_until = 0.0
+
+
+class _LeasedResponse:
+    """A response that keeps its proxy leased until it is closed, as the body comes through the proxy too."""
+
+    def __init__(self, resp: Any, release: Callable[[BaseException | None], None]) -> None:
+        self.resp = resp
+        self._release = release
+        self._lock = threading.Lock()
+        self._closed = False
+        self._error: BaseException | None = None
+
+    def read(self, *args: Any) -> bytes:
+        try:
+            return self.resp.read(*args)
+        except BaseException as e:
+            # Reads fail once the response is closed under them, e.g. by a cancelled search
+            if not self._closed:
+                self._error = e
+            raise
+
+    def close(self) -> None:
+        with self._lock:
+            closed, self._closed = self._closed, True
+        try:
+            self.resp.close()
+        finally:
+            if not closed:
+                self._release(self._error)
+
+    def __enter__(self) -> _LeasedResponse:
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def __getattr__(self, name: str) -> Any:
+        # geturl, info, code, headers, ...
+        return getattr(self.resp, name)
+
+
+class ProxyPool:
+    """
+    The proxies all plugin requests go out through, balanced round robin or to the least loaded one.
+
+    A proxy that fails ``max_failures`` requests in a row (connection errors and timeouts, not HTTP
+    errors from the mirror) is taken out of rotation for ``cooldown`` seconds, doubling with each
+    further failure up to ten minutes. If every proxy is out, the one that comes back first is used
+    anyway rather than failing the request. An empty pool sends requests directly.
+    """
+
+    def __init__(
+        self,
+        proxies: list[str] | None = None,
+        strategy: str = "round_robin",
+        max_failures: int = 3,
+        cooldown: float = 60,
+        clock: Callable[[], float] = time.monotonic,
+        events: EventLog | None = None,
+    ) -> None:
+        self.events = events
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._proxies: list[_Proxy] = []
+        self._openers: dict[str, Any] = {}
+        self._counter = itertools.count()
+        self.configure(proxies or [], strategy)
+
+    def configure(self, proxies: list[str], strategy: str = "round_robin") -> None:
+        """Use ``proxies`` from now on, keeping the stats of the ones that were already in the pool."""
+        urls = []
+        for proxy in proxies:
+            url = normalize_proxy(proxy)
+            if url is None:
+                if self.events is not None:
+                    self.events.record("proxy", message=f"Ignoring proxy {proxy!r}, only http proxies are supported")
+            elif url not in urls:
+                urls.append(url)
+        with self._lock:
+            known = {proxy.url: proxy for proxy in self._proxies}
+            self._proxies = [known.get(url) or _Proxy(url) for url in urls]
+            self.strategy = strategy if strategy in STRATEGIES else "round_robin"
+
+    def __len__(self) -> int:
+        return len(self._proxies)
+
+    def acquire(self) -> _Proxy | None:
+        with self._lock:
+            if not self._proxies:
+                return None
+            now = self.clock()
+            candidates = [proxy for proxy in self._proxies if proxy.down_until <= now]
+            if not candidates:
+                candidates = [min(self._proxies, key=lambda proxy: proxy.down_until)]
+            if self.strategy == "least_loaded":
+                proxy = min(candidates, key=lambda p: (p.in_flight, p.latency or 0.0))
+            else:
+                proxy = candidates[next(self._counter) % len(candidates)]
+            proxy.in_flight += 1
+            return proxy
+
+    def release(self, proxy: _Proxy, success: bool, latency: float) -> None:
+        with self._lock:
+            proxy.in_flight -= 1
+            if success:
+                proxy.successes += 1
+                proxy.consecutive_failures = 0
+                proxy.down_until = 0.0
+                proxy.latency = latency if proxy.latency is None else 0.7 * proxy.latency + 0.3 * latency
+                return
+            proxy.failures += 1
+            proxy.consecutive_failures += 1
+            if proxy.consecutive_failures >= self.max_failures:
+                backoff = min(self.cooldown * 2 ** (proxy.consecutive_failures - self.max_failures), 600)
+                proxy.down_until = self.clock() + backoff
+                if self.events is not None:
+                    self.events.record("proxy", message=f"Out of rotation for {backoff:.0f}s", url=proxy.url)
+
+    def open(self, request: Callable[[str | None], Any]) -> Any:
+        """
+        ``request(proxy)`` through the next proxy, or with None to go direct.
+
+        The proxy stays leased until the response is closed, and whether the request and the reads of its
+        body got through is recorded. Its latency is the time until the response arrived.
+        """
+        proxy = self.acquire()
+        if proxy is None:
+            return request(None)
+        start = self.clock()
+        try:
+            resp = request(proxy.url)
+        except BaseException as e:
+            self.release(proxy, not _proxy_failed(e), self.clock() - start)
+            raise
+        latency = self.clock() - start
+        return _LeasedResponse(resp, lambda e: self.release(proxy, e is None or not _proxy_failed(e), latency))
+
+    def _opener(self, proxy: str | None) -> Callable[..., Any]:
+        if proxy is None:
+            return urlopen
+        with self._lock:
+            opener = self._openers.get(proxy)
+            if opener is None:
+                opener = self._openers[proxy] = build_opener(ProxyHandler({"http": proxy, "https": proxy})).open
+            return opener
+
+    def urlopen(self, call: Callable[..., Any]) -> Callable[..., Any]:
+        """
+        A urlopen style callable that sends each request through the next proxy.
+
+        ``call(opener, request, *args, scope=proxy, **kwargs)`` makes the request, e.g. ``RateLimiter.call``.
+        """
+
+        def open_proxied(request: Any, *args: Any, **kwargs: Any) -> Any:
+            return self.open(lambda proxy: call(self._opener(proxy), request, *args, scope=proxy or "", **kwargs))
+
+        return open_proxied
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        now = self.clock()
+        with self._lock:
+            return {
+                proxy.url: {
+                    "in_flight": proxy.in_flight,
+                    "successes": proxy.successes,
+                    "failures": proxy.failures,
+                    "latency": proxy.latency,
+                    "out_for": max(0.0, proxy.down_until - now),
+                }
+                for proxy in self._proxies
+            }
+
+
+class ProxiedBrowser:
+    """
+    Wraps a RateLimitedBrowser, sending each request through the next proxy of ``pool``.
+
+    Each proxy gets its own rate limits, so adding proxies adds throughput.
+    """
+
+    def __init__(self, br: Any, pool: ProxyPool) -> None:
+        self.br = br
+        self.pool = pool
+        self._proxy: str | None = None
+
+    def open(self, url: Any, *args: Any, **kwargs: Any) -> Any:
+        def request(proxy: str | None) -> Any:
+            # Without a proxy the browser keeps calibre's own proxy settings
+            if proxy is not None and proxy != self._proxy:
+                self.br.set_proxies({"http": proxy, "https": proxy})
+                self._proxy = proxy
+            return self.br.open(url, *args, scope=proxy or "", **kwargs)
+
+        return self.pool.open(request)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.br, name)
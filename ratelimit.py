@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import threading
+import time
+from email.message import Message
+from email.utils import parsedate_to_datetime
+from typing import TYPE_CHECKING, Any, Callable
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+
+if TYPE_CHECKING:
+    from calibre_plugins.store_annas_archive.cancellation import CancelToken
+
+__all__ = ("THROTTLED", "RateLimiter", "RateLimitedBrowser", "Throttled", "TokenBucket", "parse_retry_after")
+
+# Status codes that mean "slow down" rather than "this mirror is dead"
+THROTTLED = (429, 503)
+
+
+def parse_retry_after(value: str | None, now: float | None = None) -> float | None:
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        # The other allowed form is an HTTP date
+        when = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+    return max(0.0, when - (time.time() if now is None else now))
+
+
+class Throttled(HTTPError):
+    """
+    A request given up on because the host's turn is further away than the caller may wait.
+
+    It is a 429, so callers treat it like the host throttling them: another mirror is tried.
+    """
+
+    def __init__(self, url: str, wait: float) -> None:
+        super().__init__(url, 429, f"Rate limited for another {wait:.1f}s", Message(), None)
+        self.wait = wait
+
+
+def _url_of(request: Any) -> str:
+    return request.get_full_url() if hasattr(request, "get_full_url") else str(request)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = now
+
+    def reserve(self, now: float) -> float:
+        """Take a token, returning how long to wait before it may be used."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        # Going negative queues callers behind each other instead of letting them all retry at once
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class _HostState:
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        self.base_rate = rate
+        self.bucket = TokenBucket(rate, burst, now)
+        self.blocked_until = 0.0
+        self.backoff = 0.0
+
+
+class RateLimiter:
+    """
+    Per-host token buckets shared by every request the plugin makes.
+
+    A throttled response halves the host's rate and blocks it for the Retry-After time (or an
+    exponential backoff when there is none), each success then wins back a tenth of the rate.
+    Requests in different ``scope``s (e.g. sent through different proxies) have separate buckets,
+    since the host sees them coming from different addresses.
+    """
+
+    def __init__(
+        self,
+        rate: float = 2.0,
+        burst: float = 4,
+        max_backoff: float = 120,
+        hosts: dict[str, tuple[float, float]] | None = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_backoff = max_backoff
+        self.hosts = dict(hosts or {})
+        self.clock = clock
+        self.sleep = sleep
+        self._states: dict[tuple[str, str], _HostState] = {}
+        self._lock = threading.Lock()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._states.clear()
+
+    def _state(self, url: str, scope: str) -> _HostState:
+        host = urlsplit(url).hostname or url
+        state = self._states.get((scope, host))
+        if state is None:
+            rate, burst = self.hosts.get(host, (self.rate, self.burst))
+            state = self._states[(scope, host)] = _HostState(rate, burst, self.clock())
+        return state
+
+    def delay(self, url: str, scope: str = "", limit: float | None = None) -> float:
+        """How long to wait for the host's turn. A turn further away than ``limit`` isn't taken."""
+        with self._lock:
+            state = self._state(url, scope)
+            now = self.clock()
+            wait = max(state.blocked_until - now, state.bucket.reserve(now))
+            if limit is not None and wait > limit:
+                state.bucket.tokens += 1
+            return wait
+
+    def acquire(
+        self, url: str, scope: str = "", max_wait: float | None = None, token: CancelToken | None = None
+    ) -> float:
+        """
+        Wait for the host's turn, raising Throttled right away if that is more than ``max_wait`` or
+        the time left to ``token``. Cancelling ``token`` ends the wait with Cancelled.
+        """
+        limit = max_wait
+        remaining = token.remaining() if token is not None else None
+        if remaining is not None:
+            limit = remaining if limit is None else min(limit, remaining)
+        wait = self.delay(url, scope, limit)
+        if limit is not None and wait > limit:
+            raise Throttled(url, wait)
+        if wait > 0:
+            if token is not None:
+                token.wait(wait)
+                token.check()
+            else:
+                self.sleep(wait)
+        return wait
+
+    def throttled(self, url: str, retry_after: str | None = None, scope: str = "") -> float:
+        with self._lock:
+            state = self._state(url, scope)
+            now = self.clock()
+            state.backoff = min(self.max_backoff, state.backoff * 2 if state.backoff else 1.0)
+            wait = parse_retry_after(retry_after)
+            if wait is None:
+                wait = state.backoff
+            state.blocked_until = max(state.blocked_until, now + min(wait, self.max_backoff))
+            state.bucket.rate = max(state.base_rate / 16, state.bucket.rate / 2)
+            return state.blocked_until - now
+
+    def succeeded(self, url: str, scope: str = "") -> None:
+        with self._lock:
+            state = self._state(url, scope)
+            state.backoff = 0.0
+            state.bucket.rate = min(state.base_rate, state.bucket.rate + state.base_rate / 10)
+
+    def call(
+        self,
+        opener: Callable[..., Any],
+        request: Any,
+        *args: Any,
+        max_wait: float = 30,
+        retries: int = 2,
+        scope: str = "",
+        token: CancelToken | None = None,
+        **kwargs: Any,
+    ) -> Any:
+        """
+        Open request with opener, waiting for the host's turn and retrying throttled responses.
+
+        No wait is longer than ``max_wait`` or outlasts ``token``, the request fails with Throttled instead.
+        """
+        url = _url_of(request)
+        for attempt in range(retries + 1):
+            self.acquire(url, scope, max_wait, token)
+            try:
+                resp = opener(request, *args, **kwargs)
+            except HTTPError as e:
+                if e.code not in THROTTLED:
+                    raise
+                if self.throttled(url, e.headers.get("Retry-After"), scope) > max_wait or attempt == retries:
+                    raise
+                continue
+            # Some openers hand back error responses instead of raising
+            if getattr(resp, "code", 200) in THROTTLED:
+                if self.throttled(url, resp.info().get("Retry-After"), scope) <= max_wait and attempt < retries:
+                    resp.close()
+                    continue
+                return resp
+            self.succeeded(url, scope)
+            return resp
+
+    def wrap(self, opener: Callable[..., Any], max_wait: float = 30, retries: int = 2) -> Callable[..., Any]:
+        """Rate limit a urlopen style callable."""
+        return lambda request, *args, scope="", **kwargs: self.call(
+            opener, request, *args, max_wait=max_wait, retries=retries, scope=scope, **kwargs
+        )
+
+
+class RateLimitedBrowser:
+    """
+    Wraps a calibre browser so that every open goes through the rate limiter.
+
+    Waits for a turn end with the search or lookup ``token`` the browser was made for.
+    """
+
+    def __init__(
+        self,
+        br: Any,
+        limiter: RateLimiter,
+        max_wait: float = 30,
+        retries: int = 2,
+        token: CancelToken | None = None,
+    ) -> None:
+        self.br = br
+        self.limiter = limiter
+        self.max_wait = max_wait
+        self.retries = retries
+        self.token = token
+
+    def open(self, request: Any, *args: Any, scope: str = "", **kwargs: Any) -> Any:
+        return self.limiter.call(
+            self.br.open,
+            request,
+            *args,
+            max_wait=self.max_wait,
+            retries=self.retries,
+            scope=scope,
+            token=self.token,
+            **kwargs,
+        )
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.br, name)
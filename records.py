@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import sys
+from typing import Any, Callable
+
+__all__ = ("ResultRecord",)
+
+
+class ResultRecord:
+    """
+    Compact form of a search result used inside the plugin's pipeline and caches.
+
+    Uses __slots__ instead of a per-instance __dict__, interns the strings that repeat across
+    rows (authors and formats) and only creates a downloads dict once one is needed. Records
+    become calibre SearchResults only when they are handed to calibre.
+    """
+
+    __slots__ = (
+        "md5",
+        "title",
+        "author",
+        "formats",
+        "cover_url",
+        "languages",
+        "sources",
+        "content",
+        "_downloads",
+    )
+
+    def __init__(
+        self,
+        md5: str,
+        title: str,
+        author: str,
+        formats: str,
+        cover_url: str,
+        languages: str = "",
+        sources: str = "",
+        content: str = "",
+    ) -> None:
+        self.md5 = md5
+        self.title = title
+        self.author = sys.intern(author)
+        self.formats = sys.intern(formats)
+        self.cover_url = cover_url
+        # Comma separated language and source codes and the content type, for filtering results locally
+        self.languages = sys.intern(languages)
+        self.sources = sys.intern(sources)
+        self.content = sys.intern(content)
+        self._downloads: dict[str, str] | None = None
+
+    @property
+    def downloads(self) -> dict[str, str]:
+        if self._downloads is None:
+            self._downloads = {}
+        return self._downloads
+
+    def __repr__(self) -> str:
+        return f"ResultRecord({self.md5!r}, {self.title!r}, {self.author!r}, {self.formats!r})"
+
+    def to_row(self) -> tuple[str, str, str, str, str, str, str, str]:
+        """The fields in the order ``ResultRecord(*row)`` takes them, for storing records outside the process."""
+        return (
+            self.md5,
+            self.title,
+            self.author,
+            self.formats,
+            self.cover_url,
+            self.languages,
+            self.sources,
+            self.content,
+        )
+
+    def to_search_result(self, factory: Callable[[], Any], library_id: int | None = None) -> Any:
+        """
+        A calibre search result for this record, ``library_id`` being the same book's id in the calibre library.
+
+        Records are shared between searches through the caches, so whether one is in the library
+        is only known to the search that checked it and never stored on the record.
+        """
+        s = factory()
+        s.detail_item = self.md5
+        s.title = self.title
+        s.author = self.author
+        s.formats = self.formats
+        s.cover_url = self.cover_url
+        s.price = "$0.00" if library_id is None else "In library"
+        s.drm = factory.DRM_UNLOCKED  # type: ignore[attr-defined]
+        if self._downloads:
+            s.downloads.update(self._downloads)
+        return s
@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Any, Callable
+
+from lxml import html
+
+if TYPE_CHECKING:
+    from calibre_plugins.store_annas_archive.cancellation import CancelToken
+
+__all__ = (
+    "DEFAULT_RESOLVERS",
+    "LibgenResolver",
+    "Resolver",
+    "ResolverRegistry",
+    "SciHubResolver",
+    "ZLibraryResolver",
+)
+
+
+class Resolver(ABC):
+    """
+    Turns one kind of download link from an md5 page into a direct download url.
+
+    Subclass it, set ``name`` and ``link_texts`` (or override ``matches``) and implement
+    ``resolve``, then register an instance with the store's ``resolvers``. ``timeout`` is the
+    budget for one resolution, higher ``priority`` resolvers are tried and listed first.
+    Links no resolver matches are left out, e.g. Libgen.li's, whose Cloudflare "Phishing Warning"
+    pages can't be passed.
+    """
+
+    name = ""
+    link_texts: tuple[str, ...] = ()
+    priority = 0
+    timeout = 15.0
+    enabled = True
+
+    def matches(self, link_text: str, url: str) -> bool:
+        return link_text in self.link_texts
+
+    @abstractmethod
+    def resolve(self, url: str, br: Any, token: CancelToken) -> str | None:
+        """The direct download url behind ``url``, or None if its page doesn't have one."""
+
+
+class LibgenResolver(Resolver):
+    name = "Libgen.rs"
+    link_texts = ("Libgen.rs Fiction", "Libgen.rs Non-Fiction")
+    priority = 30
+
+    def resolve(self, url: str, br: Any, token: CancelToken) -> str | None:
+        with token.open(br, url) as resp:
+            doc = html.fromstring(resp.read())
+        # Fiction
+        url = "".join(doc.xpath('//ul[contains(@class, "record_mirrors")]/li[1]/a/@href'))
+
+        # Handle non-fiction
+        if not url:
+            url = "".join(doc.xpath('//a[@title="Libgen & IPFS & Tor"]/@href'))
+        # Replace http with https because it doesn't work without it
+        url = url.replace("http", "https")
+
+        # Open the new books.ms url and look for the 'get' button there
+        with token.open(br, url) as resp:
+            doc = html.fromstring(resp.read())
+        return "".join(doc.xpath('//div[@id="download"]/h2[1]/a/@href'))
+
+
+class SciHubResolver(Resolver):
+    name = "Sci-Hub"
+    priority = 20
+
+    def matches(self, link_text: str, url: str) -> bool:
+        return link_text.startswith("Sci-Hub")
+
+    def resolve(self, url: str, br: Any, token: CancelToken) -> str | None:
+        with token.open(br, url) as resp:
+            doc = html.fromstring(resp.read())
+            scheme, _ = resp.geturl().split("/", 1)
+        url = "".join(doc.xpath('//embed[@id="pdf"]/@src'))
+        if url:
+            return scheme + url
+        return None
+
+
+class ZLibraryResolver(Resolver):
+    name = "Z-Library"
+    link_texts = ("Z-Library",)
+    priority = 10
+
+    # With Z-Lib, every download has a hash
+    def resolve(self, url: str, br: Any, token: CancelToken) -> str | None:
+        with token.open(br, url) as resp:
+            doc = html.fromstring(resp.read())
+            scheme, _, host, _ = resp.geturl().split("/", 3)
+        url = "".join(doc.xpath('//a[contains(@class, "addDownloadedBook")]/@href'))
+        if url:
+            # The url already has a leading /
+            return f"{scheme}//{host}{url}"
+        return None
+
+
+DEFAULT_RESOLVERS = (LibgenResolver, SciHubResolver, ZLibraryResolver)
+
+
+class _Stats:
+    def __init__(self) -> None:
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency: float | None = None
+        self.skip_until = 0.0
+
+
+class ResolverRegistry:
+    """
+    The resolvers the store knows about, with running success and latency stats for each.
+
+    A resolver that fails ``max_failures`` times in a row is skipped for ``cooldown`` seconds,
+    doubling with every further failure up to an hour, then gets one more try. Recent failures
+    and answers slower than half the budget lower its priority, so links that are likely to work
+    are resolved and listed first.
+    """
+
+    def __init__(
+        self,
+        resolvers: list[Resolver] | None = None,
+        max_failures: int = 3,
+        cooldown: float = 300,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.resolvers = list(resolvers) if resolvers is not None else [cls() for cls in DEFAULT_RESOLVERS]
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.clock = clock
+        self._stats: dict[str, _Stats] = {}
+        self._lock = threading.Lock()
+
+    def register(self, resolver: Resolver) -> None:
+        """Add a resolver, replacing one with the same name."""
+        self.resolvers = [r for r in self.resolvers if r.name != resolver.name] + [resolver]
+
+    def configure(self, options: dict[str, dict[str, Any]]) -> None:
+        # Per resolver overrides from the plugin config, e.g. {"Z-Library": {"timeout": 5, "enabled": False}}
+        for resolver in self.resolvers:
+            for attr in ("enabled", "timeout", "priority"):
+                if attr in options.get(resolver.name, {}):
+                    setattr(resolver, attr, options[resolver.name][attr])
+
+    def find(self, link_text: str, url: str) -> Resolver | None:
+        for resolver in self.resolvers:
+            if resolver.matches(link_text, url):
+                return resolver if resolver.enabled else None
+        return None
+
+    def _get_stats(self, resolver: Resolver) -> _Stats:
+        stats = self._stats.get(resolver.name)
+        if stats is None:
+            stats = self._stats[resolver.name] = _Stats()
+        return stats
+
+    def score(self, resolver: Resolver) -> float:
+        with self._lock:
+            stats = self._get_stats(resolver)
+            score = resolver.priority - 10 * stats.consecutive_failures
+            if stats.latency is not None and stats.latency > resolver.timeout / 2:
+                score -= 10
+            return score
+
+    def skipped(self, resolver: Resolver) -> bool:
+        with self._lock:
+            return self._get_stats(resolver).skip_until > self.clock()
+
+    def plan(self, links: list[tuple[str, str]]) -> list[tuple[Resolver, str, str]]:
+        """The (resolver, url, link_text) to resolve for ``links``, best first, leaving out skipped resolvers."""
+        planned = []
+        for url, link_text in links:
+            resolver = self.find(link_text, url)
+            if resolver is not None and not self.skipped(resolver):
+                planned.append((resolver, url, link_text))
+        # sorted() is stable, so equal scores keep the order of the page
+        return sorted(planned, key=lambda item: -self.score(item[0]))
+
+    def resolve(self, resolver: Resolver, url: str, br: Any, token: CancelToken) -> str | None:
+        budget = token.child(resolver.timeout)
+        start = self.clock()
+        try:
+            result = resolver.resolve(url, br, budget)
+        except BaseException:
+            # The caller giving up or running out of time says nothing about the resolver
+            remaining = token.remaining()
+            if not token.cancelled and (remaining is None or remaining > 0):
+                self._record(resolver, False, self.clock() - start)
+            raise
+        finally:
+            budget.cancel()
+        # A page without the link we look for is a failure too, the site has probably changed
+        self._record(resolver, bool(result), self.clock() - start)
+        return result
+
+    def _record(self, resolver: Resolver, success: bool, latency: float) -> None:
+        with self._lock:
+            stats = self._get_stats(resolver)
+            stats.latency = latency if stats.latency is None else 0.7 * stats.latency + 0.3 * latency
+            if success:
+                stats.successes += 1
+                stats.consecutive_failures = 0
+                stats.skip_until = 0.0
+                return
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            if stats.consecutive_failures >= self.max_failures:
+                backoff = self.cooldown * 2 ** (stats.consecutive_failures - self.max_failures)
+                stats.skip_until = self.clock() + min(backoff, 3600)
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        now = self.clock()
+        with self._lock:
+            return {
+                resolver.name: {
+                    "enabled": resolver.enabled,
+                    "successes": stats.successes,
+                    "failures": stats.failures,
+                    "latency": stats.latency,
+                    "skipped_for": max(0.0, stats.skip_until - now),
+                }
+                for resolver in self.resolvers
+                for stats in (self._get_stats(resolver),)
+            }
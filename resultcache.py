@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Dict, FrozenSet, Hashable
+
+if TYPE_CHECKING:
+    from calibre_plugins.store_annas_archive.records import ResultRecord
+    from calibre_plugins.store_annas_archive.sharedcache import SharedCache
+
+__all__ = ("LOCAL_FILTERS", "Filters", "ResultCache", "matches")
+
+# Search parameter -> the values a result has for it. The "_empty" language is what Anna's
+# Archive calls books without a language
+LOCAL_FILTERS: dict[str, Callable[[ResultRecord], set[str]]] = {
+    "ext": lambda record: {record.formats.lower()},
+    "lang": lambda record: set(record.languages.split(",")) if record.languages else {"_empty"},
+    "src": lambda record: set(record.sources.split(",")) if record.sources else set(),
+    "content": lambda record: {record.content},
+}
+
+# Search parameter -> accepted values, parameters without a filter are left out
+Filters = Dict[str, FrozenSet[str]]
+
+
+def matches(record: ResultRecord, filters: Filters) -> bool:
+    return all(LOCAL_FILTERS[param](record) & accepted for param, accepted in filters.items())
+
+
+def _covers(cached: Filters, filters: Filters) -> bool:
+    # Every result of the narrower search is also a result of the cached one
+    return all(param in filters and filters[param] <= accepted for param, accepted in cached.items())
+
+
+class _Entry:
+    def __init__(self, filters: Filters, records: list[ResultRecord], complete: bool, created: float) -> None:
+        self.filters = filters
+        self.records = records
+        self.complete = complete
+        self.created = created
+
+
+class ResultCache:
+    """
+    Recent search results, used to answer a repeated search with narrower filters locally.
+
+    Results are stored under the parts of the search that can't be checked on a result
+    (query, ordering, access) together with the filters (file type, language, source and
+    content) they were searched with. A later search with the same key and a subset of those
+    filters is answered by filtering the stored results, as long as they either yield
+    ``max_results`` matches or are everything the mirror had.
+
+    With a shared cache the results are also written there as rows, ``record_type(*row)``
+    turns them back into records in other processes.
+    """
+
+    # Filter combinations kept per search in the shared cache
+    shared_entries = 8
+
+    def __init__(
+        self,
+        max_entries: int = 32,
+        ttl: float = 600,
+        clock: Callable[[], float] = time.time,
+        shared: SharedCache | None = None,
+        record_type: Callable[..., ResultRecord] | None = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.shared = shared
+        self.record_type = record_type
+        self._entries: OrderedDict[tuple[Hashable, frozenset[tuple[str, frozenset[str]]]], _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, filters: Filters, max_results: int) -> list[ResultRecord] | None:
+        now = self.clock()
+        with self._lock:
+            for entry_key, entry in reversed(self._entries.items()):
+                if entry_key[0] != key:
+                    continue
+                records = self._answer(entry, filters, max_results, now)
+                if records is not None:
+                    self._entries.move_to_end(entry_key)
+                    return records
+        if self.shared is None or self.record_type is None:
+            return None
+
+        for filters_, rows, complete, created in reversed(self.shared.get("results", json.dumps(key)) or ()):
+            entry = _Entry({param: frozenset(values) for param, values in filters_.items()}, [], complete, created)
+            if now - entry.created > self.ttl or not _covers(entry.filters, filters):
+                continue
+            entry.records = [self.record_type(*row) for row in rows]
+            records = self._answer(entry, filters, max_results, now)
+            if records is not None:
+                self._remember(key, entry)
+                return records
+        return None
+
+    def _answer(self, entry: _Entry, filters: Filters, max_results: int, now: float) -> list[ResultRecord] | None:
+        if now - entry.created > self.ttl or not _covers(entry.filters, filters):
+            return None
+        records = [record for record in entry.records if matches(record, filters)][:max_results]
+        if len(records) >= max_results or entry.complete:
+            return records
+        return None
+
+    def put(self, key: Hashable, filters: Filters, records: list[ResultRecord], complete: bool) -> None:
+        now = self.clock()
+        self._remember(key, _Entry(filters, records, complete, now))
+        if self.shared is None:
+            return
+        # Read-modify-write, a concurrent put from another process may be lost, which only costs a search
+        stored = [
+            entry
+            for entry in self.shared.get("results", json.dumps(key)) or ()
+            if now - entry[3] <= self.ttl and entry[0] != {param: sorted(values) for param, values in filters.items()}
+        ]
+        stored.append(
+            [
+                {param: sorted(values) for param, values in filters.items()},
+                [record.to_row() for record in records],
+                complete,
+                now,
+            ]
+        )
+        self.shared.put("results", json.dumps(key), stored[-self.shared_entries :], ttl=self.ttl)
+
+    def _remember(self, key: Hashable, entry: _Entry) -> None:
+        entry_key = (key, frozenset(entry.filters.items()))
+        with self._lock:
+            self._entries[entry_key] = entry
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
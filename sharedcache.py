@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import TYPE_CHECKING, Any, Callable
+
+if TYPE_CHECKING:
+    from calibre_plugins.store_annas_archive.events import EventLog
+
+__all__ = ("SharedCache",)
+
+# Values shorter than this aren't worth compressing
+_COMPRESS_MIN = 256
+# Value encodings
+_JSON, _JSON_ZLIB, _BYTES, _BYTES_ZLIB = range(4)
+# How stale an entry's access time may get before a read writes the new one
+_TOUCH_INTERVAL = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    encoding INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    expires REAL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+"""
+
+
+def _encode(value: Any) -> tuple[bytes, int]:
+    if isinstance(value, bytes):
+        data, encoding = value, _BYTES
+    else:
+        data, encoding = json.dumps(value, separators=(",", ":")).encode("utf-8"), _JSON
+    if len(data) >= _COMPRESS_MIN:
+        compressed = zlib.compress(data)
+        if len(compressed) < len(data):
+            return compressed, encoding + 1
+    return data, encoding
+
+
+def _decode(data: bytes, encoding: int) -> Any:
+    if encoding in (_JSON_ZLIB, _BYTES_ZLIB):
+        data = zlib.decompress(data)
+    if encoding in (_BYTES, _BYTES_ZLIB):
+        return bytes(data)
+    return json.loads(data)
+
+
+class SharedCache:
+    """
+    Key-value store in a SQLite database that every calibre process on the host shares.
+
+    The database runs in WAL mode, so readers never wait for a writer and one process's
+    lookups warm the cache for the others. Values are JSON or bytes, zlib compressed when that
+    makes them smaller. Once the stored values take up more than max_size bytes the least
+    recently used ones are evicted. Database errors (e.g. a lock held for too long by another
+    process) are reported and treated as a cache miss, the cache never fails a search.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_size: int = 100 * 1024 * 1024,
+        clock: Callable[[], float] = time.time,
+        events: EventLog | None = None,
+    ) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.clock = clock
+        self.events = events
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # One connection shared by all threads, SQLite itself serializes access across processes
+        self._db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, namespace: str, key: str) -> Any:
+        now = self.clock()
+        try:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT value, encoding, expires, accessed FROM entries WHERE namespace = ? AND key = ?",
+                    (namespace, key),
+                ).fetchone()
+                if row is None:
+                    return None
+                value, encoding, expires, accessed = row
+                if expires is not None and expires <= now:
+                    self._db.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+                    return None
+                if now - accessed > _TOUCH_INTERVAL:
+                    self._db.execute(
+                        "UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ?", (now, namespace, key)
+                    )
+        except sqlite3.Error as e:
+            if self.events is not None:
+                self.events.record("cache", e, f"Shared cache read failed: {e}")
+            return None
+        try:
+            return _decode(value, encoding)
+        except (ValueError, zlib.error):
+            self.delete(namespace, key)
+            return None
+
+    def put(self, namespace: str, key: str, value: Any, ttl: float | None = None) -> None:
+        data, encoding = _encode(value)
+        now = self.clock()
+        try:
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (namespace, key, data, encoding, len(data), now + ttl if ttl is not None else None, now),
+                )
+                self._writes += 1
+                # Summing the sizes is a full scan, so only check the bound every few writes
+                if self._writes % 16 == 0 or len(data) > self.max_size // 16:
+                    self._evict(now)
+        except sqlite3.Error as e:
+            if self.events is not None:
+                self.events.record("cache", e, f"Shared cache write failed: {e}")
+
+    def delete(self, namespace: str, key: str) -> None:
+        try:
+            with self._lock:
+                self._db.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+        except sqlite3.Error as e:
+            if self.events is not None:
+                self.events.record("cache", e, f"Shared cache write failed: {e}")
+
+    def size(self, namespace: str | None = None) -> int:
+        with self._lock:
+            if namespace is None:
+                row = self._db.execute("SELECT SUM(size) FROM entries").fetchone()
+            else:
+                row = self._db.execute("SELECT SUM(size) FROM entries WHERE namespace = ?", (namespace,)).fetchone()
+        return row[0] or 0
+
+    def _evict(self, now: float) -> None:
+        self._db.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires <= ?", (now,))
+        excess = (self._db.execute("SELECT SUM(size) FROM entries").fetchone()[0] or 0) - self.max_size
+        if excess <= 0:
+            return
+        victims = []
+        for namespace, key, size in self._db.execute("SELECT namespace, key, size FROM entries ORDER BY accessed"):
+            victims.append((namespace, key))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM entries WHERE namespace = ? AND key = ?", victims)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Generic, Hashable, Iterator, TypeVar
+from urllib.parse import parse_qsl, urlencode
+
+if TYPE_CHECKING:
+    from calibre_plugins.store_annas_archive.cancellation import CancelToken
+
+__all__ = ("SingleFlight", "canonical_url")
+
+T = TypeVar("T")
+
+
+def canonical_url(url: str) -> str:
+    # Parameter order doesn't change the page, so it shouldn't change the key
+    base, _, query = url.partition("?")
+    if not query:
+        return url
+    return f"{base}?{urlencode(sorted(parse_qsl(query, keep_blank_values=True)), safe='{}')}"
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class _Stream(Generic[T]):
+    def __init__(self, iterator: Iterator[T], on_done: Callable[[], None]) -> None:
+        self.iterator = iterator
+        self.on_done = on_done
+        self.buffer: list[T] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.consumers = 0
+        self.abandoned = False
+        self.lock = threading.Lock()
+
+    def get(self, index: int) -> tuple[bool, T | None]:
+        # Whoever runs past the end of the buffer drives the shared iterator for everyone
+        with self.lock:
+            if index < len(self.buffer):
+                return True, self.buffer[index]
+            if self.error is not None:
+                raise self.error
+            if self.done:
+                return False, None
+            try:
+                item = next(self.iterator)
+            except StopIteration:
+                self.done = True
+                self.on_done()
+                return False, None
+            except BaseException as e:
+                self.error = e
+                self.done = True
+                self.on_done()
+                raise
+            self.buffer.append(item)
+            return True, item
+
+
+class _Consumer:
+    # Tracked by the caller's CancelToken, which closes it when the caller is cancelled
+    def __init__(self, leave: Callable[[_Consumer], None]) -> None:
+        self.leave = leave
+        self.left = False
+
+    def close(self) -> None:
+        self.leave(self)
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls so that only one of them does the work.
+
+    ``do`` shares the return value of a function, ``stream`` shares the items of a generator as
+    they are produced, so every caller still gets the first results as soon as they are ready.
+    A stream is stopped once all of its callers have left, by closing their generator or by
+    cancelling the ``token`` they passed in, even while they are still blocked on the next item.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[Hashable, _Call] = {}
+        self._streams: dict[Hashable, _Stream[Any]] = {}
+        self._lock = threading.Lock()
+
+    def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], T],
+        timeout: float | None = None,
+        rerun: tuple[type[BaseException], ...] = (),
+    ) -> T:
+        """
+        ``fn()``, or the result of an identical call already running.
+
+        A follower whose leader failed with one of ``rerun`` runs its own ``fn`` instead of sharing
+        the error, for errors that only concern the leader, like its own cancellation or deadline.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+            if leader:
+                break
+            # The leader has its own deadline, a follower stops waiting at its own
+            if not call.event.wait(deadline - time.monotonic() if deadline is not None else None):
+                raise TimeoutError("Timed out waiting for a shared call")
+            if call.error is not None:
+                if isinstance(call.error, rerun):
+                    continue
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        return call.result
+
+    def stream(
+        self,
+        key: Hashable,
+        factory: Callable[[], Iterator[T]],
+        copy: Callable[[T], T] | None = None,
+        cancel: Callable[[], None] | None = None,
+        token: CancelToken | None = None,
+    ) -> Iterator[T]:
+        with self._lock:
+            shared = self._streams.get(key)
+            if shared is None:
+                shared = self._streams[key] = _Stream(factory(), lambda: self._forget(key, shared))
+            shared.consumers += 1
+
+        def leave(consumer: _Consumer) -> None:
+            # Nobody left to read it stops the underlying request. Only cancel() runs here, it doesn't
+            # need the stream's lock, which a blocked request may be holding
+            if self._leave(key, shared, consumer) and cancel is not None:
+                cancel()
+
+        consumer = _Consumer(leave)
+        index = 0
+        try:
+            if token is not None:
+                token.track(consumer)
+            while True:
+                found, item = shared.get(index)
+                if not found:
+                    return
+                index += 1
+                yield copy(item) if copy is not None else item  # type: ignore[misc]
+        finally:
+            if token is not None:
+                token.untrack(consumer)
+            consumer.close()
+            if shared.abandoned:
+                with shared.lock:
+                    shared.done = True
+                    close = getattr(shared.iterator, "close", None)
+                    if close is not None:
+                        close()
+
+    def _leave(self, key: Hashable, shared: _Stream[Any], consumer: _Consumer) -> bool:
+        """Count ``consumer`` out of ``shared``, returns whether that abandoned the stream."""
+        with self._lock:
+            if consumer.left:
+                return False
+            consumer.left = True
+            shared.consumers -= 1
+            if shared.consumers > 0 or shared.done:
+                return False
+            shared.abandoned = True
+            if self._streams.get(key) is shared:
+                del self._streams[key]
+            return True
+
+    def _forget(self, key: Hashable, shared: _Stream[Any] | None) -> None:
+        with self._lock:
+            if self._streams.get(key) is shared:
+                del self._streams[key]
@@ -0,0 +1,375 @@
+import importlib.util
+import os
+import sys
+import threading
+import time
+import types
+from email.message import Message
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if not any(importlib.util.find_spec(name) for name in ("qt", "PyQt6", "PyQt5")):
+    pytest.skip("The store module needs Qt", allow_module_level=True)
+
+# calibre's plugin loader makes the plugin's modules a package under calibre_plugins
+if "calibre_plugins.store_annas_archive" not in sys.modules:
+    sys.modules.setdefault("calibre_plugins", types.ModuleType("calibre_plugins")).__path__ = []
+    plugin = types.ModuleType("calibre_plugins.store_annas_archive")
+    plugin.__path__ = [ROOT]
+    sys.modules["calibre_plugins.store_annas_archive"] = plugin
+
+from calibre_plugins.store_annas_archive import annas_archive  # noqa: E402
+from calibre_plugins.store_annas_archive.annas_archive import AnnasArchiveStore, SearchResult  # noqa: E402
+from calibre_plugins.store_annas_archive.cancellation import Cancelled, CancelToken  # noqa: E402
+from calibre_plugins.store_annas_archive.records import ResultRecord  # noqa: E402
+from calibre_plugins.store_annas_archive.verification import LinkVerifier  # noqa: E402
+
+MD5 = "d64efd386ed7227592499460aca2044b"
+
+
+def make_store(**config):
+    # No network at construction, no shared database and a plain dict instead of the user's settings
+    config = {"cache": {"shared": False}, "discovery": {"enabled": False}, "preconnect": False, **config}
+    return AnnasArchiveStore(None, "Anna's Archive", config=config)
+
+
+class Browser:
+    # The parts of calibre's mechanize browser the store uses
+    def __init__(self, respond):
+        self.respond = respond
+        self.addheaders = []
+
+    def set_handle_gzip(self, handle):
+        pass
+
+    def set_proxies(self, proxies):
+        pass
+
+    def open(self, url, timeout=None):
+        return self.respond(url)
+
+
+class HeadResponse:
+    def __init__(self, content_type):
+        self.headers = Message()
+        self.headers["Content-Type"] = content_type
+
+    def info(self):
+        return self.headers
+
+    def close(self):
+        pass
+
+
+def test_details_wait_for_link_checks_and_never_change_afterwards():
+    slow = threading.Event()
+
+    def opener(request, timeout=None):
+        if "slow" in request.get_full_url():
+            slow.wait(5)
+        return HeadResponse("text/html" if "broken" in request.get_full_url() else "application/epub+zip")
+
+    store = make_store(link={"content_type": True, "verify_wait": 0.5})
+    store.link_verifier = LinkVerifier(opener=opener)
+    links = [
+        ("Libgen.rs Fiction", "https://good.example/a"),
+        ("Sci-Hub", "https://broken.example/b"),
+        ("Slow Mirror", "https://slow.example/c"),
+        ("Z-Library", "https://z-lib.example/d"),
+    ]
+    store._get_download_links = lambda md5, token: links
+
+    result = SearchResult()
+    result.detail_item, result.formats = MD5, "EPUB"
+    store.get_details(result, timeout=10)
+    expected = {
+        "Libgen.rs Fiction.EPUB": "https://good.example/a",
+        "Slow Mirror (unverified).EPUB": "https://slow.example/c",
+        "Z-Library.EPUB": "https://z-lib.example/d",
+    }
+    assert result.downloads == expected
+
+    # calibre may be reading the dict by now, the late verdict only counts for the next lookup
+    slow.set()
+    assert store.link_verifier.submit("https://slow.example/c").result(5) is True
+    assert result.downloads == expected
+    again = SearchResult()
+    again.detail_item, again.formats = MD5, "EPUB"
+    store.get_details(again, timeout=10)
+    assert "Slow Mirror.EPUB" in again.downloads
+
+
+def test_retry_after_longer_than_the_search_may_wait_fails_fast(monkeypatch):
+    requests = []
+
+    def respond(url):
+        requests.append(url)
+        headers = Message()
+        headers["Retry-After"] = "40"
+        raise HTTPError(url, 429, "Too Many Requests", headers, None)
+
+    monkeypatch.setattr(annas_archive, "browser", lambda: Browser(respond))
+    store = make_store(mirrors=["https://a.example"])
+    store.working_mirror = "https://a.example"
+    with pytest.raises(Exception, match="rate limiting"):
+        list(store.search("x", 5, timeout=5))
+
+    start = time.monotonic()
+    with pytest.raises(Exception, match="rate limiting"):
+        list(store.search("y", 5, timeout=5))
+    assert time.monotonic() - start < 1
+    assert len(requests) == 1
+    # Being throttled doesn't make the mirror any less the working one
+    assert store.working_mirror == "https://a.example"
+
+
+class StalledHandler(BaseHTTPRequestHandler):
+    # Sends the headers and the start of the page, then nothing until the test is over
+    done = threading.Event()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", "100000")
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        self.wfile.write(b"<html>")
+        self.wfile.flush()
+        self.done.wait(10)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_cancelling_a_search_interrupts_a_stalled_page(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StalledHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(annas_archive, "browser", lambda: Browser(lambda url: urlopen(url, timeout=10)))
+    # The page goes through the response cache, which must not read it before the search does
+    store = make_store(mirrors=[f"http://127.0.0.1:{server.server_port}"])
+    assert store.response_cache is not None
+    token = CancelToken(30)
+    outcome = []
+
+    def search():
+        try:
+            outcome.append(list(store._search_records("dune", 5, token)))
+        except Cancelled as e:
+            outcome.append(e)
+
+    thread = threading.Thread(target=search)
+    thread.start()
+    try:
+        time.sleep(0.3)
+        start = time.monotonic()
+        token.cancel()
+        thread.join(5)
+        assert time.monotonic() - start < 1
+        assert isinstance(outcome[0], Cancelled)
+    finally:
+        StalledHandler.done.set()
+        server.shutdown()
+        server.server_close()
+
+
+def test_search_many_returns_at_most_max_results():
+    store = make_store()
+    # Every variant finds its own books and one they all share
+    store._search_records = lambda query, max_results, token, looked_up=None: iter(
+        [ResultRecord(MD5, "Dune", "Frank Herbert", "EPUB", "")]
+        + [ResultRecord(f"{query}{i}".ljust(32, "0"), query, "", "EPUB", "") for i in range(max_results - 1)]
+    )
+    results = list(store.search_many(["dune", "dune herbert", "herbert"], max_results=5))
+    assert len(results) == 5
+    assert results[0].detail_item == MD5
+
+
+def test_closing_search_many_cancels_the_searches_still_running():
+    store = make_store()
+    cancelled = []
+
+    def search(url, max_results, token):
+        yield ResultRecord(MD5, "Dune", "Frank Herbert", "EPUB", "")
+        # Waiting for the next page from a slow mirror
+        cancelled.append(token.wait(5))
+
+    store._search = search
+    results = store.search_many(["dune", "dune herbert"], max_results=20)
+    assert next(results).detail_item == MD5
+    start = time.monotonic()
+    results.close()
+    while len(cancelled) < 2 and time.monotonic() - start < 5:
+        time.sleep(0.01)
+    assert cancelled == [True, True]
+    assert time.monotonic() - start < 1
+
+
+class Library:
+    # The parts of calibre's db.new_api the library index uses, with one book that has ISBN
+    def __init__(self):
+        self.books = {1: {"title": "The Hobbit", "authors": ("J. R. R. Tolkien",), "identifiers": {"isbn": ISBN}}}
+
+    def add_listener(self, listener):
+        pass
+
+    def all_book_ids(self):
+        return frozenset(self.books)
+
+    def all_field_for(self, field, book_ids, default_value=None):
+        return {book_id: self.books[book_id].get(field, default_value) for book_id in book_ids}
+
+
+ISBN = "9780261102217"
+HOBBIT = "0123456789abcdef0123456789abcdef"
+
+
+def library_store(mode, found_by_isbn):
+    store = make_store(library={"mode": mode})
+    db = Library()
+    store._library_db = lambda: db
+    # The ISBN's record page names the book differently than the library does
+    store._lookup_identifier = lambda kind, value, token: (
+        ResultRecord(HOBBIT, "Hobbit, or There and Back", "Tolkien", "EPUB", "") if found_by_isbn else None
+    )
+    store._search = lambda url, max_results, token: iter(
+        [
+            ResultRecord(MD5, "Dune", "Frank Herbert", "EPUB", ""),
+            ResultRecord("f" * 32, "Emma", "Jane Austen", "EPUB", ""),
+        ]
+    )
+    return store
+
+
+def test_query_identifiers_only_count_for_the_record_they_found():
+    store = library_store("hide", found_by_isbn=True)
+    assert [result.detail_item for result in store.search_many(["dune", ISBN])] == [MD5, "f" * 32]
+    assert list(store.search(ISBN)) == []
+
+    # Not known by the ISBN, so the full-text results are other books
+    store = library_store("mark", found_by_isbn=False)
+    assert [result.price for result in store.search(ISBN)] == ["$0.00", "$0.00"]
+
+
+def test_library_marks_dont_stick_to_cached_results():
+    store = library_store("mark", found_by_isbn=False)
+    store._library_db().books[2] = {"title": "Dune", "authors": ("Frank Herbert",), "identifiers": {}}
+    assert [result.price for result in store.search("dune")] == ["In library", "$0.00"]
+    # The second search is answered from the result cache, with the same records
+    store.config["library"]["mode"] = "off"
+    assert [result.price for result in store.search("dune")] == ["$0.00", "$0.00"]
+
+
+def test_isbn_naming_several_files_is_searched_for(monkeypatch):
+    pages = {
+        f"{{base}}/isbn/{ISBN}": f'<a href="/md5/{HOBBIT}">epub</a><a href="/md5/{MD5}">pdf</a>'.encode(),
+        f"{{base}}/md5/{HOBBIT}": b'<meta property="og:title" content="The Hobbit"><div class="text-gray-500">English, .epub, 1MB</div>',
+    }
+    monkeypatch.setattr(annas_archive, "browser", lambda: Browser(None))
+    store = make_store()
+    monkeypatch.setattr(store, "_fetch_from_mirrors", lambda url, token, br: pages[url])
+    searched = []
+
+    def search(url, max_results, token):
+        searched.append(url)
+        yield ResultRecord(HOBBIT, "The Hobbit", "Tolkien", "EPUB", "")
+        yield ResultRecord(MD5, "The Hobbit", "Tolkien", "PDF", "")
+
+    store._search = search
+    assert [result.formats for result in store.search(ISBN)] == ["EPUB", "PDF"]
+    assert len(searched) == 1
+
+    # The same file twice is still a single file, looked up directly unless a filter needs the search page
+    pages[f"{{base}}/isbn/{ISBN}"] = f'<a href="/md5/{HOBBIT}">cover</a><a href="/md5/{HOBBIT}">epub</a>'.encode()
+    store = make_store(cache={"shared": False, "results": False})
+    monkeypatch.setattr(store, "_fetch_from_mirrors", lambda url, token, br: pages[url])
+    store._search = search
+    assert [result.detail_item for result in store.search(ISBN)] == [HOBBIT]
+    store.config["search"] = {"filetype": ["pdf"]}
+    list(store.search(ISBN))
+    assert len(searched) == 2 and "&ext=pdf" in searched[1]
+
+
+def test_mirrors_keep_the_configured_order():
+    store = make_store(mirrors=["https://a.example", "https://b.example", "https://c.example"])
+    # Answering faster doesn't move a mirror ahead of the ones the user put first
+    store.mirror_latency = {"https://c.example": 0.1, "https://b.example": 0.2, "https://a.example": 5.0}
+    assert store._mirror_order() == ["https://a.example", "https://b.example", "https://c.example"]
+    store.working_mirror = "https://b.example"
+    store.dead_mirrors = {"https://a.example"}
+    assert store._mirror_order() == ["https://b.example", "https://c.example", "https://a.example"]
+
+
+def test_discovered_mirrors_go_last_fastest_first(monkeypatch):
+    store = make_store(mirrors=["https://a.example", "https://b.example"])
+    store.config["discovery"] = {"enabled": True, "sources": []}
+    monkeypatch.setattr(
+        store.discovery,
+        "candidates",
+        lambda sources, configured: ["https://b.example", "https://d.example", "https://e.example"],
+    )
+    probed = {"https://a.example": 0.5, "https://b.example": 0.1, "https://d.example": 0.3, "https://e.example": 0.2}
+    monkeypatch.setattr(store.discovery, "probe_all", lambda mirrors: (probed, set()))
+    store._discover_mirrors()
+
+    order = ["https://a.example", "https://b.example", "https://e.example", "https://d.example"]
+    assert store.config["mirrors"] == order
+    assert store.mirror_latency == {}
+    assert store._mirror_order() == order
+    # Requests that went through them reorder only the discovered mirrors
+    store.mirror_latency = {"https://d.example": 0.1, "https://e.example": 0.4, "https://b.example": 2.0}
+    assert store._mirror_order() == ["https://a.example", "https://b.example", "https://d.example", "https://e.example"]
+
+
+def test_secret_key_only_goes_to_configured_mirrors(monkeypatch):
+    store = make_store(mirrors=["https://a.example"], secret="s3cret")
+    store.config["discovery"] = {"enabled": True, "sources": []}
+    monkeypatch.setattr(store.discovery, "candidates", lambda sources, configured: ["https://d.example"])
+    monkeypatch.setattr(store.discovery, "probe_all", lambda mirrors: ({m: 0.1 for m in mirrors}, set()))
+    store._discover_mirrors()
+    assert store.config["mirrors"] == ["https://a.example", "https://d.example"]
+    store.working_mirror = "https://d.example"
+    assert store._get_url_premium(MD5).startswith("https://a.example/dyn/api/")
+
+    # Saving the settings, even unchanged, doesn't turn the discovered mirror into one the user added
+    save_settings(store)
+    store.dead_mirrors = {"https://a.example"}
+    assert store._get_url_premium(MD5).startswith("https://a.example/dyn/api/")
+    store.config["mirrors"] = ["https://d.example"]
+    assert store._get_url_premium(MD5) is None
+
+
+def save_settings(store):
+    # What the plugin's settings dialog does when the user presses OK, with what calibre provides around it
+    import builtins
+
+    from PyQt6 import QtCore, QtGui, QtWidgets
+
+    if "qt.core" not in sys.modules:
+        core = types.ModuleType("qt.core")
+        for module in (QtCore, QtGui, QtWidgets):
+            core.__dict__.update({name: getattr(module, name) for name in dir(module) if name.startswith("Q")})
+        core.Qt = QtCore.Qt
+        sys.modules["qt.core"] = core
+    builtins.__dict__.setdefault("_", lambda text: text)
+    builtins.__dict__.setdefault("load_translations", lambda: None)
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])  # noqa: F841
+    from calibre_plugins.store_annas_archive.config import ConfigWidget
+
+    widget = ConfigWidget(store)
+    widget.load_settings()
+    widget.save_settings()
+
+
+def test_pages_are_revalidated_without_the_shared_cache():
+    # make_store turns the shared database off, the pages are then cached in memory
+    store = make_store()
+    assert store.shared_cache is None
+    store.response_cache.put(f"https://a.example/md5/{MD5}", b"<html>book</html>", '"v1"', None)
+    assert store.response_cache.get(f"https://a.example/md5/{MD5}") == b"<html>book</html>"
+    assert make_store(cache={"shared": False, "http": False}).response_cache is None
@@ -0,0 +1,127 @@
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import urlopen
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cancellation import Cancelled, CancelToken  # noqa: E402
+from singleflight import SingleFlight  # noqa: E402
+
+
+class Response:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_timeout_is_capped_by_the_deadline():
+    token = CancelToken(0.5)
+    assert token.timeout(60) <= 0.5
+    assert CancelToken().timeout(60) == 60
+    time.sleep(0.6)
+    with pytest.raises(Cancelled):
+        token.timeout(60)
+
+
+def test_cancel_closes_tracked_responses_and_children():
+    token = CancelToken(60)
+    child = token.child(120)
+    assert child.remaining() <= 60
+    resp = token.track(Response())
+    done = Response()
+    token.untrack(token.track(done))
+
+    token.cancel()
+    assert resp.closed and not done.closed
+    assert child.cancelled
+    late = Response()
+    with pytest.raises(Cancelled):
+        token.track(late)
+    assert late.closed
+
+
+def test_abandoned_stream_cancels_its_token():
+    token = CancelToken(30)
+
+    def search():
+        yield "first"
+        yield "second"
+
+    flights = SingleFlight()
+    consumer = flights.stream("q", search, cancel=token.cancel)
+    assert next(consumer) == "first"
+    consumer.close()
+    assert token.cancelled
+
+
+def test_follower_stops_waiting_at_its_own_deadline():
+    flights = SingleFlight()
+    release = threading.Event()
+    leader = threading.Thread(target=flights.do, args=("md5", lambda: release.wait(5)))
+    leader.start()
+    time.sleep(0.05)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        flights.do("md5", lambda: None, timeout=0.1)
+    assert time.monotonic() - start < 1
+    release.set()
+    leader.join()
+
+
+class StallingHandler(BaseHTTPRequestHandler):
+    # /body sends the headers and the start of the page, /headers sends nothing, until the test is over
+    done = threading.Event()
+
+    def do_GET(self):
+        if self.path == "/body":
+            self.send_response(200)
+            self.send_header("Content-Length", "100000")
+            self.end_headers()
+            self.wfile.write(b"<html>")
+            self.wfile.flush()
+        self.done.wait(10)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UrlopenBrowser:
+    def open(self, url, timeout=None):
+        return urlopen(url, timeout=timeout)
+
+
+@pytest.mark.parametrize("path", ["/body", "/headers"])
+def test_cancel_interrupts_a_stalled_socket(path):
+    StallingHandler.done.clear()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StallingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    token = CancelToken(30)
+    outcome = []
+
+    def fetch():
+        try:
+            with token.open(UrlopenBrowser(), f"http://127.0.0.1:{server.server_port}{path}") as resp:
+                outcome.append(resp.read())
+        except Exception as e:
+            outcome.append(e)
+
+    thread = threading.Thread(target=fetch)
+    thread.start()
+    try:
+        time.sleep(0.3)
+        start = time.monotonic()
+        token.cancel()
+        thread.join(5)
+        assert time.monotonic() - start < 1
+        assert isinstance(outcome[0], Cancelled)
+    finally:
+        StallingHandler.done.set()
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,90 @@
+import io
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from discovery import MirrorDiscovery, merge_mirrors, normalize_mirror, parse_mirror_list  # noqa: E402
+
+KNOWN = ["https://annas-archive.org"]
+
+
+class FakeResponse(io.BytesIO):
+    code = 200
+
+
+def test_normalize_mirror():
+    assert normalize_mirror("https://Annas-Archive.SE/search?q=x") == "https://annas-archive.se"
+    assert normalize_mirror("annas-archive.li") == "https://annas-archive.li"
+    assert normalize_mirror("ftp://annas-archive.li") is None
+    assert normalize_mirror("not a url") is None
+
+
+def test_parse_mirror_list_formats():
+    assert parse_mirror_list(b'["https://a.example", "b.example", "https://a.example/"]') == [
+        "https://a.example",
+        "https://b.example",
+    ]
+    assert parse_mirror_list(b'{"mirrors": ["https://a.example"]}') == ["https://a.example"]
+    assert parse_mirror_list(b"# mirrors\nhttps://a.example\n\nhttps://b.example/\n") == [
+        "https://a.example",
+        "https://b.example",
+    ]
+    page = b"""<html><body>
+    <a href="https://annas-archive.se/">se</a>
+    <a href="https://annas-archive.org/blog">blog</a>
+    <a href="https://example.com/">other</a>
+    <a href="/relative">relative</a>
+    </body></html>"""
+    assert parse_mirror_list(page, KNOWN) == ["https://annas-archive.se", "https://annas-archive.org"]
+
+
+def test_merge_keeps_manual_order_and_ignored():
+    configured = ["https://annas-archive.li", "https://annas-archive.org/"]
+    live = ["https://annas-archive.org", "https://annas-archive.se", "https://annas-archive.gs"]
+    assert merge_mirrors(configured, live, ignored=["https://annas-archive.gs"]) == [
+        "https://annas-archive.li",
+        "https://annas-archive.org/",
+        "https://annas-archive.se",
+    ]
+
+
+def test_probe_requires_a_search_form():
+    pages = {
+        "https://live.example/": b'<form action="/search"></form>',
+        "https://parked.example/": b"<p>This domain has been seized</p>",
+    }
+
+    def opener(url, timeout=None):
+        if url not in pages:
+            raise OSError("connection refused")
+        return FakeResponse(pages[url])
+
+    discovery = MirrorDiscovery(opener)
+    live, dead = discovery.probe_all(["https://live.example", "https://parked.example", "https://gone.example"])
+    assert list(live) == ["https://live.example"]
+    assert dead == {"https://parked.example", "https://gone.example"}
+
+
+def test_candidates_skip_unreadable_sources(tmp_path):
+    path = tmp_path / "mirrors.txt"
+    path.write_text("https://annas-archive.se\n")
+
+    def opener(url, timeout=None):
+        raise OSError("offline")
+
+    discovery = MirrorDiscovery(opener)
+    assert discovery.candidates([str(path), "https://mirrors.example/list", str(tmp_path / "missing")], KNOWN) == [
+        "https://annas-archive.se"
+    ]
+
+
+def test_html_links_only_count_on_known_mirror_domains():
+    page = b"""<html><body>
+    <a href="https://annas-archive.gs/">gs</a>
+    <a href="https://annas-archive.attacker.example/">lookalike</a>
+    <a href="https://annas-archive.example/">unknown tld</a>
+    <a href="https://www.annas-archive.org.attacker.example/">subdomain</a>
+    <a href="https://annas-archive.se:8443/">port</a>
+    </body></html>"""
+    assert parse_mirror_list(page, KNOWN) == ["https://annas-archive.gs"]
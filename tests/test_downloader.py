@@ -0,0 +1,98 @@
+import hashlib
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from downloader import DownloadError, SegmentedDownloader  # noqa: E402
+
+DATA = os.urandom(10 * 1024 * 1024 + 123)
+MD5 = hashlib.md5(DATA).hexdigest()
+
+
+class FakeResponse(io.BytesIO):
+    def __init__(self, body, status, headers):
+        super().__init__(body)
+        self.status = status
+        self.headers = headers
+
+
+def make_opener(data, ranges=True, log=None):
+    def opener(request, timeout=None):
+        byte_range = request.get_header("Range")
+        if log is not None:
+            log.append((request.full_url, byte_range))
+        if not byte_range or not ranges:
+            return FakeResponse(data, 200, {"Content-Length": str(len(data))})
+        start, end = byte_range.split("=")[1].split("-")
+        end = int(end) if end else len(data) - 1
+        body = data[int(start) : end + 1]
+        return FakeResponse(body, 206, {"Content-Range": f"bytes {start}-{end}/{len(data)}"})
+
+    return opener
+
+
+def test_segmented_download_from_several_mirrors(tmp_path):
+    log = []
+    path = str(tmp_path / "book.pdf")
+    downloader = SegmentedDownloader(
+        ["https://a.example/book", "https://b.example/book"],
+        path,
+        md5=MD5,
+        segment_size=1024 * 1024,
+        opener=make_opener(DATA, log=log),
+    )
+
+    assert downloader.download() == path
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert not os.path.exists(path + ".part.json")
+    assert {url for url, _ in log} == {"https://a.example/book", "https://b.example/book"}
+
+
+def test_resume_skips_journaled_segments(tmp_path):
+    path = str(tmp_path / "book.pdf")
+    segment_size = 1024 * 1024
+    with open(path + ".part", "wb") as f:
+        f.write(DATA[:segment_size])
+        f.truncate(len(DATA))
+    downloader = SegmentedDownloader(["https://a.example/book"], path, md5=MD5, segment_size=segment_size)
+    downloader._done = [[0, segment_size - 1]]
+    downloader._save_journal(len(DATA))
+
+    log = []
+    downloader.opener = make_opener(DATA, log=log)
+    downloader.download()
+
+    assert ("https://a.example/book", f"bytes=0-{segment_size - 1}") not in log
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+
+
+def test_journal_without_its_partial_file_starts_over(tmp_path):
+    path = str(tmp_path / "book.pdf")
+    segment_size = 1024 * 1024
+    downloader = SegmentedDownloader(["https://a.example/book"], path, md5=MD5, segment_size=segment_size)
+    downloader._done = [[0, segment_size - 1]]
+    downloader._save_journal(len(DATA))
+
+    log = []
+    downloader.opener = make_opener(DATA, log=log)
+    downloader.download()
+
+    assert ("https://a.example/book", f"bytes=0-{segment_size - 1}") in log
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+
+
+def test_md5_mismatch_discards_partial_file(tmp_path):
+    path = str(tmp_path / "book.pdf")
+    downloader = SegmentedDownloader(["https://a.example/book"], path, md5="0" * 32, opener=make_opener(DATA[:1000]))
+
+    with pytest.raises(DownloadError):
+        downloader.download()
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + ".part")
@@ -0,0 +1,56 @@
+import json
+import os
+import sys
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from events import EventLog  # noqa: E402
+
+
+def test_events_are_structured_and_bounded():
+    log = EventLog(capacity=3, clock=lambda: 0.0)
+    for i in range(5):
+        log.record("fetch", TimeoutError(f"timed out {i}"), mirror="https://a.example", url=f"https://a.example/{i}")
+    log.record("discovery", message="Found new mirrors: https://b.example")
+
+    events = log.events()
+    assert len(log) == 3
+    assert [event.url for event in events[:2]] == ["https://a.example/3", "https://a.example/4"]
+    assert events[0].error == "TimeoutError" and events[0].message == "timed out 3"
+    assert log.events("discovery")[0].error == ""
+    assert log.counts() == {("fetch", "TimeoutError"): 2, ("discovery", ""): 1}
+
+
+def test_format_and_write(tmp_path):
+    log = EventLog()
+    log.record(
+        "resolve", OSError("reset"), "Z-Library: reset", mirror="Z-Library", url="https://z.example", duration=1.5
+    )
+    line = log.format()
+    assert "resolve Z-Library 1.50s OSError: Z-Library: reset <https://z.example>" in line
+
+    path = tmp_path / "events.jsonl"
+    log.write(str(path))
+    (event,) = [json.loads(line) for line in path.read_text().splitlines()]
+    assert event["stage"] == "resolve" and event["duration"] == 1.5
+
+    log.clear()
+    assert log.format() == ""
+
+
+def test_concurrent_writers_and_readers():
+    log = EventLog(capacity=100)
+
+    def write():
+        for _ in range(2000):
+            log.record("fetch", OSError("down"))
+
+    threads = [threading.Thread(target=write) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        assert len(log.events()) <= 100
+    for thread in threads:
+        thread.join()
+    assert len(log) == 100
@@ -0,0 +1,41 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fanout import merge_ranked  # noqa: E402
+
+
+def test_results_are_merged_and_ranked_by_variant_count():
+    variants = [["a", "b", "c"], ["c", "a"], ["d", "a", "c", "c"]]
+    merged = list(merge_ranked([lambda rows=rows: iter(rows) for rows in variants], key=lambda row: row))
+    assert merged[:2] == ["a", "c"]
+    assert sorted(merged[2:]) == ["b", "d"]
+    assert len(merged) == 4
+
+
+def test_hit_found_by_every_variant_is_yielded_before_slow_variant_finishes():
+    release = threading.Event()
+
+    def slow():
+        yield "a"
+        release.wait(5)
+        yield "b"
+
+    merged = merge_ranked([lambda: iter(["a"]), slow], key=lambda row: row)
+    assert next(merged) == "a"
+    release.set()
+    assert list(merged) == ["b"]
+
+
+def test_failed_variants_are_skipped_unless_all_fail():
+    def broken():
+        raise OSError("mirror down")
+        yield
+
+    assert list(merge_ranked([broken, lambda: iter(["a"])], key=lambda row: row)) == ["a"]
+    with pytest.raises(OSError):
+        list(merge_ranked([broken, broken], key=lambda row: row))
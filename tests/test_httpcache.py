@@ -0,0 +1,91 @@
+import os
+import sys
+from email.message import Message
+from urllib.error import HTTPError
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from httpcache import CachedResponse, CachingBrowser, ResponseCache  # noqa: E402
+from sharedcache import SharedCache  # noqa: E402
+
+URL = "https://annas-archive.org/md5/d64efd386ed7227592499460aca2044b"
+
+
+class FakeBrowser:
+    def __init__(self, body):
+        self.body = body
+        self.addheaders = [("User-Agent", "test")]
+        self.sent = []
+
+    def open(self, url, timeout=None):
+        headers = dict(self.addheaders)
+        self.sent.append(headers)
+        if headers.get("If-None-Match") == '"v1"':
+            raise HTTPError(url, 304, "Not Modified", Message(), None)
+        info = Message()
+        info["ETag"] = '"v1"'
+        return CachedResponse(self.body, url, info)
+
+
+def test_revalidated_page_is_served_from_cache(tmp_path):
+    cache = ResponseCache(SharedCache(str(tmp_path / "cache.sqlite")))
+    br = CachingBrowser(FakeBrowser(b"<html>book</html>"), cache)
+
+    assert br.open(URL).read() == b"<html>book</html>"
+    resp = br.open(URL)
+    assert resp.code == 200
+    assert resp.read() == b"<html>book</html>"
+    assert br.sent[1]["If-None-Match"] == '"v1"'
+    # The validators don't stick to the browser
+    assert br.br.addheaders == [("User-Agent", "test")]
+
+
+def test_other_urls_are_not_cached(tmp_path):
+    cache = ResponseCache(SharedCache(str(tmp_path / "cache.sqlite")))
+    br = CachingBrowser(FakeBrowser(b"file"), cache)
+    br.open("https://libgen.example/get.php?md5=abc")
+    assert cache.size() == 0
+
+
+def test_pages_are_shared_between_processes(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    ResponseCache(SharedCache(path)).put(URL, b"<html>book</html>", '"v1"', None)
+
+    # Another process opening the same database sees the page
+    other = ResponseCache(SharedCache(path))
+    assert other.validators(URL) == {"If-None-Match": '"v1"'}
+    assert other.get(URL) == b"<html>book</html>"
+    other.remove(URL)
+    assert other.validators(URL) == {}
+
+
+def test_page_is_cached_once_read_to_the_end(tmp_path):
+    cache = ResponseCache(SharedCache(str(tmp_path / "cache.sqlite")))
+    br = CachingBrowser(FakeBrowser(b"<html>book</html>"), cache)
+
+    # Closed halfway, e.g. by a cancelled search
+    with br.open(URL) as resp:
+        assert resp.read(6) == b"<html>"
+    assert cache.get(URL) is None
+
+    with br.open(URL) as resp:
+        assert b"".join(iter(lambda: resp.read(4), b"")) == b"<html>book</html>"
+    assert cache.get(URL) == b"<html>book</html>"
+
+
+def test_page_cut_off_by_close_is_not_cached(tmp_path):
+    cache = ResponseCache(SharedCache(str(tmp_path / "cache.sqlite")))
+    br = CachingBrowser(FakeBrowser(b"<html>book</html>"), cache)
+
+    # A response closed under the reader ends early without an error
+    resp = br.open(URL)
+    resp.info()["Content-Length"] = "100000"
+    assert resp.read() == b"<html>book</html>"
+    assert cache.get(URL) is None
+    assert cache.validators(URL) == {}
+
+    resp = br.open(URL)
+    assert resp.read(6) == b"<html>"
+    resp.close()
+    assert resp.read() == b"book</html>"
+    assert cache.get(URL) is None
@@ -0,0 +1,41 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from identifiers import IdentifierCache, classify  # noqa: E402
+from sharedcache import SharedCache  # noqa: E402
+
+
+def test_classify_identifier_queries():
+    assert classify("D64EFD386ED7227592499460ACA2044B") == ("md5", "d64efd386ed7227592499460aca2044b")
+    assert classify("978-0-306-40615-7") == ("isbn", "9780306406157")
+    # ISBN-10s share the ISBN-13 cache entry
+    assert classify("ISBN 0-306-40615-2") == ("isbn", "9780306406157")
+    assert classify("https://doi.org/10.1000/XYZ123") == ("doi", "10.1000/xyz123")
+
+
+def test_normal_queries_are_not_identifiers():
+    assert classify("dune frank herbert") is None
+    # Wrong check digit
+    assert classify("978-0-306-40615-8") is None
+    assert classify("1234567890123") is None
+
+
+def test_cache_is_bounded():
+    cache = IdentifierCache(max_entries=2)
+    for i in range(3):
+        cache.remember_md5("isbn", str(i), f"md5-{i}")
+    assert cache.md5_for("isbn", "0") is None
+    assert cache.md5_for("isbn", "2") == "md5-2"
+
+
+def test_lookups_are_shared_through_the_shared_cache(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    first = IdentifierCache(shared=SharedCache(path))
+    first.remember_md5("isbn", "9780441013593", "d64e")
+    first.remember_record("d64e", ("Dune", "Frank Herbert", "EPUB", ""))
+
+    other = IdentifierCache(shared=SharedCache(path))
+    assert other.md5_for("isbn", "9780441013593") == "d64e"
+    assert other.record("d64e") == ("Dune", "Frank Herbert", "EPUB", "")
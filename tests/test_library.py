@@ -0,0 +1,65 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library import LibraryIndex, author_key, title_key  # noqa: E402
+
+
+class Library:
+    # The parts of calibre's db.new_api the index uses
+    def __init__(self, books):
+        self.books = books
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def all_book_ids(self):
+        return frozenset(self.books)
+
+    def has_id(self, book_id):
+        return book_id in self.books
+
+    def all_field_for(self, field, book_ids, default_value=None):
+        return {book_id: self.books[book_id].get(field, default_value) for book_id in book_ids if book_id in self.books}
+
+    def emit(self, event, *args):
+        for listener in self.listeners:
+            listener("library", event, args)
+
+
+def test_keys_ignore_case_accents_articles_and_author_order():
+    assert title_key("Les Misérables: A Novel") == title_key("les miserables") == "les miserables"
+    assert title_key("The Hobbit") == title_key("hobbit: or There and Back Again")
+    assert author_key("Tolkien, J. R. R.; Someone Else") == author_key(["J. R. R. Tolkien"])
+
+
+def test_index_matches_and_follows_library_changes():
+    db = Library(
+        {
+            1: {"title": "The Hobbit", "authors": ("J. R. R. Tolkien",), "identifiers": {"isbn": "9780261102217"}},
+            2: {"title": "Dune", "authors": ("Frank Herbert",), "identifiers": {}},
+        }
+    )
+    index = LibraryIndex()
+    index.attach(db)
+    assert index.wait(5)
+    assert len(index) == 2
+    assert index.match("Hobbit", "Tolkien, J. R. R.") == 1
+    assert index.match("Something else", "Nobody", [("isbn", "9780261102217")]) == 1
+    assert index.match("Dune", "Brian Herbert") is None
+
+    db.books[2]["title"] = "Dune Messiah"
+    db.emit(type("Event", (), {"name": "metadata_changed"}), "title", {2})
+    db.books[3] = {"title": "Emma", "authors": ("Jane Austen",), "identifiers": {}}
+    db.emit("book_created", 3)
+    del db.books[1]
+    db.emit("books_removed", {1})
+    index.wait(5)
+
+    assert index.match("Dune", "Frank Herbert") is None
+    assert index.match("Dune Messiah", "Frank Herbert") == 2
+    assert index.match("Emma", "Austen, Jane") == 3
+    assert index.match("The Hobbit", "J. R. R. Tolkien") is None
+    assert len(index) == 2
@@ -0,0 +1,85 @@
+import multiprocessing
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parsing import Parser, parse_download_links, parse_md5_page, parse_search_rows  # noqa: E402
+
+SEARCH_PAGE = """
+<html><head><meta charset="utf-8"/></head><body><table>
+<tr>
+    <td><img src="https://example.com/small.jpg"/><div id="hover_cover"><img src="https://example.com/large.jpg"/></div></td>
+    <td><a href="/md5/d64efd386ed7227592499460aca2044b" class="js-vim-focus">Dune</a></td>
+    <td>Frank Herbert</td>
+    <td>Ace</td><td>1965</td><td>dune.epub</td><td>🚀/lgli/zlib</td><td>English [en], French [fr]</td><td>📗 Book (fiction)</td>
+    <td>epub</td>
+    <td>1.2MB</td>
+</tr>
+<tr>
+    <td></td>
+    <td><a href="/md5/0123456789abcdef0123456789abcdef" class="js-vim-focus">Untitled</a></td>
+    <td></td>
+    <td></td><td></td><td></td><td></td><td></td><td></td><td></td><td></td>
+</tr>
+</table></body></html>
+""".encode()
+
+MD5_PAGE = """
+<html><head><meta charset="utf-8"/><meta property="og:title" content="Dune"/><meta property="og:image" content="https://example.com/c.jpg"/></head>
+<body>
+    <div class="text-3xl font-bold">Dune</div>
+    <div class="italic">Frank Herbert 🔍</div>
+    <div class="text-sm text-gray-500">English [en], .epub, 🚀/lgli/zlib, 1.2MB, 📗 Book (fiction)</div>
+    <div id="md5-panel-downloads"><ul class="list-inside">
+        <li><a class="js-download-link" href="https://libgen.example/ads.php?md5=d64e">Libgen.rs Fiction</a></li>
+        <li><a class="js-download-link" href="https://z-lib.example/md5/d64e">Z-Library</a></li>
+    </ul></div>
+</body></html>
+""".encode()
+
+
+def test_search_rows():
+    assert parse_search_rows(SEARCH_PAGE) == [
+        (
+            "d64efd386ed7227592499460aca2044b",
+            "Dune",
+            "Frank Herbert",
+            "EPUB",
+            "https://example.com/small.jpg",
+            "en,fr",
+            "lgli,zlib",
+            "book (fiction)",
+        ),
+        ("0123456789abcdef0123456789abcdef", "Untitled", "Unknown", "UNKNOWN", "", "", "", ""),
+    ]
+
+
+def test_md5_page():
+    assert parse_md5_page(MD5_PAGE) == ("Dune", "Frank Herbert", "EPUB", "https://example.com/c.jpg")
+    assert parse_download_links(MD5_PAGE) == [
+        ("https://libgen.example/ads.php?md5=d64e", "Libgen.rs Fiction"),
+        ("https://z-lib.example/md5/d64e", "Z-Library"),
+    ]
+
+
+def test_process_pool_returns_the_same_rows():
+    parser = Parser(processes=1)
+    try:
+        assert parser.run(parse_search_rows, SEARCH_PAGE) == parse_search_rows(SEARCH_PAGE)
+    finally:
+        parser.close()
+
+
+def test_workers_are_started_with_the_parser():
+    before = {child.pid for child in multiprocessing.active_children()}
+    parser = Parser(processes=2)
+    try:
+        # Not when the first page comes in, by then the store's threads are running
+        assert len({child.pid for child in multiprocessing.active_children()} - before) == 2
+        parser.close()
+        # A closed pool isn't started again
+        assert parser.run(parse_search_rows, SEARCH_PAGE) == parse_search_rows(SEARCH_PAGE)
+        assert parser._pool is None
+    finally:
+        parser.close()
@@ -0,0 +1,81 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cancellation import CancelToken  # noqa: E402
+from prefetch import Prefetcher  # noqa: E402
+
+
+def test_finished_prefetch_is_taken_once():
+    prefetcher = Prefetcher(workers=1)
+    token = prefetcher.restart(CancelToken())
+    calls = []
+    started = threading.Event()
+
+    def lookup(budget):
+        calls.append(budget.remaining())
+        started.set()
+        return ["link"]
+
+    prefetcher.submit("md5", lookup, token, timeout=30)
+    assert started.wait(5)
+    prefetcher.submit("md5", lookup, token, timeout=30)
+    assert prefetcher.take("md5", timeout=5) == (True, ["link"])
+    assert prefetcher.take("md5", timeout=5) == (False, None)
+    assert len(calls) == 1 and 0 < calls[0] <= 30
+    prefetcher.close()
+
+
+def test_queued_prefetch_is_taken_back_and_restart_cancels_running():
+    prefetcher = Prefetcher(workers=1)
+    token = prefetcher.restart(CancelToken())
+    started = threading.Event()
+    stopped = threading.Event()
+
+    def slow(budget):
+        started.set()
+        budget.wait(10)
+        stopped.set()
+        budget.check()
+
+    prefetcher.submit("slow", slow, token, timeout=30)
+    prefetcher.submit("queued", lambda budget: "never", token, timeout=30)
+    assert started.wait(5)
+    # Waiting behind the queue would be slower than doing it ourselves
+    assert prefetcher.take("queued", timeout=5) == (False, None)
+
+    prefetcher.restart(CancelToken())
+    assert stopped.wait(5)
+    assert token.cancelled
+    assert prefetcher.take("slow", timeout=5) == (False, None)
+    prefetcher.close()
+
+
+def test_failed_prefetch_is_a_miss_and_can_be_retried():
+    prefetcher = Prefetcher(workers=1)
+    token = prefetcher.restart(CancelToken())
+    failed = threading.Event()
+    started = threading.Event()
+
+    def broken(budget):
+        failed.set()
+        raise OSError("mirror down")
+
+    def working(budget):
+        started.set()
+        return "ok"
+
+    prefetcher.submit("md5", broken, token, timeout=30)
+    assert failed.wait(5)
+    time.sleep(0.1)
+    # The failure doesn't block a new attempt
+    prefetcher.submit("md5", working, token, timeout=30)
+    assert started.wait(5)
+    assert prefetcher.take("md5", timeout=5) == (True, "ok")
+
+    prefetcher.submit("other", broken, token, timeout=30)
+    assert prefetcher.take("other", timeout=5) == (False, None)
+    prefetcher.close()
@@ -0,0 +1,81 @@
+import cProfile
+import glob
+import json
+import os
+import sys
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from profiling import PROFILE_ENV, Tracer, profile_mode  # noqa: E402
+
+
+def test_generator_trace_records_spans_and_rotates(tmp_path):
+    tracer = Tracer(str(tmp_path), "cprofile", keep=2)
+
+    def rows():
+        for i in range(3):
+            with tracer.span("parse", row=i):
+                yield i
+
+    for _ in range(3):
+        assert list(tracer.generator("search", rows(), query="dune")) == [0, 1, 2]
+
+    traces = sorted(glob.glob(str(tmp_path / "*.json")))
+    assert len(traces) == 2
+    assert len(glob.glob(str(tmp_path / "*.prof"))) == 2
+    with open(traces[-1]) as f:
+        events = json.load(f)["traceEvents"]
+    assert [event["name"] for event in events] == ["search", "parse", "parse", "parse"]
+    assert events[0]["args"] == {"query": "dune", "results": "3"}
+
+
+def test_disabled_tracer_writes_nothing(tmp_path):
+    tracer = Tracer(str(tmp_path))
+    with tracer.span("fetch"):
+        pass
+    assert tracer.call("get_details", lambda: 42) == 42
+    assert os.listdir(tmp_path) == []
+
+
+def test_environment_overrides_setting(monkeypatch):
+    monkeypatch.delenv(PROFILE_ENV, raising=False)
+    assert profile_mode(False) is None
+    assert profile_mode(True) == "cprofile"
+    monkeypatch.setenv(PROFILE_ENV, "trace")
+    assert profile_mode(False) == "trace"
+    monkeypatch.setenv(PROFILE_ENV, "0")
+    assert profile_mode(True) is None
+
+
+def test_concurrent_calls_take_turns_at_the_profiler(tmp_path):
+    tracer = Tracer(str(tmp_path), "cprofile")
+    inside, done = threading.Event(), threading.Event()
+
+    def first():
+        inside.set()
+        done.wait(5)
+        return "first"
+
+    results = []
+    thread = threading.Thread(target=lambda: results.append(tracer.call("search", first)))
+    thread.start()
+    assert inside.wait(5)
+    # Profiled by nobody while the first call has the profiler, but it still works and is traced
+    assert tracer.call("get_details", lambda: "second") == "second"
+    done.set()
+    thread.join(5)
+    assert results == ["first"]
+    assert len(glob.glob(str(tmp_path / "*.json"))) == 2
+    assert [os.path.basename(path)[-11:] for path in glob.glob(str(tmp_path / "*.prof"))] == ["search.prof"]
+
+
+def test_another_active_profiler_is_left_alone(tmp_path):
+    tracer = Tracer(str(tmp_path), "cprofile")
+    other = cProfile.Profile()
+    other.enable()
+    try:
+        assert tracer.call("search", lambda: 42) == 42
+    finally:
+        other.disable()
+    assert len(glob.glob(str(tmp_path / "*.json"))) == 1
@@ -0,0 +1,170 @@
+import os
+import sys
+from email.message import Message
+from urllib.error import HTTPError, URLError
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from proxies import ProxiedBrowser, ProxyPool, normalize_proxy  # noqa: E402
+
+A = "http://a.example:3128"
+B = "http://b.example:3128"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeResponse:
+    def __init__(self, error=None):
+        self.error = error
+        self.closed = False
+
+    def read(self, size=-1):
+        if self.error is not None:
+            raise self.error
+        return b"body"
+
+    def close(self):
+        self.closed = True
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.proxies = None
+        self.opened = []
+
+    def set_proxies(self, proxies):
+        self.proxies = proxies
+
+    def open(self, url, timeout=None, scope=""):
+        self.opened.append((url, scope, dict(self.proxies or {})))
+        return FakeResponse()
+
+
+def fail(error):
+    def request(proxy):
+        raise error
+
+    return request
+
+
+def test_normalize_proxy():
+    assert normalize_proxy("a.example:3128") == A
+    assert normalize_proxy(" http://user:pw@a.example:3128/ ") == "http://user:pw@a.example:3128"
+    assert normalize_proxy("socks5://a.example:1080") is None
+    assert normalize_proxy("") is None
+
+
+def test_round_robin_and_least_loaded():
+    pool = ProxyPool([A, B, "b.example:3128"])
+    assert len(pool) == 2
+    first, second = pool.acquire(), pool.acquire()
+    assert {first.url, second.url} == {A, B}
+
+    pool.configure([A, B], strategy="least_loaded")
+    busy = pool.acquire()
+    assert pool.acquire().url != busy.url
+
+
+def test_failing_proxy_leaves_rotation_until_cooldown():
+    clock = FakeClock()
+    pool = ProxyPool([A, B], max_failures=2, cooldown=60, clock=clock)
+
+    def request(proxy):
+        if proxy == A:
+            raise URLError("proxy refused")
+        return FakeResponse()
+
+    for _ in range(4):
+        try:
+            pool.open(request).close()
+        except URLError:
+            pass
+    assert pool.stats()[A]["out_for"] == 60
+    assert {pool.acquire().url for _ in range(4)} == {B}
+
+    clock.now += 61
+    assert A in {pool.acquire().url for _ in range(4)}
+
+
+def test_http_errors_from_the_mirror_dont_count_against_the_proxy():
+    pool = ProxyPool([A])
+    with pytest.raises(HTTPError):
+        pool.open(fail(HTTPError("https://mirror.example", 404, "Not Found", Message(), None)))
+    assert pool.stats()[A]["failures"] == 0
+    with pytest.raises(HTTPError):
+        pool.open(fail(HTTPError("https://mirror.example", 407, "Proxy Authentication Required", Message(), None)))
+    assert pool.stats()[A]["failures"] == 1
+
+
+def test_every_proxy_down_still_uses_one():
+    pool = ProxyPool([A], max_failures=1)
+    with pytest.raises(OSError):
+        pool.open(fail(OSError("timed out")))
+    assert pool.acquire().url == A
+
+
+def test_browser_and_opener_pass_the_proxy_and_its_scope():
+    pool = ProxyPool([A, B])
+    br = FakeBrowser()
+    proxied = ProxiedBrowser(br, pool)
+    proxied.open("https://mirror.example/search", timeout=5)
+    proxied.open("https://mirror.example/search", timeout=5)
+    assert [(scope, proxies["https"]) for _, scope, proxies in br.opened] == [(A, A), (B, B)]
+
+    calls = []
+    urlopen = pool.urlopen(lambda opener, request, scope="", **kwargs: calls.append(scope) or FakeResponse())
+    urlopen("https://mirror.example/md5/x", timeout=5)
+    assert calls == [A]
+
+    # An empty pool goes direct and leaves the browser's proxy settings alone
+    direct = ProxiedBrowser(FakeBrowser(), ProxyPool())
+    direct.open("https://mirror.example/search")
+    assert direct.br.opened == [("https://mirror.example/search", "", {})]
+
+
+def test_proxy_stays_leased_until_the_response_is_closed():
+    clock = FakeClock()
+    pool = ProxyPool([A, B], strategy="least_loaded", clock=clock)
+    proxied = ProxiedBrowser(FakeBrowser(), pool)
+
+    def request(proxy):
+        clock.now += 0.5
+        return FakeResponse()
+
+    with pool.open(request) as resp:
+        # Still reading the body through A, so the next request goes to B
+        clock.now += 10
+        assert resp.read() == b"body"
+        assert pool.stats()[A]["in_flight"] == 1
+        proxied.open("https://mirror.example/search").close()
+        assert proxied.br.opened[-1][1] == B
+    assert resp.resp.closed
+    resp.close()
+    stats = pool.stats()[A]
+    assert (stats["in_flight"], stats["successes"], stats["latency"]) == (0, 1, 0.5)
+
+
+def test_failed_read_counts_against_the_proxy():
+    pool = ProxyPool([A])
+    resp = pool.open(lambda proxy: FakeResponse(OSError("connection reset")))
+    with pytest.raises(OSError):
+        resp.read()
+    resp.close()
+    assert pool.stats()[A]["failures"] == 1
+
+    # Closed under the reader, e.g. by a cancelled search, isn't the proxy's fault
+    resp = pool.open(lambda proxy: FakeResponse())
+    resp.close()
+    resp.resp.error = ValueError("read of closed file")
+    with pytest.raises(ValueError):
+        resp.read()
+    stats = pool.stats()[A]
+    assert (stats["in_flight"], stats["successes"], stats["failures"]) == (0, 1, 1)
@@ -0,0 +1,106 @@
+import os
+import sys
+import threading
+import time
+from email.message import Message
+from urllib.error import HTTPError
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cancellation import Cancelled, CancelToken  # noqa: E402
+from ratelimit import RateLimiter, Throttled, parse_retry_after  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def make_limiter(**kwargs):
+    clock = FakeClock()
+    return RateLimiter(clock=clock, sleep=clock.sleep, **kwargs), clock
+
+
+def test_bucket_allows_burst_then_paces_per_host():
+    limiter, clock = make_limiter(rate=2.0, burst=2)
+    for _ in range(2):
+        assert limiter.acquire("https://a.example/x") == 0
+    assert limiter.acquire("https://a.example/y") == pytest.approx(0.5)
+    # Other hosts have their own bucket
+    assert limiter.acquire("https://b.example/x") == 0
+    # So do requests to the same host through a proxy
+    assert limiter.acquire("https://a.example/x", scope="http://proxy.example:3128") == 0
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("120") == 120
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT", now=1445412470) == 10
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+def test_throttled_response_is_retried_after_retry_after():
+    limiter, clock = make_limiter(rate=100.0, burst=10)
+    calls = []
+
+    def opener(url, timeout=None):
+        calls.append(clock.now)
+        if len(calls) == 1:
+            headers = Message()
+            headers["Retry-After"] = "3"
+            raise HTTPError(url, 429, "Too Many Requests", headers, None)
+        return "ok"
+
+    assert limiter.wrap(opener)("https://a.example/search") == "ok"
+    assert calls[1] - calls[0] >= 3
+    # The host was slowed down and recovers gradually
+    assert limiter._states[("", "a.example")].bucket.rate < 100.0
+
+
+def test_long_retry_after_gives_up_so_next_mirror_is_tried():
+    limiter, clock = make_limiter()
+
+    def opener(url, timeout=None):
+        headers = Message()
+        headers["Retry-After"] = "600"
+        raise HTTPError(url, 503, "Service Unavailable", headers, None)
+
+    with pytest.raises(HTTPError):
+        limiter.wrap(opener, max_wait=30)("https://a.example/search")
+    assert clock.slept == []
+
+
+def test_wait_longer_than_allowed_fails_fast_and_gives_the_turn_back():
+    limiter, clock = make_limiter(rate=1.0, burst=1)
+    limiter.throttled("https://a.example/search", "40")
+    with pytest.raises(Throttled) as raised:
+        limiter.acquire("https://a.example/search", max_wait=30)
+    assert raised.value.code == 429 and raised.value.wait == pytest.approx(40)
+    # Nor past the caller's deadline
+    with pytest.raises(Throttled):
+        limiter.acquire("https://a.example/search", max_wait=60, token=CancelToken(5))
+    assert clock.slept == []
+
+    clock.now += 40
+    assert limiter.acquire("https://a.example/search", max_wait=30) == 0
+
+
+def test_waiting_for_a_turn_ends_on_cancellation():
+    limiter = RateLimiter(rate=0.5, burst=1)
+    limiter.acquire("https://a.example/search")
+    token = CancelToken(30)
+    threading.Timer(0.1, token.cancel).start()
+    start = time.monotonic()
+    with pytest.raises(Cancelled):
+        limiter.acquire("https://a.example/search", token=token)
+    assert time.monotonic() - start < 1
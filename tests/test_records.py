@@ -0,0 +1,40 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import ResultRecord  # noqa: E402
+
+
+class SearchResult:
+    DRM_UNLOCKED = 2
+
+    def __init__(self):
+        self.downloads = {}
+
+
+def test_record_is_compact():
+    record = ResultRecord("md5", "Dune", "".join(["Frank ", "Herbert"]), "".join(["EP", "UB"]), "")
+    assert not hasattr(record, "__dict__")
+    assert record._downloads is None
+    assert record.author is ResultRecord("md5", "Dune", "".join(["Frank ", "Herbert"]), "EPUB", "").author
+    assert record.formats is sys.intern("EPUB")
+
+
+def test_conversion_to_search_result():
+    record = ResultRecord("d64e", "Dune", "Frank Herbert", "EPUB", "https://example.com/c.jpg")
+    record.downloads["Z-Library.EPUB"] = "https://z-lib.example/dl"
+    s = record.to_search_result(SearchResult)
+    assert (s.detail_item, s.title, s.author, s.formats, s.cover_url) == (
+        "d64e",
+        "Dune",
+        "Frank Herbert",
+        "EPUB",
+        "https://example.com/c.jpg",
+    )
+    assert s.price == "$0.00"
+    assert s.drm == SearchResult.DRM_UNLOCKED
+    assert s.downloads == {"Z-Library.EPUB": "https://z-lib.example/dl"}
+    assert s.downloads is not record.downloads
+    assert record.to_search_result(SearchResult, library_id=12).price == "In library"
+    assert record.to_search_result(SearchResult).price == "$0.00"
@@ -0,0 +1,100 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cancellation import Cancelled, CancelToken  # noqa: E402
+from httpcache import CachedResponse  # noqa: E402
+from resolvers import Resolver, ResolverRegistry, ZLibraryResolver  # noqa: E402
+
+
+class Fixed(Resolver):
+    def __init__(self, name, priority, result="https://dl.example/book", error=None):
+        self.name = name
+        self.link_texts = (name,)
+        self.priority = priority
+        self.result = result
+        self.error = error
+
+    def resolve(self, url, br, token):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class Browser:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def open(self, url, timeout=None):
+        return CachedResponse(self.pages[url], url)
+
+
+def test_default_resolvers_match_the_link_texts():
+    registry = ResolverRegistry()
+    assert registry.find("Libgen.rs Non-Fiction", "").name == "Libgen.rs"
+    assert registry.find("Sci-Hub: sci-hub.se", "").name == "Sci-Hub"
+    assert registry.find("Slow Partner Server #1", "") is None
+    # Can't be resolved, so there is nothing to enable
+    registry.configure({"Libgen.li": {"enabled": True}})
+    assert registry.find("Libgen.li", "") is None
+    registry.configure({"Z-Library": {"enabled": False}})
+    assert registry.find("Z-Library", "") is None
+
+    class Unfinished(Resolver):
+        name = "Unfinished"
+
+    with pytest.raises(TypeError):
+        registry.register(Unfinished())
+
+
+def test_zlibrary_resolver_builds_the_download_url():
+    br = Browser({"https://z-lib.example/md5/d64e": b'<a class="addDownloadedBook" href="/dl/123">Get</a>'})
+    url = ZLibraryResolver().resolve("https://z-lib.example/md5/d64e", br, CancelToken(5))
+    assert url == "https://z-lib.example/dl/123"
+
+
+def test_failing_resolvers_are_deprioritized_then_skipped():
+    now = [0.0]
+    broken = Fixed("broken", priority=15, error=OSError("down"))
+    registry = ResolverRegistry(
+        [broken, Fixed("working", priority=10)], max_failures=3, cooldown=60, clock=lambda: now[0]
+    )
+    links = [("https://a.example", "broken"), ("https://b.example", "working")]
+    assert [resolver.name for resolver, _, _ in registry.plan(links)] == ["broken", "working"]
+
+    for expected in (["working", "broken"], ["working", "broken"], ["working"]):
+        with pytest.raises(OSError):
+            registry.resolve(broken, "https://a.example", None, CancelToken(5))
+        assert [resolver.name for resolver, _, _ in registry.plan(links)] == expected
+
+    # Gets another chance after the cooldown and is trusted again once it works
+    now[0] = 61
+    assert registry.skipped(broken) is False
+    broken.error = None
+    assert registry.resolve(broken, "https://a.example", None, CancelToken(5)) == "https://dl.example/book"
+    assert registry.stats()["broken"]["successes"] == 1
+    assert [resolver.name for resolver, _, _ in registry.plan(links)] == ["broken", "working"]
+
+
+def test_budget_caps_the_resolver_and_cancellation_is_not_held_against_it():
+    class Slow(Resolver):
+        name = "slow"
+        timeout = 0.05
+
+        def resolve(self, url, br, token):
+            token.wait(1)
+            token.check()
+
+    registry = ResolverRegistry([Slow()])
+    with pytest.raises(Cancelled):
+        registry.resolve(registry.resolvers[0], "https://a.example", None, CancelToken(5))
+    assert registry.stats()["slow"]["failures"] == 1
+
+    token = CancelToken(5)
+    token.cancel()
+    with pytest.raises(Cancelled):
+        registry.resolve(registry.resolvers[0], "https://a.example", None, token)
+    assert registry.stats()["slow"]["failures"] == 1
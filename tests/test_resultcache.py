@@ -0,0 +1,60 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import ResultRecord  # noqa: E402
+from resultcache import ResultCache, matches  # noqa: E402
+from sharedcache import SharedCache  # noqa: E402
+
+KEY = (("q", ("dune",)), ("sort", ("",)))
+RECORDS = [
+    ResultRecord("1", "Dune", "Frank Herbert", "EPUB", "", "en", "lgli,zlib", "book (fiction)"),
+    ResultRecord("2", "Dune", "Frank Herbert", "PDF", "", "en,fr", "zlib", "book (fiction)"),
+    ResultRecord("3", "Dune", "Frank Herbert", "EPUB", "", "", "ia", "book (unknown)"),
+]
+
+
+def test_matches_checks_every_filter():
+    assert matches(RECORDS[1], {"ext": frozenset({"pdf"}), "lang": frozenset({"fr"})})
+    assert not matches(RECORDS[0], {"ext": frozenset({"epub"}), "src": frozenset({"ia"})})
+    assert matches(RECORDS[2], {"lang": frozenset({"_empty"})})
+
+
+def test_narrower_filters_are_answered_from_the_superset():
+    cache = ResultCache()
+    cache.put(KEY, {}, RECORDS, complete=True)
+
+    assert cache.get(KEY, {"ext": frozenset({"epub"})}, 10) == [RECORDS[0], RECORDS[2]]
+    assert cache.get(KEY, {"ext": frozenset({"epub"}), "src": frozenset({"zlib"})}, 10) == [RECORDS[0]]
+    # Another query or ordering is a different search
+    assert cache.get((("q", ("emma",)),), {}, 10) is None
+
+
+def test_superset_must_supply_enough_results_or_be_complete():
+    cache = ResultCache()
+    cache.put(KEY, {"ext": frozenset({"epub", "pdf"})}, RECORDS[:2], complete=False)
+
+    assert cache.get(KEY, {"ext": frozenset({"pdf"})}, 1) == [RECORDS[1]]
+    # Only one PDF is cached but the search wasn't exhausted, there may be more
+    assert cache.get(KEY, {"ext": frozenset({"pdf"})}, 2) is None
+    # A wider filter than the cached one can't be answered
+    assert cache.get(KEY, {"ext": frozenset({"pdf", "mobi"})}, 1) is None
+    assert cache.get(KEY, {}, 1) is None
+
+
+def test_entries_expire():
+    now = [0.0]
+    cache = ResultCache(ttl=60, clock=lambda: now[0])
+    cache.put(KEY, {}, RECORDS, complete=True)
+    now[0] = 61
+    assert cache.get(KEY, {}, 10) is None
+
+
+def test_results_are_shared_between_processes(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    ResultCache(shared=SharedCache(path), record_type=ResultRecord).put(KEY, {}, RECORDS, complete=True)
+
+    other = ResultCache(shared=SharedCache(path), record_type=ResultRecord)
+    records = other.get(KEY, {"lang": frozenset({"fr"})}, 10)
+    assert [record.to_row() for record in records] == [RECORDS[1].to_row()]
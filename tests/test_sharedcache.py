@@ -0,0 +1,58 @@
+import os
+import sys
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sharedcache import SharedCache  # noqa: E402
+
+
+def test_values_round_trip_compactly(tmp_path):
+    cache = SharedCache(str(tmp_path / "cache.sqlite"))
+    record = ["Dune", "Frank Herbert", "EPUB", "https://example.com/c.jpg"]
+    cache.put("record", "d64e", record)
+    cache.put("page", "https://a.example/md5/d64e", b"<html>" * 1000)
+
+    assert cache.get("record", "d64e") == record
+    assert cache.get("page", "https://a.example/md5/d64e") == b"<html>" * 1000
+    assert cache.size("page") < 1000
+    assert cache.get("record", "missing") is None
+    assert cache.get("page", "d64e") is None
+    assert cache._db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_expired_and_least_recently_used_entries_go(tmp_path):
+    now = [1000.0]
+    cache = SharedCache(str(tmp_path / "cache.sqlite"), max_size=2500, clock=lambda: now[0])
+    cache.put("mirrors", "down", 1.0, ttl=60)
+    for i in range(2):
+        now[0] += 100
+        cache.put("page", str(i), os.urandom(1000))
+    # Reading refreshes the access time of the first page, so the second one goes first
+    now[0] += 100
+    assert cache.get("page", "0") is not None
+    cache.put("page", "2", os.urandom(1000))
+    for i in range(3, 20):
+        now[0] += 1
+        cache.put("page", str(i), os.urandom(10))
+
+    assert cache.get("mirrors", "down") is None
+    assert cache.get("page", "0") is not None
+    assert cache.get("page", "1") is None
+    assert cache.size() <= 2500
+
+
+def test_concurrent_writers(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    caches = [SharedCache(path) for _ in range(4)]
+
+    def write(cache, n):
+        for i in range(50):
+            cache.put("identifier", f"{n}:{i}", "d64e")
+
+    threads = [threading.Thread(target=write, args=(cache, n)) for n, cache in enumerate(caches)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(caches[0].get("identifier", f"{n}:49") == "d64e" for n in range(4))
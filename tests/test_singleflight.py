@@ -0,0 +1,138 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cancellation import Cancelled, CancelToken  # noqa: E402
+from singleflight import SingleFlight, canonical_url  # noqa: E402
+
+
+def test_concurrent_calls_share_one_result():
+    flights = SingleFlight()
+    calls = []
+    results = []
+
+    def work():
+        calls.append(1)
+        time.sleep(0.1)
+        return "page"
+
+    threads = [threading.Thread(target=lambda: results.append(flights.do("md5", work))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == ["page"] * 5
+    # Once finished, the next call does the work again
+    flights.do("md5", work)
+    assert len(calls) == 2
+
+
+def test_follower_reruns_when_the_leader_is_cancelled():
+    flights = SingleFlight()
+    errors = []
+
+    def lead():
+        token = CancelToken(0.2)
+
+        def work():
+            time.sleep(0.3)
+            token.check()
+
+        try:
+            flights.do("md5", work, rerun=(Cancelled,))
+        except Cancelled as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    time.sleep(0.05)
+    # Only the leader's deadline ran out, this caller still has time to do the work itself
+    assert flights.do("md5", lambda: "links", timeout=5, rerun=(Cancelled,)) == "links"
+    leader.join()
+    assert len(errors) == 1
+
+
+def test_streams_share_items_as_they_are_produced():
+    flights = SingleFlight()
+    produced = []
+
+    def rows():
+        for i in range(3):
+            produced.append(i)
+            yield i
+
+    first = flights.stream("search", rows)
+    second = flights.stream("search", rows)
+    assert next(first) == 0
+    assert list(second) == [0, 1, 2]
+    assert list(first) == [1, 2]
+    assert produced == [0, 1, 2]
+
+
+def test_abandoned_stream_closes_the_shared_generator():
+    flights = SingleFlight()
+    closed = []
+
+    def rows():
+        try:
+            yield from range(10)
+        finally:
+            closed.append(True)
+
+    stream = flights.stream("search", rows)
+    next(stream)
+    stream.close()
+    assert closed == [True]
+    assert list(flights.stream("search", rows)) == list(range(10))
+
+
+def test_canonical_url_ignores_parameter_order():
+    a = "{base}/search?page={page}&q=dune&display=table&ext=epub"
+    b = "{base}/search?ext=epub&display=table&q=dune&page={page}"
+    assert canonical_url(a) == canonical_url(b)
+
+
+def test_stream_stops_once_every_callers_token_is_cancelled():
+    flights = SingleFlight()
+    request = CancelToken()
+    fetching = threading.Event()
+
+    def pages():
+        yield "page 1"
+        fetching.set()
+        # A request blocked on a slow mirror, it only ends when the shared token is cancelled
+        request.wait(5)
+        request.check()
+        yield "page 2"
+
+    callers = [CancelToken(), CancelToken()]
+    results = []
+
+    def consume(token):
+        try:
+            results.append(list(flights.stream("search", pages, cancel=request.cancel, token=token)))
+        except Cancelled:
+            results.append("cancelled")
+
+    threads = [threading.Thread(target=consume, args=(token,)) for token in callers]
+    threads[0].start()
+    assert fetching.wait(5)
+    threads[1].start()
+    while flights._streams["search"].consumers < 2:
+        time.sleep(0.01)
+
+    callers[0].cancel()
+    time.sleep(0.1)
+    assert not request.cancelled
+    callers[1].cancel()
+    for thread in threads:
+        thread.join(5)
+    assert request.cancelled
+    assert results == ["cancelled", "cancelled"]
+    # The next caller starts over
+    assert "search" not in flights._streams
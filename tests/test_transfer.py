@@ -0,0 +1,107 @@
+import gzip
+import io
+import os
+import sys
+import zlib
+from email.message import Message
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transfer import ACCEPT_ENCODING, CompressingBrowser, DecodedResponse, TransferStats  # noqa: E402
+
+PAGE = b"<table>" + b"<tr><td>Some book</td><td>Some author</td></tr>" * 2000 + b"</table>"
+
+
+class FakeResponse(io.BytesIO):
+    def __init__(self, body, encoding=None, url="https://annas-archive.org/search?q=x"):
+        super().__init__(body)
+        self.headers = Message()
+        if encoding:
+            self.headers["Content-Encoding"] = encoding
+        self.url = url
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+
+class FakeBrowser:
+    def __init__(self, resp):
+        self.resp = resp
+        self.addheaders = [("User-Agent", "test"), ("Accept-Encoding", "identity")]
+        self.sent = None
+        self.gzip = True
+
+    def set_handle_gzip(self, handle):
+        self.gzip = handle
+
+    def open(self, url, timeout=None):
+        self.sent = dict(self.addheaders)
+        return self.resp
+
+
+def test_gzip_is_decoded_in_pieces_and_counted():
+    stats = TransferStats()
+    wire = gzip.compress(PAGE)
+    resp = DecodedResponse(FakeResponse(wire, "gzip"), stats)
+    body = b""
+    while True:
+        chunk = resp.read(1000)
+        if not chunk:
+            break
+        assert len(chunk) <= 1000
+        body += chunk
+    assert body == PAGE
+    snapshot = stats.snapshot()
+    assert snapshot["wire_bytes"] == len(wire) < len(PAGE) == snapshot["decoded_bytes"]
+    assert snapshot["by_encoding"]["gzip"]["responses"] == 1
+    assert snapshot["by_host"]["annas-archive.org"]["responses"] == 1
+
+
+def test_deflate_zlib_wrapped_and_raw():
+    raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    for wire in (zlib.compress(PAGE), raw.compress(PAGE) + raw.flush()):
+        assert DecodedResponse(FakeResponse(wire, "deflate")).read() == PAGE
+
+
+def test_identity_is_passed_through_and_recorded_once_on_close():
+    stats = TransferStats()
+    resp = DecodedResponse(FakeResponse(PAGE), stats)
+    assert resp.read(10) == PAGE[:10]
+    resp.close()
+    resp.close()
+    snapshot = stats.snapshot()
+    assert snapshot["responses"] == 1
+    assert snapshot["by_encoding"]["identity"]["wire_bytes"] < len(PAGE)
+
+
+def test_browser_asks_for_compression_and_restores_headers():
+    br = FakeBrowser(FakeResponse(gzip.compress(PAGE), "gzip"))
+    compressing = CompressingBrowser(br)
+    assert br.gzip is False
+    assert compressing.open("https://annas-archive.org/md5/x", timeout=5).read() == PAGE
+    assert br.sent["Accept-Encoding"] == ACCEPT_ENCODING
+    assert "gzip" in ACCEPT_ENCODING
+    assert br.addheaders == [("User-Agent", "test"), ("Accept-Encoding", "identity")]
+
+    # Wrappers above swap the headers through it
+    compressing.addheaders = [("If-None-Match", '"1"')]
+    assert br.addheaders == [("If-None-Match", '"1"')]
+
+
+def test_body_cut_short_is_not_complete():
+    wire = gzip.compress(PAGE)
+    cut = DecodedResponse(FakeResponse(wire[: len(wire) // 2], "gzip"))
+    cut.read()
+    assert not cut.complete
+    whole = DecodedResponse(FakeResponse(wire, "gzip"))
+    whole.read()
+    assert whole.complete
+
+    plain = FakeResponse(PAGE[:1000])
+    plain.headers["Content-Length"] = str(len(PAGE))
+    resp = DecodedResponse(plain)
+    resp.read()
+    assert not resp.complete
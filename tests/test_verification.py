@@ -0,0 +1,59 @@
+import os
+import sys
+from email.message import Message
+from urllib.error import HTTPError
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from verification import LinkVerifier  # noqa: E402
+
+
+class FakeResponse:
+    def __init__(self, content_type):
+        self.message = Message()
+        self.message["Content-Type"] = content_type
+
+    def info(self):
+        return self.message
+
+    def close(self):
+        pass
+
+
+def test_head_rejected_falls_back_to_range_get():
+    requests = []
+
+    def opener(request, timeout=None):
+        requests.append((request.get_method(), request.get_header("Range")))
+        if request.get_method() == "HEAD":
+            raise HTTPError(request.full_url, 405, "Method Not Allowed", Message(), None)
+        return FakeResponse("application/pdf")
+
+    verifier = LinkVerifier(opener=opener)
+    assert verifier.verify("https://files.example/a.pdf") is True
+    assert requests == [("HEAD", None), ("GET", "bytes=0-0")]
+
+    # The host is remembered as rejecting HEAD and as serving files
+    assert verifier.verdict("https://files.example/b.pdf") is True
+    requests.clear()
+    verifier._hosts.clear()
+    assert verifier.verify("https://files.example/c.pdf") is True
+    assert requests == [("GET", "bytes=0-0")]
+
+
+def test_verdicts_are_cached_until_ttl():
+    calls = []
+
+    def opener(request, timeout=None):
+        calls.append(request.full_url)
+        return FakeResponse("text/html")
+
+    verifier = LinkVerifier(opener=opener)
+    assert verifier.verify("https://files.example/a.pdf") is False
+    assert verifier.verify("https://files.example/a.pdf") is False
+    assert calls == ["https://files.example/a.pdf"]
+
+    verifier.ttl = -1
+    verifier._urls.clear()
+    verifier.verify("https://files.example/a.pdf")
+    assert verifier.verdict("https://files.example/a.pdf") is None
@@ -0,0 +1,22 @@
+import os
+import socket
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from warmup import preconnect  # noqa: E402
+
+
+def test_preconnect_measures_the_connection():
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        port = server.getsockname()[1]
+        assert 0 <= preconnect(f"http://127.0.0.1:{port}", timeout=2) < 2
+
+
+def test_unreachable_mirror_raises_oserror():
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        port = server.getsockname()[1]
+    with pytest.raises(OSError):
+        preconnect(f"http://127.0.0.1:{port}", timeout=2)
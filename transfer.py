@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import threading
+import zlib
+from typing import Any, Callable, Dict
+from urllib.parse import urlsplit
+from urllib.request import Request
+
+__all__ = ("ACCEPT_ENCODING", "CompressingBrowser", "DecodedResponse", "TransferStats", "compressing_opener")
+
+try:
+    import brotli  # pyright: ignore[reportMissingImports]
+except ImportError:
+    try:
+        import brotlicffi as brotli  # pyright: ignore[reportMissingImports]
+    except ImportError:
+        brotli = None
+
+try:
+    from compression import zstd  # pyright: ignore[reportMissingImports]
+except ImportError:
+    zstd = None
+    try:
+        import zstandard  # pyright: ignore[reportMissingImports]
+    except ImportError:
+        zstandard = None
+
+# Read the wire in chunks of this size, so a page is never held compressed and decoded in full at once
+_CHUNK = 64 * 1024
+
+
+def _gzip() -> Callable[[bytes], bytes]:
+    return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress
+
+
+class _Deflate:
+    # "deflate" is meant to be zlib wrapped, but some servers send a raw stream
+    def __init__(self) -> None:
+        self._decoder: Any = None
+
+    @property
+    def eof(self) -> bool:
+        return self._decoder is not None and self._decoder.eof
+
+    def __call__(self, data: bytes) -> bytes:
+        if self._decoder is None:
+            self._decoder = zlib.decompressobj()
+            try:
+                return self._decoder.decompress(data)
+            except zlib.error:
+                self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._decoder.decompress(data)
+
+
+def _brotli() -> Callable[[bytes], bytes]:
+    decoder = brotli.Decompressor()
+    return getattr(decoder, "process", None) or decoder.decompress
+
+
+def _zstd() -> Callable[[bytes], bytes]:
+    if zstd is not None:
+        return zstd.ZstdDecompressor().decompress
+    return zstandard.ZstdDecompressor().decompressobj().decompress
+
+
+_DECODERS: Dict[str, Callable[[], Callable[[bytes], bytes]]] = {"gzip": _gzip, "x-gzip": _gzip, "deflate": _Deflate}
+if brotli is not None:
+    _DECODERS["br"] = _brotli
+if zstd is not None or zstandard is not None:
+    _DECODERS["zstd"] = _zstd
+
+
+def _stream_ended(decode: Callable[[bytes], bytes]) -> bool | None:
+    """Whether the decoder has seen the end of the compressed stream, None if it can't tell."""
+    decoder = getattr(decode, "__self__", decode)
+    eof = getattr(decoder, "eof", None)
+    if eof is None and hasattr(decoder, "is_finished"):
+        eof = decoder.is_finished()
+    return eof
+
+
+# Best first, only what we can decode
+ACCEPT_ENCODING = ", ".join(name for name in ("zstd", "br", "gzip", "deflate") if name in _DECODERS)
+
+
+class TransferStats:
+    """Bytes received on the wire and after decoding, per host and content encoding."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stats: dict[tuple[str, str], list[int]] = {}
+
+    def record(self, host: str, encoding: str, wire: int, decoded: int) -> None:
+        with self._lock:
+            stats = self._stats.setdefault((host, encoding), [0, 0, 0])
+            stats[0] += 1
+            stats[1] += wire
+            stats[2] += decoded
+
+    def snapshot(self) -> dict[str, Any]:
+        """Totals plus a breakdown by encoding and by host, e.g. for the load test report."""
+        totals = {"responses": 0, "wire_bytes": 0, "decoded_bytes": 0}
+        by_encoding: dict[str, dict[str, int]] = {}
+        by_host: dict[str, dict[str, int]] = {}
+        with self._lock:
+            items = [(key, list(stats)) for key, stats in self._stats.items()]
+        for (host, encoding), (responses, wire, decoded) in items:
+            for bucket in (totals, by_encoding.setdefault(encoding, {}), by_host.setdefault(host, {})):
+                bucket["responses"] = bucket.get("responses", 0) + responses
+                bucket["wire_bytes"] = bucket.get("wire_bytes", 0) + wire
+                bucket["decoded_bytes"] = bucket.get("decoded_bytes", 0) + decoded
+        return {**totals, "by_encoding": by_encoding, "by_host": by_host}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+class DecodedResponse:
+    """
+    Wraps a response, decoding its body as it is read according to its Content-Encoding.
+
+    The body is decompressed chunk by chunk, so reading a page in pieces never holds the whole
+    compressed page next to the decoded one. Once the body has been read to the end or the
+    response is closed, the byte counts are added to ``stats``.
+    """
+
+    def __init__(self, resp: Any, stats: TransferStats | None = None) -> None:
+        self.resp = resp
+        self.stats = stats
+        self.encoding = (resp.info().get("Content-Encoding") or "identity").strip().lower()
+        factory = _DECODERS.get(self.encoding)
+        self._decode: Callable[[bytes], bytes] | None = factory() if factory is not None else None
+        self._buffer = b""
+        self._eof = False
+        self._recorded = False
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        chunks = [self._buffer]
+        have = len(self._buffer)
+        while not self._eof and (size < 0 or have < size):
+            data = self.resp.read(_CHUNK)
+            if not data:
+                self._eof = True
+                self._record()
+                break
+            self.wire_bytes += len(data)
+            if self._decode is not None:
+                data = self._decode(data)
+            self.decoded_bytes += len(data)
+            chunks.append(data)
+            have += len(data)
+        body = b"".join(chunks)
+        if size < 0:
+            self._buffer = b""
+            return body
+        self._buffer = body[size:]
+        return body[:size]
+
+    @property
+    def complete(self) -> bool:
+        """
+        Whether the body was read to its real end.
+
+        http.client returns an empty read once a response is closed under it, which looks just like
+        the end of a shorter body, so the compressed stream has to have ended or the byte count has
+        to match Content-Length. A chunked body that is cut off already fails in http.client.
+        """
+        if not self._eof:
+            return False
+        if self._decode is not None:
+            ended = _stream_ended(self._decode)
+            if ended is not None:
+                return ended
+        length = self.resp.info().get("Content-Length")
+        return length is None or not length.strip().isdigit() or int(length) == self.wire_bytes
+
+    def _record(self) -> None:
+        if self._recorded or self.stats is None:
+            return
+        self._recorded = True
+        self.stats.record(urlsplit(self.geturl()).hostname or "", self.encoding, self.wire_bytes, self.decoded_bytes)
+
+    def close(self) -> None:
+        self._record()
+        self.resp.close()
+
+    def __enter__(self) -> DecodedResponse:
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def __getattr__(self, name: str) -> Any:
+        # geturl, info, code, headers, ...
+        return getattr(self.resp, name)
+
+
+class CompressingBrowser:
+    """Wraps a calibre browser, asking for compressed pages and decoding them as they are read."""
+
+    def __init__(self, br: Any, stats: TransferStats | None = None) -> None:
+        self.br = br
+        self.stats = stats
+        # mechanize's own gzip support is experimental and would decode twice
+        br.set_handle_gzip(False)
+
+    @property
+    def addheaders(self) -> Any:
+        return self.br.addheaders
+
+    @addheaders.setter
+    def addheaders(self, value: Any) -> None:
+        # CachingBrowser swaps the headers of the browser it wraps, they have to land on the real one
+        self.br.addheaders = value
+
+    def open(self, url: Any, *args: Any, **kwargs: Any) -> Any:
+        addheaders = self.br.addheaders
+        self.br.addheaders = [(k, v) for k, v in addheaders if k.lower() != "accept-encoding"] + [
+            ("Accept-Encoding", ACCEPT_ENCODING)
+        ]
+        try:
+            resp = self.br.open(url, *args, **kwargs)
+        finally:
+            self.br.addheaders = addheaders
+        return DecodedResponse(resp, self.stats)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.br, name)
+
+
+def compressing_opener(opener: Callable[..., Any], stats: TransferStats | None = None) -> Callable[..., Any]:
+    """Wrap a urlopen style callable to ask for compressed responses and decode them."""
+
+    def open_compressed(request: Any, *args: Any, **kwargs: Any) -> DecodedResponse:
+        if isinstance(request, str):
+            request = Request(request)
+        request.add_header("Accept-Encoding", ACCEPT_ENCODING)
+        return DecodedResponse(opener(request, *args, **kwargs), stats)
+
+    return open_compressed
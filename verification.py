@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing
+from http.client import RemoteDisconnected
+from typing import Any, Callable
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+
+__all__ = ("LinkVerifier",)
+
+# Status codes servers use to say they don't do HEAD
+HEAD_REJECTED = (403, 405, 501)
+
+
+class LinkVerifier:
+    """
+    Checks that download links serve an 'application' Content-Type, caching the verdicts.
+
+    Verdicts are cached per url and per host. A host that served files for one url is trusted for its
+    other urls until the TTL runs out, and hosts that reject HEAD go straight to a 1 byte range GET.
+    """
+
+    def __init__(self, ttl: float = 3600, workers: int = 4, opener: Callable[..., Any] = urlopen) -> None:
+        self.ttl = ttl
+        self.workers = workers
+        self.opener = opener
+        self._urls: dict[str, tuple[float, bool]] = {}
+        self._hosts: dict[str, tuple[float, bool]] = {}
+        self._no_head: dict[str, float] = {}
+        self._pending: dict[str, Future[bool | None]] = {}
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+
+    def verdict(self, url: str) -> bool | None:
+        # None means we don't know yet
+        now = time.time()
+        with self._lock:
+            cached = self._urls.get(url)
+            if cached and cached[0] > now:
+                return cached[1]
+            cached = self._hosts.get(self._host(url))
+            if cached and cached[0] > now and cached[1]:
+                return True
+        return None
+
+    def verify(self, url: str, timeout: float = 60) -> bool | None:
+        cached = self.verdict(url)
+        if cached is not None:
+            return cached
+
+        host = self._host(url)
+        try:
+            if self._no_head.get(host, 0) > time.time():
+                result = self._check_range(url, timeout)
+            else:
+                try:
+                    result = self._check_head(url, timeout)
+                except HTTPError as e:
+                    if e.code not in HEAD_REJECTED:
+                        raise
+                    with self._lock:
+                        self._no_head[host] = time.time() + self.ttl
+                    result = self._check_range(url, timeout)
+        except (HTTPError, URLError, TimeoutError, RemoteDisconnected, OSError):
+            # Not being able to check a link isn't a reason to hide it
+            return None
+
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._urls[url] = (expires, result)
+            self._hosts[host] = (expires, result)
+        return result
+
+    def submit(
+        self, url: str, timeout: float = 60, callback: Callable[[bool | None], None] | None = None
+    ) -> Future[bool | None]:
+        with self._lock:
+            future = self._pending.get(url)
+            if future is None:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="AnnasArchiveVerify")
+                future = self._executor.submit(self.verify, url, timeout)
+                self._pending[url] = future
+                future.add_done_callback(lambda _, url=url: self._finished(url))
+        if callback is not None:
+            future.add_done_callback(lambda f: callback(None if f.exception() else f.result()))
+        return future
+
+    def _finished(self, url: str) -> None:
+        with self._lock:
+            self._pending.pop(url, None)
+
+    def _check_head(self, url: str, timeout: float) -> bool:
+        with closing(self.opener(Request(url, method="HEAD"), timeout=timeout)) as resp:
+            return resp.info().get_content_maintype() == "application"
+
+    def _check_range(self, url: str, timeout: float) -> bool:
+        with closing(self.opener(Request(url, headers={"Range": "bytes=0-0"}), timeout=timeout)) as resp:
+            return resp.info().get_content_maintype() == "application"
+
+    @staticmethod
+    def _host(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
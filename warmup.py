@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+import socket
+import ssl
+import time
+from urllib.parse import urlsplit
+
+__all__ = ("preconnect",)
+
+
+def preconnect(url: str, timeout: float = 5) -> float:
+    """
+    Resolve the host of ``url``, connect to it and, for https, complete a TLS handshake.
+
+    Returns how long that took. Raises OSError (including ssl.SSLError and socket.gaierror)
+    if the host can't be reached. Nothing of the connection is kept, not even its TLS session.
+    """
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    https = parts.scheme == "https"
+    port = parts.port or (443 if https else 80)
+    start = time.monotonic()
+    # Fills the system's DNS cache if it has one, so the first search doesn't wait on DNS
+    address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0][4]
+    with socket.create_connection(address[:2], timeout=timeout) as sock:
+        if https:
+            with ssl.create_default_context().wrap_socket(sock, server_hostname=host):
+                pass
+    return time.monotonic() - start
@@ -1,4 +1,4 @@
 #!/bin/bash
 
 version=$(grep ' version' __init__.py | sed -E "s/^.*version.*= \(([0-9]+), ([0-9]+), ([0-9]+)\).*/\1.\2.\3/")
-zip "calibre_annas_archive-v${version}.zip" README.md plugin-import-name-store_annas_archive.txt __init__.py annas_archive.py config.py constants.py
+zip "calibre_annas_archive-v${version}.zip" README.md plugin-import-name-store_annas_archive.txt __init__.py annas_archive.py cancellation.py config.py constants.py discovery.py downloader.py events.py fanout.py httpcache.py identifiers.py library.py parsing.py prefetch.py profiling.py proxies.py ratelimit.py records.py resolvers.py resultcache.py sharedcache.py singleflight.py transfer.py verification.py warmup.py